@@ -0,0 +1,69 @@
+"""add lookup indexes
+
+Indexes are built CONCURRENTLY, so migration can be applied to live
+database without blocking writes; transaction.user_id lookups are already
+served by ix_transaction_user_id_seq. account.balance is deliberately not
+included into ix_account_user_id - it would prevent HOT updates of
+balances, which happen on every payment.
+
+Revision ID: cb429e57e647
+Revises: bb69879ab61d
+Create Date: 2026-10-18 06:38:17.093265
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "cb429e57e647"
+down_revision: Union[str, None] = "bb69879ab61d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = [
+    ("ix_account_user_id", "account", ["user_id"]),
+    ("ix_transaction_account_id", "transaction", ["account_id"]),
+]
+
+
+INVALID_INDEX = sa.text(
+    "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = indexrelid "
+    "WHERE relname = :name AND NOT indisvalid "
+    "AND pg_class.relnamespace = to_regnamespace(current_schema())"
+)
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            # failed concurrent build leaves INVALID index behind, which
+            # IF NOT EXISTS would keep instead of building usable one
+            if op.get_bind().scalar(INVALID_INDEX, {"name": name}):
+                op.drop_index(
+                    name, table_name=table, postgresql_concurrently=True
+                )
+            op.create_index(
+                name,
+                table,
+                columns,
+                unique=False,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(
+                name,
+                table_name=table,
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
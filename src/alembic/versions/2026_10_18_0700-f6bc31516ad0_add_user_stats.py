@@ -0,0 +1,246 @@
+"""add user stats
+
+Per-user aggregates (total balance, amount of accounts and transactions,
+time of last transaction) are maintained by statement-level triggers on
+"account" and "transaction" tables, so they are updated in the same
+transaction as every change of balances, whichever way it is made. Every
+triggering statement applies one aggregated update, locking affected rows
+in user id order. Triggers run at the end of statements, after rows of
+accounts were locked, so payments lock stats rows of their users before
+touching accounts (see app.webhook) to keep one lock order; this
+serializes payments to all accounts of one user.
+
+Revision ID: f6bc31516ad0
+Revises: cb429e57e647
+Create Date: 2026-10-18 07:00:41.562306
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f6bc31516ad0"
+down_revision: Union[str, None] = "cb429e57e647"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+APPLY_FUNCTION = """
+CREATE FUNCTION user_stats_apply(
+    changed_users integer[],
+    balance_deltas numeric[],
+    account_deltas integer[],
+    transaction_deltas integer[]
+) RETURNS void LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM 1 FROM user_stats
+    WHERE user_id = ANY(changed_users)
+    ORDER BY user_id
+    FOR UPDATE;
+
+    UPDATE user_stats AS s SET
+        total_balance = s.total_balance + d.balance,
+        account_count = s.account_count + d.accounts,
+        transaction_count = s.transaction_count + d.transactions,
+        last_transaction_at = CASE
+            WHEN d.transactions > 0 THEN now()
+            ELSE s.last_transaction_at
+        END
+    FROM (
+        SELECT
+            c.user_id,
+            sum(c.balance) AS balance,
+            sum(c.accounts) AS accounts,
+            sum(c.transactions) AS transactions
+        FROM unnest(
+            changed_users, balance_deltas, account_deltas, transaction_deltas
+        ) AS c(user_id, balance, accounts, transactions)
+        GROUP BY c.user_id
+    ) AS d
+    WHERE s.user_id = d.user_id;
+END
+$$;
+"""
+
+USER_FUNCTION = """
+CREATE FUNCTION user_stats_user_inserted() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO user_stats (user_id) SELECT id FROM new_rows;
+    RETURN NULL;
+END
+$$;
+"""
+
+ACCOUNT_FUNCTION = """
+CREATE FUNCTION user_stats_account_changed() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM user_stats_apply(
+            array_agg(user_id), array_agg(balance),
+            array_agg(1), array_agg(0)
+        ) FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM user_stats_apply(
+            array_agg(user_id), array_agg(-balance),
+            array_agg(-1), array_agg(0)
+        ) FROM old_rows;
+    ELSE
+        PERFORM user_stats_apply(
+            array_agg(user_id), array_agg(balance),
+            array_agg(accounts), array_agg(0)
+        ) FROM (
+            SELECT user_id, balance, 1 AS accounts FROM new_rows
+            UNION ALL
+            SELECT user_id, -balance, -1 FROM old_rows
+        ) AS c;
+    END IF;
+    RETURN NULL;
+END
+$$;
+"""
+
+TRANSACTION_FUNCTION = """
+CREATE FUNCTION user_stats_transaction_changed() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM user_stats_apply(
+            array_agg(user_id), array_agg(0::numeric),
+            array_agg(0), array_agg(1)
+        ) FROM new_rows;
+    ELSE
+        PERFORM user_stats_apply(
+            array_agg(user_id), array_agg(0::numeric),
+            array_agg(0), array_agg(-1)
+        ) FROM old_rows;
+    END IF;
+    RETURN NULL;
+END
+$$;
+"""
+
+# (trigger name, table, event, transition tables, function);
+# transition tables can't be shared by triggers of several events
+TRIGGERS = [
+    (
+        "user_stats_user_insert",
+        '"user"',
+        "INSERT",
+        "NEW TABLE AS new_rows",
+        "user_stats_user_inserted",
+    ),
+    (
+        "user_stats_account_insert",
+        "account",
+        "INSERT",
+        "NEW TABLE AS new_rows",
+        "user_stats_account_changed",
+    ),
+    (
+        "user_stats_account_update",
+        "account",
+        "UPDATE",
+        "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+        "user_stats_account_changed",
+    ),
+    (
+        "user_stats_account_delete",
+        "account",
+        "DELETE",
+        "OLD TABLE AS old_rows",
+        "user_stats_account_changed",
+    ),
+    (
+        "user_stats_transaction_insert",
+        '"transaction"',
+        "INSERT",
+        "NEW TABLE AS new_rows",
+        "user_stats_transaction_changed",
+    ),
+    (
+        "user_stats_transaction_delete",
+        '"transaction"',
+        "DELETE",
+        "OLD TABLE AS old_rows",
+        "user_stats_transaction_changed",
+    ),
+]
+
+FUNCTIONS = [
+    "user_stats_user_inserted()",
+    "user_stats_account_changed()",
+    "user_stats_transaction_changed()",
+    "user_stats_apply(integer[], numeric[], integer[], integer[])",
+]
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_stats",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "total_balance",
+            sa.Numeric(precision=14, scale=2),
+            server_default="0",
+            nullable=False,
+        ),
+        sa.Column(
+            "account_count", sa.Integer(), server_default="0", nullable=False
+        ),
+        sa.Column(
+            "transaction_count",
+            sa.BigInteger(),
+            server_default="0",
+            nullable=False,
+        ),
+        sa.Column(
+            "last_transaction_at", sa.DateTime(timezone=True), nullable=True
+        ),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+    for function in (
+        APPLY_FUNCTION,
+        USER_FUNCTION,
+        ACCOUNT_FUNCTION,
+        TRANSACTION_FUNCTION,
+    ):
+        op.execute(function)
+    # triggers lock their tables until migration commits,
+    # so no change can slip between them and the backfill
+    for name, table, event, referencing, function in TRIGGERS:
+        op.execute(
+            f"CREATE TRIGGER {name} AFTER {event} ON {table} "
+            f"REFERENCING {referencing} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION {function}()"
+        )
+    op.execute(
+        """
+        INSERT INTO user_stats (
+            user_id, total_balance, account_count, transaction_count
+        )
+        SELECT
+            u.id,
+            coalesce(
+                (SELECT sum(a.balance) FROM account a WHERE a.user_id = u.id),
+                0
+            ),
+            (SELECT count(*) FROM account a WHERE a.user_id = u.id),
+            (SELECT count(*) FROM "transaction" t WHERE t.user_id = u.id)
+        FROM "user" u
+        """
+    )
+
+
+def downgrade() -> None:
+    for name, table, _, _, _ in reversed(TRIGGERS):
+        op.execute(f"DROP TRIGGER {name} ON {table}")
+    for function in FUNCTIONS:
+        op.execute(f"DROP FUNCTION {function}")
+    op.drop_table("user_stats")
@@ -1,15 +1,31 @@
 from http import HTTPStatus
 
 from app.auth import admin_only
-from app.utils import retry_decorator, validate_user_data
-
-from database.models import Account, User
+from app.schemas import UserData, validate_body
+from app.tokens import revoke_user_tokens
+from app.utils import (
+    all_users,
+    conditional,
+    hasher_busy_response,
+    mark_written,
+    read_connection,
+    retry_decorator,
+    stream_ndjson,
+    wants_ndjson,
+)
+
+import config
+
+from database import queries
+from database.hashing import HasherBusyError
+from database.models import User
+from database.statements import USER_BY_EMAIL, USER_BY_ID
 
 from sanic import Blueprint, json
 from sanic.views import HTTPMethodView
 
 import sqlalchemy.exc
-from sqlalchemy import false, insert, select, update
+from sqlalchemy import insert, update
 
 admin_bp = Blueprint("admin", url_prefix="/admin")
 
@@ -17,39 +33,31 @@ admin_bp = Blueprint("admin", url_prefix="/admin")
 @admin_bp.post("/create-user", name="create_user")
 @admin_only
 @retry_decorator
-@validate_user_data
-async def create_user(request):
+@validate_body(UserData)
+async def create_user(request, user_data: UserData):
     """
     Accepts user credentials; on valid returns json with created user's data
     """
-    user_data = request.json
-    keys = user_data.keys()
-    if "is_admin" not in keys:
-        user_data["is_admin"] = False
-    if "full_name" not in keys:
-        user_data["full_name"] = None
-    else:
-        user_data["full_name"] = user_data["full_name"].strip()
-    user_data["is_admin"] = str(user_data["is_admin"]).lower() in [
-        "true",
-        "1",
-        "yes",
-        "y",
-    ]
+    try:
+        password = await User.hash_password_async(user_data.password)
+    except HasherBusyError:
+        return hasher_busy_response()
 
     try:
         async with request.app.ctx.session() as session:
             await session.execute(
                 insert(User).values(
-                    email=user_data["email"],
-                    full_name=user_data["full_name"],
-                    is_admin=user_data["is_admin"],
-                    password=User.hash_password(user_data["password"]),
+                    email=user_data.email,
+                    full_name=user_data.full_name or None,
+                    is_admin=user_data.is_admin or False,
+                    password=password,
                 )
             )
             await session.commit()
+            request.app.ctx.user_cache.invalidate(user_data.email)
+            mark_written(request)
             user = await session.scalar(
-                select(User).where(User.email == user_data["email"])
+                USER_BY_EMAIL, {"email": user_data.email}
             )
             return json(user.serialize(), status=HTTPStatus.CREATED)
     except sqlalchemy.exc.IntegrityError as e:
@@ -61,29 +69,34 @@ async def create_user(request):
 
 @admin_bp.get("/users", name="user_list")
 @admin_only
+@conditional(all_users)
 async def get_user_list(request):
-    async with request.app.ctx.session() as session:
-        users = await session.scalars(
-            select(User).order_by(User.is_admin, User.id)
-        )
-    response_data = []
-    for user in users:
-        response_data.append(user.serialize())
+    """Returns JSON array of users with their stats; streams them as NDJSON
+    if client accepts application/x-ndjson"""
+    if wants_ndjson(request):
+        async with read_connection(request, all_users(request)) as conn:
+            rows = await conn.stream(
+                queries.USERS_QUERY.execution_options(
+                    yield_per=config.STREAM_CHUNK_SIZE
+                )
+            )
+            await stream_ndjson(request, queries.user_rows(rows))
+        return
 
-    return json(response_data, status=HTTPStatus.OK)
+    async with read_connection(request, all_users(request)) as conn:
+        rows = await conn.execute(queries.USERS_QUERY)
+    return json(
+        [queries.user_row(row) for row in rows], status=HTTPStatus.OK
+    )
 
 
 @admin_bp.get("/user-accounts/<id:int>", name="user_accounts")
 @admin_only
+@conditional(lambda request, id: id)
 async def get_user_accounts(request, id: int):
-    async with request.app.ctx.session() as session:
-        accounts = await session.scalars(
-            select(Account).where(Account.user_id == id)
-        )
-    data = []
-    for acc in accounts:
-        data.append(acc.serialize())
-    return json(data, HTTPStatus.OK)
+    async with read_connection(request, id) as conn:
+        accounts = await queries.user_accounts(conn, id)
+    return json(accounts, HTTPStatus.OK)
 
 
 class UserManipulationView(HTTPMethodView):
@@ -92,7 +105,7 @@ class UserManipulationView(HTTPMethodView):
     @staticmethod
     async def delete(request, id: int):
         async with request.app.ctx.session() as session:
-            user = await session.scalar(select(User).where(User.id == id))
+            user = await session.scalar(USER_BY_ID, {"id": id})
             if user is None:
                 return json(
                     {"error": "user with given id doesn't exist"},
@@ -100,29 +113,22 @@ class UserManipulationView(HTTPMethodView):
                 )
             await session.delete(user)
             await session.commit()
+            request.app.ctx.user_cache.invalidate(user.email)
+            mark_written(request, id)
             return json(user.serialize(), HTTPStatus.OK)
 
     @staticmethod
-    @validate_user_data
-    async def put(request, id: int):
+    @validate_body(UserData)
+    async def put(request, data: UserData, id: int):
         """Accepts update credentials,
         returns updated user data on valid input"""
-        data = request.json
-        keys = data.keys()
-        checkup_fields = {"password", "full_name", "email", "is_admin"}
-        if not any([field in keys for field in checkup_fields]):
-            return json(
-                {"error": "no update credentials were provided"},
-                status=HTTPStatus.BAD_REQUEST,
-            )
-        update_data = dict()
-        for field in keys:
-            if field in checkup_fields:
-                update_data[field] = data[field]
-        if "password" in keys:
-            update_data["password"] = User.hash_password(
-                update_data["password"]
+        update_data = data.fields()
+        try:
+            update_data["password"] = await User.hash_password_async(
+                data.password
             )
+        except HasherBusyError:
+            return hasher_busy_response()
 
         async with request.app.ctx.session() as session:
             async with session.begin():
@@ -132,43 +138,46 @@ class UserManipulationView(HTTPMethodView):
                         {"error": "user with given id doesn't exist"},
                         HTTPStatus.BAD_REQUEST,
                     )
+                # the update refreshes `user`, so its email is new after it
+                old_email = user.email
 
                 st = update(User).where(User.id == id).values(**update_data)
                 await session.execute(st)
-                return json(user.serialize(), HTTPStatus.OK)
+                # credentials were reset, sessions must log in again
+                await revoke_user_tokens(session, id)
+                response_data = user.serialize()
+
+        request.app.ctx.user_cache.invalidate(
+            old_email, response_data["email"]
+        )
+        mark_written(request, id)
+        return json(response_data, HTTPStatus.OK)
 
 
 @admin_bp.get("/users-with-accounts", name="users_accounts_info")
 @admin_only
+@conditional(all_users)
 async def get_users_info(request):
-    query = (
-        select(User, Account)
-        .join(User.accounts, isouter=True)
-        .where(User.is_admin == false())
-        .order_by(User.id, Account.id)
+    """Returns JSON array of non-admin users with their accounts;
+    streams them as NDJSON if client accepts application/x-ndjson"""
+    query = queries.USERS_ACCOUNTS_QUERY.execution_options(
+        yield_per=config.STREAM_CHUNK_SIZE
     )
-    data = []
-    async with request.app.ctx.session() as session:
-        results = await session.execute(query)
-        results = results.all()
-        prev_row = results[0]
-        account_list = []
-        for row in results:
-            prev_user = prev_row.User
-            if row.User == prev_user:
-                account_list.append(row.Account.serialize())
-            else:
-                user_info = prev_user.serialize()
-                user_info["accounts"] = account_list
-                data.append(user_info)
-                account_list = []
-                if row.Account is not None:
-                    account_list.append(row.Account.serialize())
-            prev_row = row
-        user_info = prev_row.User.serialize()
-        user_info["accounts"] = account_list
-        data.append(user_info)
-        return json(data, HTTPStatus.OK)
+    async with read_connection(request, all_users(request)) as conn:
+        rows = queries.users_with_accounts(await conn.stream(query))
+        if wants_ndjson(request):
+            await stream_ndjson(request, rows)
+            return
+        data = [user async for user in rows]
+    return json(data, HTTPStatus.OK)
+
+
+@admin_bp.get("/user-cache", name="user_cache_stats")
+@admin_only
+async def get_user_cache_stats(request):
+    """Returns authenticated users cache counters of the worker
+    which handled the request"""
+    return json(request.app.ctx.user_cache.stats(), HTTPStatus.OK)
 
 
 admin_bp.add_route(UserManipulationView.as_view(), "/user/<id:int>/")
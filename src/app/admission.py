@@ -0,0 +1,239 @@
+"""Admission control of database work: every session or read connection
+takes a slot of worker's adaptive concurrency limit, and requests which
+find no free slot within a short wait fail with 503 instead of piling up
+on the pool while the database is slow"""
+
+import asyncio
+import contextlib
+import contextvars
+import math
+import time
+from typing import AsyncIterator, Final, Optional
+
+import config
+
+import metrics
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+
+# share of the limit requests of blueprint may occupy, the rest of it is
+# kept for blueprints of higher priority; work outside of requests (inbox
+# consumer, startup) may occupy the whole limit
+BLUEPRINT_SHARES: Final = {
+    "webhook": 1.0,
+    "auth": 0.8,
+    "main": 0.8,
+    "admin": 0.5,
+}
+DEFAULT_SHARE: Final = 0.8
+
+current_blueprint: contextvars.ContextVar[Optional[str]] = (
+    contextvars.ContextVar("current_blueprint", default=None)
+)
+
+
+class Overloaded(Exception):
+    """Raised when database work can't be admitted"""
+
+    def __init__(self, retry_after: int = config.ADMISSION_RETRY_AFTER):
+        super().__init__("database is overloaded")
+        self.retry_after = retry_after
+
+
+def blueprint_of(request) -> Optional[str]:
+    # names of blueprints' routes are "<app>.<blueprint>.<route>"
+    if request.route is None:
+        return None
+    parts = request.route.name.split(".")
+    return parts[1] if len(parts) > 2 else None
+
+
+def idle_clock() -> float:
+    """Time the worker's thread spent off CPU; stands still while the
+    event loop is busy, e.g. with other requests or inline hashing"""
+    return time.perf_counter() - time.thread_time()
+
+
+class AdaptiveLimiter:
+    """Concurrency limit following execution time of queries (gradient
+    algorithm); slots are held by sessions and connections, but only time
+    their queries spent waiting for the database is sampled (see
+    sample_queries), so that work of the event loop doesn't pass for a
+    slow database. Smoothed recent latency is compared with the baseline -
+    average latency of queries run while at most half of the limit was in
+    use, i.e. without queueing in the database. Saturated slowdown doesn't
+    move the baseline, so the limit stays down as long as it lasts; only if
+    no unloaded query was seen for `baseline_window` seconds, recent
+    latency is taken as the new baseline. Baselines under `min_baseline`
+    are taken as that, as a few queued queries make such latency grow
+    manifold while the database is fine.
+    While recent latency stays within `tolerance` of the baseline and the
+    limit is used up, the limit grows by about its square root per sample;
+    as latency grows over that, the limit shrinks proportionally, down to
+    `min_limit`. The limit never grows while less than half of it is used.
+    Work finding no free slot waits up to `max_wait` seconds of idle_clock
+    for one, so that a blocked event loop doesn't run waits out"""
+
+    def __init__(
+        self,
+        initial_limit: float = config.ADMISSION_INITIAL_LIMIT,
+        min_limit: float = config.ADMISSION_MIN_LIMIT,
+        max_limit: float = config.ADMISSION_MAX_LIMIT,
+        tolerance: float = config.ADMISSION_TOLERANCE,
+        max_wait: float = config.ADMISSION_MAX_WAIT,
+        smoothing: float = 0.2,
+        baseline_smoothing: float = 0.02,
+        baseline_window: float = 300.0,
+        min_baseline: float = 0.01,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.max_wait = max_wait
+        self.smoothing = smoothing
+        self.baseline_smoothing = baseline_smoothing
+        self.baseline_window = baseline_window
+        self.min_baseline = min_baseline
+        self.in_flight = 0
+        self.rejected = 0
+        self.latency: Optional[float] = None
+        self.baseline: Optional[float] = None
+        self._baseline_updated = 0.0
+        # replaced on every release, so that waiters are woken once
+        self._released = asyncio.Event()
+        metrics.ADMISSION_LIMIT.set(self.limit)
+
+    def try_acquire(self, share: float = 1.0) -> bool:
+        if self.in_flight >= max(self.limit * share, 1):
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        released, self._released = self._released, asyncio.Event()
+        released.set()
+
+    def observe(self, latency: float, in_flight: int) -> None:
+        """Samples execution time of a query; in_flight - amount of work
+        holding slots while it ran"""
+        latency = max(latency, 1e-6)
+        now = time.monotonic()
+        if self.latency is None:
+            self.latency = self.baseline = latency
+            self._baseline_updated = now
+        else:
+            self.latency += (latency - self.latency) * self.smoothing
+        if in_flight <= self.limit / 2:
+            self.baseline += self.baseline_smoothing * (
+                latency - self.baseline
+            )
+            self._baseline_updated = now
+        elif now - self._baseline_updated >= self.baseline_window:
+            # saturated for so long that it is the new normal
+            self.baseline = self.latency
+            self._baseline_updated = now
+
+        baseline = max(self.baseline, self.min_baseline)
+        gradient = max(
+            0.5, min(1.0, self.tolerance * baseline / self.latency)
+        )
+        # queue of about square root of the limit is allowed only while
+        # latency is fine, so that it can't hold the limit above minimum
+        queue = math.sqrt(self.limit) if gradient == 1.0 else 0.0
+        new_limit = self.limit * gradient + queue
+        if new_limit > self.limit and in_flight < self.limit / 2:
+            # limit is not what restrains throughput
+            return
+        self.limit = min(
+            self.max_limit,
+            max(
+                self.min_limit,
+                self.limit * (1 - self.smoothing) + new_limit * self.smoothing,
+            ),
+        )
+        metrics.ADMISSION_LIMIT.set(self.limit)
+
+    async def acquire(self, share: float = 1.0) -> bool:
+        """Takes a slot, waiting up to max_wait for one to be released"""
+        if self.try_acquire(share):
+            return True
+        deadline = idle_clock() + self.max_wait
+        while (timeout := deadline - idle_clock()) > 0:
+            try:
+                await asyncio.wait_for(self._released.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            if self.try_acquire(share):
+                return True
+        return False
+
+    @contextlib.asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """Holds a slot for the enclosed database work of the current
+        request's blueprint; raises Overloaded if there is none"""
+        blueprint = current_blueprint.get()
+        share = (
+            BLUEPRINT_SHARES.get(blueprint, DEFAULT_SHARE)
+            if blueprint is not None
+            else 1.0
+        )
+        if not await self.acquire(share):
+            self.rejected += 1
+            metrics.ADMISSION_REJECTED.labels(blueprint or "none").inc()
+            raise Overloaded()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def sample_queries(self, engine) -> None:
+        """Feeds execution time of given AsyncEngine's queries to the
+        limiter. While a query waits for the database, the event loop runs
+        other requests, so its latency is taken by idle_clock; queries the
+        event loop was busy for most of the time are not sampled at all"""
+        sync_engine = engine.sync_engine
+
+        @event.listens_for(sync_engine, "before_cursor_execute")
+        def before_execute(conn, cursor, statement, params, context, many):
+            conn.info.setdefault("admission_started_at", []).append(
+                (time.perf_counter(), time.thread_time(), self.in_flight)
+            )
+
+        @event.listens_for(sync_engine, "after_cursor_execute")
+        def after_execute(conn, cursor, statement, params, context, many):
+            started, cpu_started, in_flight = conn.info[
+                "admission_started_at"
+            ].pop()
+            elapsed = time.perf_counter() - started
+            busy = time.thread_time() - cpu_started
+            if busy < elapsed / 2:
+                self.observe(elapsed - busy, max(in_flight, self.in_flight))
+
+        @event.listens_for(sync_engine, "handle_error")
+        def on_error(context):
+            started = context.connection and context.connection.info.get(
+                "admission_started_at"
+            )
+            if started:
+                started.pop()
+
+
+class AdmittedSessions:
+    """Session factory admitting every session through the limiter;
+    used the same way as async_sessionmaker: `async with factory() as s`"""
+
+    def __init__(
+        self, sessions: async_sessionmaker, limiter: AdaptiveLimiter
+    ):
+        self.sessions = sessions
+        self.limiter = limiter
+
+    @contextlib.asynccontextmanager
+    async def __call__(self) -> AsyncIterator[AsyncSession]:
+        async with self.limiter.admit():
+            async with self.sessions() as session:
+                yield session
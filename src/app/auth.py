@@ -3,31 +3,16 @@ from http import HTTPStatus
 
 from app.utils import fetch_user_from_request
 
-import jwt
-
 from sanic import json
 
 
-def check_token(request):
-    if not request.token:
-        return False
-    try:
-        jwt.decode(
-            request.token, request.app.config.SECRET, algorithms=["HS256"]
-        )
-    except jwt.exceptions.InvalidTokenError:
-        return False
-    else:
-        return True
-
-
 def protected(wrapped):
     def decorator(f):
         @wraps(f)
         async def decorated_function(request, *args, **kwargs):
-            is_authenticated = check_token(request)
+            user = await fetch_user_from_request(request)
 
-            if is_authenticated:
+            if user is not None:
                 response = await f(request, *args, **kwargs)
                 return response
             else:
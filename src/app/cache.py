@@ -0,0 +1,167 @@
+import secrets
+import time
+import zlib
+from collections import OrderedDict
+from multiprocessing import Array, Value
+from typing import Any, Dict, Final, Iterable, Optional
+from uuid import UUID
+
+import config
+
+import metrics
+
+
+class SharedVersions:
+    """Striped version counters living in shared memory, allowing workers
+    to tell each other that data stored under some key has changed.
+    Keys are spread over fixed amount of stripes, so bumping one key
+    may also invalidate few unrelated ones - never the other way round"""
+
+    def __init__(self, array):
+        self._array = array
+        self._values = array.get_obj()
+        self._stripes = len(self._values)
+
+    @staticmethod
+    def allocate(stripes: int = 4096):
+        return Array("Q", stripes)
+
+    def _stripe(self, key: str) -> int:
+        # builtin hash() is salted per process, so it can't be used here
+        return zlib.crc32(key.encode("utf-8")) % self._stripes
+
+    def get(self, key: str) -> int:
+        return self._values[self._stripe(key)]
+
+    def bump(self, key: str) -> None:
+        stripe = self._stripe(key)
+        with self._array.get_lock():
+            self._values[stripe] += 1
+
+
+class DataVersions:
+    """Versions of users' data served by GET endpoints, which make their
+    ETags. Any change of user's data bumps version of the user and version
+    of all users' data (ALL - admin listings). ETags also carry random epoch
+    chosen at startup, so that ones issued before restart never match"""
+
+    ALL: Final = "*"
+
+    def __init__(self, versions: SharedVersions, epoch):
+        self._versions = versions
+        self._epoch = epoch.value
+
+    @staticmethod
+    def allocate_epoch():
+        return Value("Q", secrets.randbits(32), lock=False)
+
+    def bump(self, *user_ids: int) -> None:
+        """Call after changes of users' data are committed"""
+        for user_id in user_ids:
+            self._versions.bump(str(user_id))
+        self._versions.bump(self.ALL)
+
+    def etag(self, key) -> str:
+        """Must be taken before querying the data, so that change committed
+        during the query makes served ETag stale right away"""
+        return f'"{self._epoch:x}-{self._versions.get(str(key)):x}"'
+
+
+class UserCache:
+    """Bounded LRU cache of authenticated users, keyed by JWT subject.
+    Entries expire after TTL and whenever user's version is bumped
+    (by any worker) through shared versions"""
+
+    def __init__(
+        self,
+        versions: SharedVersions,
+        max_size: int = config.USER_CACHE_SIZE,
+        ttl: float = config.USER_CACHE_TTL,
+    ):
+        self._versions = versions
+        self._entries = OrderedDict()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def version(self, key: str) -> int:
+        """Must be taken before querying the user, so that update committed
+        during the query makes stored entry stale right away"""
+        return self._versions.get(key)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        user, version, expires_at = entry
+        if expires_at < time.monotonic() or version != self.version(key):
+            del self._entries[key]
+            self.invalidations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return user
+
+    def set(self, key: str, user: Any, version: int) -> None:
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (user, version, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *keys: str) -> None:
+        """Drops users from caches of all workers;
+        call only after changes are committed"""
+        for key in keys:
+            self._entries.pop(key, None)
+            self._versions.bump(key)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class SeenTransactions:
+    """Bounded LRU set of ids of transactions known to be committed.
+    Transactions are never deleted, so membership proves that payment is
+    a duplicate; absence proves nothing and must be checked in database"""
+
+    def __init__(self, max_size: int = config.WEBHOOK_SEEN_CACHE_SIZE):
+        self._ids = OrderedDict()
+        self.max_size = max_size
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def seen(self, transaction_id: UUID) -> bool:
+        if transaction_id in self._ids:
+            self._ids.move_to_end(transaction_id)
+            metrics.WEBHOOK_SEEN_LOOKUPS.labels("hit").inc()
+            return True
+        metrics.WEBHOOK_SEEN_LOOKUPS.labels("miss").inc()
+        return False
+
+    def add(self, transaction_ids: Iterable[UUID]) -> None:
+        """Call only after transactions are committed"""
+        if self.max_size <= 0:
+            return
+        for transaction_id in transaction_ids:
+            self._ids[transaction_id] = None
+            self._ids.move_to_end(transaction_id)
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
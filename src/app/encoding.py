@@ -0,0 +1,51 @@
+from typing import Any
+from uuid import UUID
+
+import config
+
+import msgspec
+
+from sqlalchemy import Row
+
+import ujson
+
+
+def encode_default(obj: Any) -> Any:
+    """Converts objects JSON encoders don't know natively: models (by their
+    `serialize`), result rows (into dicts of their columns) and, for
+    encoders other than msgspec, Structs"""
+    if isinstance(obj, msgspec.Struct):
+        return msgspec.structs.asdict(obj)
+    serialize = getattr(obj, "serialize", None)
+    if serialize is not None:
+        return serialize()
+    if isinstance(obj, Row):
+        return obj._asdict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON")
+
+
+_encoder = msgspec.json.Encoder(
+    enc_hook=encode_default, decimal_format="number"
+)
+
+
+def msgspec_dumps(obj: Any, **kwargs) -> bytes:
+    return _encoder.encode(obj)
+
+
+def _ujson_default(obj: Any) -> Any:
+    if isinstance(obj, UUID):
+        return str(obj)
+    return encode_default(obj)
+
+
+def ujson_dumps(obj: Any, **kwargs) -> str:
+    return ujson.dumps(
+        obj, escape_forward_slashes=False, default=_ujson_default, **kwargs
+    )
+
+
+ENCODERS = {"msgspec": msgspec_dumps, "ujson": ujson_dumps}
+
+# used for all JSON responses, see create_app
+dumps = ENCODERS[config.JSON_ENCODER]
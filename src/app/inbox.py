@@ -0,0 +1,165 @@
+import asyncio
+import datetime
+import time
+from typing import Dict
+from uuid import UUID
+
+from app.utils import data_changed
+from app.webhook import Payment, apply_payments
+
+import config
+
+from database.models import WebhookInbox
+
+import metrics
+
+from sanic.log import error_logger
+
+from sqlalchemy import (
+    ARRAY,
+    Interval,
+    String,
+    bindparam,
+    delete,
+    func,
+    select,
+    update,
+)
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+
+
+QUEUED_PAYMENTS = (
+    select(WebhookInbox)
+    .where(WebhookInbox.status == "queued")
+    .order_by(WebhookInbox.received_at)
+    .limit(bindparam("limit"))
+    .with_for_update(skip_locked=True)
+)
+
+_outcomes = (
+    func.unnest(
+        bindparam("transaction_ids", type_=ARRAY(PG_UUID(as_uuid=True))),
+        bindparam("statuses", type_=ARRAY(String)),
+    )
+    .table_valued("transaction_id", "status")
+    .render_derived("outcomes")
+)
+RECORD_OUTCOMES = (
+    update(WebhookInbox)
+    .where(WebhookInbox.transaction_id == _outcomes.c.transaction_id)
+    .values(status=_outcomes.c.status, processed_at=func.now())
+    .execution_options(synchronize_session=False)
+)
+
+QUEUE_DEPTH = select(func.count()).where(WebhookInbox.status == "queued")
+
+PURGE_PROCESSED = delete(WebhookInbox).where(
+    WebhookInbox.status != "queued",
+    WebhookInbox.processed_at
+    < func.now() - bindparam("retention", type_=Interval),
+)
+
+
+class InboxConsumer:
+    """Applies payments queued in the inbox table in batches - every batch
+    within a single DB transaction. Consumers of all workers drain the same
+    table concurrently, skipping rows locked by each other"""
+
+    def __init__(
+        self,
+        batch_size: int = config.WEBHOOK_QUEUE_BATCH_SIZE,
+        linger: float = config.WEBHOOK_QUEUE_LINGER,
+        poll_interval: float = config.WEBHOOK_QUEUE_POLL_INTERVAL,
+    ):
+        self.batch_size = batch_size
+        self.linger = linger
+        self.poll_interval = poll_interval
+        # amount of queued payments as of the last drained batch
+        self.depth = 0
+        self._wakeup = asyncio.Event()
+        self._purged_at = time.monotonic()
+
+    def notify(self) -> None:
+        """Wakes consumer up after payment is queued by this worker"""
+        self._wakeup.set()
+
+    async def drain(self, app) -> Dict[UUID, str]:
+        """Applies one batch of queued payments; returns their statuses"""
+        async with app.ctx.session() as session:
+            async with session.begin():
+                rows = await session.scalars(
+                    QUEUED_PAYMENTS, {"limit": self.batch_size}
+                )
+                payments = [
+                    Payment(
+                        row.transaction_id,
+                        row.user_id,
+                        row.account_id,
+                        row.amount,
+                    )
+                    for row in rows
+                ]
+                statuses = dict()
+                if payments:
+                    statuses = await apply_payments(session, payments)
+                    await session.execute(
+                        RECORD_OUTCOMES,
+                        {
+                            "transaction_ids": list(statuses.keys()),
+                            "statuses": list(statuses.values()),
+                        },
+                    )
+            self.depth = await session.scalar(QUEUE_DEPTH)
+        metrics.WEBHOOK_INBOX_DEPTH.set(self.depth)
+
+        app.ctx.seen_transactions.add(
+            transaction_id
+            for transaction_id, status in statuses.items()
+            if status != "invalid user id"
+        )
+        data_changed(
+            app,
+            *{
+                p.user_id
+                for p in payments
+                if statuses[p.transaction_id] == "accepted"
+            }
+        )
+        for status in statuses.values():
+            metrics.WEBHOOK_PAYMENTS.labels(status).inc()
+        return statuses
+
+    async def purge(self, app) -> None:
+        """Deletes processed payments older than retention period"""
+        retention = datetime.timedelta(seconds=config.WEBHOOK_INBOX_RETENTION)
+        async with app.ctx.session() as session:
+            await session.execute(PURGE_PROCESSED, {"retention": retention})
+            await session.commit()
+        self._purged_at = time.monotonic()
+
+    async def run(self, app) -> None:
+        while True:
+            # payments queued from now on must not wait for poll interval
+            self._wakeup.clear()
+            try:
+                processed = len(await self.drain(app))
+                if time.monotonic() - self._purged_at > 60:
+                    await self.purge(app)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error_logger.error(f"Error on draining webhook inbox: {e}")
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            if processed >= self.batch_size:
+                continue
+            if self.depth == 0:
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), self.poll_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            # let more payments arrive, so that they are committed together
+            await asyncio.sleep(self.linger)
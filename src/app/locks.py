@@ -0,0 +1,70 @@
+import asyncio
+import contextlib
+import time
+from typing import Any, Awaitable, Callable, Hashable, List, TypeVar
+
+import config
+
+import metrics
+
+T = TypeVar("T")
+
+
+class StripedCombiner:
+    """Serializes work on the same key (e.g. account id) within a worker
+    using fixed set of asyncio locks; keys are spread over the locks, so two
+    keys may share one - never the same key two locks.
+
+    Items submitted while their stripe is busy are queued, and whoever gets
+    the stripe next processes all queued items of the stripe with a single
+    call, so waiting for a hot key turns into batching instead of queueing.
+    Zero stripes disable locking"""
+
+    def __init__(self, stripes: int = config.ACCOUNT_LOCK_STRIPES):
+        self._stripes = [(asyncio.Lock(), []) for _ in range(stripes)]
+
+    async def submit(
+        self,
+        key: Hashable,
+        item: T,
+        process: Callable[[List[T]], Awaitable[List[Any]]],
+    ) -> Any:
+        """Returns result of processing the item; `process` gets list of
+        items and must return list of their results in the same order"""
+        if not self._stripes:
+            return (await process([item]))[0]
+
+        lock, queue = self._stripes[hash(key) % len(self._stripes)]
+        entry = (item, asyncio.get_running_loop().create_future())
+        queue.append(entry)
+        started = time.perf_counter()
+        try:
+            await lock.acquire()
+        except asyncio.CancelledError:
+            with contextlib.suppress(ValueError):
+                queue.remove(entry)
+            raise
+        try:
+            metrics.ACCOUNT_LOCK_WAIT.observe(time.perf_counter() - started)
+            if not entry[1].done():
+                await self._process(queue, entry, process)
+        finally:
+            lock.release()
+        return entry[1].result()
+
+    @staticmethod
+    async def _process(queue, own_entry, process) -> None:
+        batch = queue[:]
+        queue.clear()
+        try:
+            results = await process([item for item, _ in batch])
+        except asyncio.CancelledError:
+            # nothing was applied; leave others' items to the next holder
+            queue[:0] = [entry for entry in batch if entry is not own_entry]
+            raise
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
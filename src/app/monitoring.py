@@ -0,0 +1,21 @@
+import metrics
+
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from sanic import Blueprint, raw
+
+monitoring = Blueprint("monitoring")
+
+
+async def metrics_request_middleware(request):
+    metrics.request_started(request)
+
+
+async def metrics_response_middleware(request, response):
+    metrics.request_finished(request, response)
+
+
+@monitoring.get("/metrics", name="metrics")
+async def get_metrics(request):
+    """Exposes metrics of all workers in Prometheus text format"""
+    return raw(metrics.render(), content_type=CONTENT_TYPE_LATEST)
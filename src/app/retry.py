@@ -0,0 +1,106 @@
+import asyncio
+import random
+import time
+from typing import Optional
+
+import config
+
+import metrics
+
+from sanic.log import error_logger
+
+import sqlalchemy.exc
+
+# serialization_failure, deadlock_detected, admin_shutdown,
+# crash_shutdown, cannot_connect_now
+TRANSIENT_SQLSTATES = {"40001", "40P01", "57P01", "57P02", "57P03"}
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Tells whether operation failed with error may succeed if repeated
+    as is: serialization failures, deadlocks and lost connections"""
+    if isinstance(error, sqlalchemy.exc.DBAPIError):
+        if error.connection_invalidated:
+            return True
+        sqlstate = getattr(error.orig, "sqlstate", None) or ""
+        # class 08 - connection exceptions
+        return sqlstate in TRANSIENT_SQLSTATES or sqlstate.startswith("08")
+    # e.g. refused connection while database restarts
+    return isinstance(error, ConnectionError)
+
+
+class RetryBudget:
+    """Token bucket limiting retries to a fraction of requests: every
+    request deposits `ratio` of a token, every retry takes a whole one;
+    `min_per_second` tokens are added over time, so that retries are
+    possible under low traffic too"""
+
+    def __init__(
+        self,
+        ratio: float = config.RETRY_BUDGET_RATIO,
+        min_per_second: float = config.RETRY_BUDGET_MIN_PER_SECOND,
+    ):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max(1.0, min_per_second * 10)
+        self.tokens = self.max_tokens
+        self._updated_at = time.monotonic()
+
+    def _add(self, tokens: float) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + tokens)
+
+    def deposit(self) -> None:
+        self._add(self.ratio)
+
+    def withdraw(self) -> bool:
+        now = time.monotonic()
+        self._add((now - self._updated_at) * self.min_per_second)
+        self._updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RetryPolicy:
+    """Re-executes handlers failed with transient errors, with exponential
+    backoff and full jitter, as long as worker's retry budget allows"""
+
+    def __init__(
+        self,
+        attempts: int = config.RETRY_ATTEMPTS,
+        base_delay: float = config.RETRY_BASE_DELAY,
+        max_delay: float = config.RETRY_MAX_DELAY,
+        budget: Optional[RetryBudget] = None,
+    ):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget if budget is not None else RetryBudget()
+
+    def backoff(self, retry: int) -> float:
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2**retry)
+        )
+
+    async def run(self, request, handler, *args, **kwargs):
+        """Returns handler's response; raises error of the last attempt"""
+        route = metrics.route_label(request)
+        self.budget.deposit()
+        for retry in range(self.attempts):
+            try:
+                return await handler(request, *args, **kwargs)
+            except Exception as e:
+                if retry == self.attempts - 1 or not is_transient_error(e):
+                    raise
+                if not self.budget.withdraw():
+                    metrics.RETRY_BUDGET_EXHAUSTED.labels(route).inc()
+                    raise
+                error_logger.warning(
+                    f"Retrying {route} after transient error: {e}"
+                )
+                metrics.REQUEST_RETRIES.labels(route).inc()
+                await asyncio.sleep(self.backoff(retry))
+
+
+retry_policy = RetryPolicy()
@@ -1,14 +1,33 @@
 from http import HTTPStatus
 
 from app.auth import protected
-from app.utils import generate_jwt_token
-
-from database.models import Account, Transaction, User
+from app.schemas import LoginCredentials, RefreshTokenData, validate_body
+from app.tokens import (
+    issue_refresh_token,
+    purge_expired_tokens,
+    revoke_refresh_token,
+    rotate_refresh_token,
+)
+from app.utils import (
+    conditional,
+    decode_cursor,
+    encode_cursor,
+    generate_jwt_token,
+    hasher_busy_response,
+    read_connection,
+    requesting_user,
+    retry_decorator,
+    too_many_requests_response,
+)
+
+import config
+
+from database import queries
+from database.hashing import HasherBusyError
+from database.statements import USER_BY_EMAIL
 
 from sanic import Blueprint, json, text
 
-from sqlalchemy import select
-
 
 main = Blueprint("main")
 auth = Blueprint("auth", url_prefix="/auth")
@@ -21,67 +40,134 @@ async def main_handler(request):
 
 @main.get("/me", name="personal_info")
 @protected
+@conditional(requesting_user)
 async def get_personal_data(request):
     user = request.ctx.user
+    async with read_connection(request) as conn:
+        stats = await queries.user_stats(conn, user.id)
     payload = {
         "id": user.id,
         "email": user.email,
         "full name": user.full_name,
+        "stats": stats,
     }
     return json(payload, status=HTTPStatus.OK)
 
 
 @main.get("/accounts", name="accounts_info")
 @protected
+@conditional(requesting_user)
 async def get_account_data(request):
     user = request.ctx.user
-    st = select(Account).where(Account.user_id == user.id)
-    async with request.app.ctx.session() as session:
-        accounts = await session.scalars(st)
-
-    return_data = dict()
-    for account in accounts:
-        return_data[account.id] = account.balance
-
-    return json(return_data, status=HTTPStatus.OK)
+    async with read_connection(request) as conn:
+        balances = await queries.account_balances(conn, user.id)
+    return json(balances, status=HTTPStatus.OK)
 
 
 @main.get("/transactions", name="transactions_info")
 @protected
+@conditional(requesting_user)
 async def get_transactions(request):
+    """Returns page of user's transactions in order they were received;
+    accepts "limit" and "after" (cursor from previous page) query arguments"""
     user = request.ctx.user
-    st = select(Transaction).where(Transaction.user_id == user.id)
-    async with request.app.ctx.session() as session:
-        transactions = await session.scalars(st)
-    data = []
-    for transaction in transactions:
-        data.append(transaction.serialize())
-    return json(data, HTTPStatus.OK)
+    try:
+        limit = int(request.args.get("limit", config.PAGE_SIZE))
+        after = request.args.get("after")
+        after = decode_cursor(after) if after is not None else 0
+    except ValueError:
+        return json(
+            {"error": "invalid pagination arguments"},
+            HTTPStatus.BAD_REQUEST,
+        )
+    if not 0 < limit <= config.MAX_PAGE_SIZE:
+        return json(
+            {"error": f"limit must be between 1 and {config.MAX_PAGE_SIZE}"},
+            HTTPStatus.BAD_REQUEST,
+        )
+
+    async with read_connection(request) as conn:
+        transactions, next_position = await queries.transactions_page(
+            conn, user.id, after, limit
+        )
+    next_cursor = None
+    if next_position is not None:
+        next_cursor = encode_cursor(next_position)
+    return json(
+        {"transactions": transactions, "next_cursor": next_cursor},
+        HTTPStatus.OK,
+    )
 
 
 @auth.post("/login", name="login")
-async def login_user(request):
+@validate_body(LoginCredentials)
+async def login_user(request, credentials: LoginCredentials):
     """Logs user in; credentials must be sent in
-    request's JSON body, and are supposed to be email and password"""
-    credentials = request.json
-    if (
-        "email" not in credentials.keys()
-        or "password" not in credentials.keys()
-    ):
-        return json(
-            {"error": "invalid credentials list"},
-            status=HTTPStatus.BAD_REQUEST,
-        )
+    request's JSON body, and are supposed to be email and password.
+    Returns access token and refresh token to renew it with; attempts are
+    throttled per client address and per email"""
+    retry_after = request.app.ctx.login_throttle.check(
+        request.remote_addr or request.ip, credentials.email
+    )
+    if retry_after:
+        return too_many_requests_response(retry_after)
 
-    stmt = select(User).where(User.email == credentials["email"])
     async with request.app.ctx.session() as session:
-        user = await session.scalar(stmt)
-        if user is None or not user.verify_password(credentials["password"]):
+        user = await session.scalar(
+            USER_BY_EMAIL, {"email": credentials.email}
+        )
+    try:
+        if user is None or not await user.verify_password_async(
+            credentials.password
+        ):
             return json(
                 {"error": "invalid credentials"},
                 status=HTTPStatus.IM_A_TEAPOT,
             )
+    except HasherBusyError:
+        return hasher_busy_response()
+
+    async with request.app.ctx.session() as session:
+        await purge_expired_tokens(session, user.id)
+        refresh_token = await issue_refresh_token(session, user.id)
+        await session.commit()
 
     token = generate_jwt_token(user.email, request.app.config.SECRET)
 
-    return json({"access_token": token}, status=HTTPStatus.OK)
+    return json(
+        {"access_token": token, "refresh_token": refresh_token},
+        status=HTTPStatus.OK,
+    )
+
+
+@auth.post("/refresh", name="refresh")
+@retry_decorator
+@validate_body(RefreshTokenData)
+async def refresh_access_token(request, data: RefreshTokenData):
+    """Exchanges refresh token for new access token and the next refresh
+    token; every refresh token can be used only once"""
+    async with request.app.ctx.session() as session:
+        rotated = await rotate_refresh_token(session, data.refresh_token)
+        await session.commit()
+    if rotated is None:
+        return json(
+            {"error": "invalid refresh token"}, HTTPStatus.UNAUTHORIZED
+        )
+
+    email, refresh_token = rotated
+    token = generate_jwt_token(email, request.app.config.SECRET)
+    return json(
+        {"access_token": token, "refresh_token": refresh_token},
+        HTTPStatus.OK,
+    )
+
+
+@auth.post("/logout", name="logout")
+@validate_body(RefreshTokenData)
+async def logout_user(request, data: RefreshTokenData):
+    """Revokes refresh token along with all tokens it was renewed with;
+    access tokens stay valid until they expire"""
+    async with request.app.ctx.session() as session:
+        await revoke_refresh_token(session, data.refresh_token)
+        await session.commit()
+    return json({"message": "OK"}, HTTPStatus.OK)
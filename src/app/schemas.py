@@ -0,0 +1,174 @@
+import re
+from decimal import Decimal
+from functools import wraps
+from hashlib import sha256
+from http import HTTPStatus
+from typing import ClassVar, Final, Type, TypeVar, Union
+from uuid import UUID
+
+import config
+
+import msgspec
+
+from sanic import json
+
+
+ALLOWED_PASSWORD_CHARACTERS: Final = "!@#$%^&*()_+=-'\"<>,./\\|{}[]:;`~]+$"
+
+EMAIL_PATTERN: Final = re.compile(
+    r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
+)
+PASSWORD_PATTERN: Final = re.compile(
+    r"""^[A-Za-z0-9!@#$%^&*()_+=\-"'<>,./\\|{}\[\]:;`~]+$"""
+)
+FULL_NAME_PATTERN: Final = re.compile(r"^[A-Za-z]+(?:\s[A-Za-z]+)*$")
+
+# payments must fit columns they are stored to - Numeric(12, 2) amounts
+# and 32-bit integer ids - or they would fail the whole DB transaction
+MAX_AMOUNT: Final = Decimal("1e10")
+AMOUNT_QUANTUM: Final = Decimal("0.01")
+MIN_ID: Final = -(2**31)
+MAX_ID: Final = 2**31 - 1
+
+S = TypeVar("S", bound="Schema")
+
+
+class Schema(msgspec.Struct):
+    """Base of request bodies; `invalid_message` is the error reported when
+    body can't be decoded into the schema, while checks of `__post_init__`
+    report their own messages (by raising ValueError)"""
+
+    invalid_message: ClassVar[str] = "invalid request data"
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def decode(body: bytes, schema: Type[S]) -> S:
+    """Decodes and validates raw JSON in a single pass; raises SchemaError
+    with message to report to the client"""
+    try:
+        return msgspec.json.decode(body, type=schema)
+    except msgspec.DecodeError as e:
+        if isinstance(e.__cause__, ValueError):
+            raise SchemaError(str(e)) from e
+        raise SchemaError(schema.invalid_message) from e
+
+
+def validate_body(schema: Type[Schema]):
+    """Decorator decoding request's body into the schema and passing it to
+    the handler as the argument following request; returns BAD_REQUEST with
+    error message on invalid body"""
+
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(request, *args, **kwargs):
+            try:
+                data = decode(request.body, schema)
+            except SchemaError as e:
+                return json({"error": str(e)}, HTTPStatus.BAD_REQUEST)
+            return await f(request, data, *args, **kwargs)
+
+        return decorated_function
+
+    return decorator
+
+
+class LoginCredentials(Schema):
+    invalid_message: ClassVar[str] = "invalid credentials list"
+
+    email: str
+    password: str
+
+
+class RefreshTokenData(Schema):
+    invalid_message: ClassVar[str] = "invalid refresh token"
+
+    refresh_token: str
+
+
+class UserData(Schema):
+    """User's data for creation/editing; email and password are required,
+    and fields which were not sent are left UNSET"""
+
+    email: Union[str, msgspec.UnsetType] = msgspec.UNSET
+    password: Union[str, msgspec.UnsetType] = msgspec.UNSET
+    full_name: Union[str, None, msgspec.UnsetType] = msgspec.UNSET
+    is_admin: Union[bool, int, str, msgspec.UnsetType] = msgspec.UNSET
+
+    def __post_init__(self):
+        if self.email is msgspec.UNSET or self.password is msgspec.UNSET:
+            raise ValueError(
+                "invalid request data: missing email and/or password"
+            )
+        if not EMAIL_PATTERN.fullmatch(self.email):
+            raise ValueError("invalid email format")
+        if not PASSWORD_PATTERN.fullmatch(self.password):
+            raise ValueError(
+                "invalid password value - only english letters, digits "
+                f"and special characters {ALLOWED_PASSWORD_CHARACTERS} allowed"
+            )
+        if isinstance(self.full_name, str):
+            self.full_name = self.full_name.strip()
+            if not FULL_NAME_PATTERN.fullmatch(self.full_name):
+                raise ValueError(
+                    "invalid full_name value - it can be only list of words, "
+                    "consisting of ASCII characters"
+                )
+        if self.is_admin is not msgspec.UNSET:
+            self.is_admin = str(self.is_admin).lower() in [
+                "true",
+                "1",
+                "yes",
+                "y",
+            ]
+
+    def fields(self):
+        """Returns dict of the fields which were sent"""
+        return {
+            field: value
+            for field in self.__struct_fields__
+            if (value := getattr(self, field)) is not msgspec.UNSET
+        }
+
+
+class WebhookPayload(Schema):
+    """Payment notification; values are kept as sent, since signature is
+    computed over their textual representation"""
+
+    invalid_message: ClassVar[str] = "invalid json data"
+
+    transaction_id: str
+    user_id: Union[int, str]
+    account_id: Union[int, str]
+    amount: Union[int, float, str]
+    signature: str
+
+    def signature_valid(self) -> bool:
+        string = (
+            f"{self.account_id}{self.amount}"
+            f"{self.transaction_id}{self.user_id}"
+            f"{config.WEBHOOK_SECRET}"
+        )
+        return sha256(string.encode("utf-8")).hexdigest() == self.signature
+
+    def parse(self):
+        """Returns (transaction_id, user_id, account_id, amount) converted to
+        their types; raises ValueError on malformed values and on values
+        out of range of DB columns"""
+        try:
+            amount = Decimal(str(self.amount))
+        except ArithmeticError as e:
+            raise ValueError("invalid amount") from e
+        if (
+            not amount.is_finite()
+            or abs(amount) >= MAX_AMOUNT
+            or amount != amount.quantize(AMOUNT_QUANTUM)
+        ):
+            raise ValueError("invalid amount")
+        user_id, account_id = int(self.user_id), int(self.account_id)
+        for value in (user_id, account_id):
+            if not MIN_ID <= value <= MAX_ID:
+                raise ValueError("invalid id")
+        return UUID(self.transaction_id), user_id, account_id, amount
@@ -0,0 +1,89 @@
+import time
+import zlib
+from multiprocessing import Array
+from typing import Final
+
+import metrics
+
+
+class TokenBuckets:
+    """Token buckets living in shared memory, so that all workers draw
+    attempts from the same buckets. Buckets are kept in a fixed table:
+    key's bucket is one of WAYS entries of the set its hash points to, and
+    entries remember hash of their key, so that keys of the same set don't
+    share buckets. A new key takes over the least drained entry of the set
+    and starts with full bucket: keys crowding one set can make others
+    forget their drained buckets, but can't lock a new key out"""
+
+    WAYS: Final = 4
+
+    def __init__(self, array, rate: float, burst: float):
+        """rate - tokens added per second (0 disables the limit),
+        burst - bucket capacity"""
+        self._array = array
+        self._values = array.get_obj()
+        # every entry holds amount of tokens, time it was updated at
+        # and hash of its key
+        self._sets = len(self._values) // (self.WAYS * 3)
+        self.rate = rate
+        self.burst = burst
+
+    @staticmethod
+    def allocate(sets: int = 16384):
+        return Array("d", sets * TokenBuckets.WAYS * 3)
+
+    def _tokens(self, index: int, now: float) -> float:
+        # zeroed (never used) buckets are full
+        elapsed = max(now - self._values[index + 1], 0.0)
+        return min(self._values[index] + elapsed * self.rate, self.burst)
+
+    def take(self, key: str) -> float:
+        """Takes a token from key's bucket; returns 0 if it was taken,
+        or seconds until one is available otherwise"""
+        if self.rate <= 0:
+            return 0.0
+        # builtin hash() is salted per process, so it can't be used here
+        key_hash = zlib.crc32(key.encode("utf-8"))
+        first = key_hash % self._sets * self.WAYS * 3
+        with self._array.get_lock():
+            # wall clock, as times are compared across processes
+            now = time.time()
+            index, tokens = None, -1.0
+            for way in range(first, first + self.WAYS * 3, 3):
+                way_tokens = self._tokens(way, now)
+                if self._values[way + 2] == key_hash:
+                    index, tokens = way, way_tokens
+                    break
+                if way_tokens > tokens:
+                    index, tokens = way, way_tokens
+            else:
+                self._values[index + 2] = key_hash
+                tokens = self.burst
+            self._values[index + 1] = now
+            if tokens >= 1:
+                self._values[index] = tokens - 1
+                return 0.0
+            self._values[index] = tokens
+        return (1 - tokens) / self.rate
+
+
+class LoginThrottle:
+    """Limits login attempts per client address (credential stuffing) and
+    per email (password guessing), so that excess attempts are rejected
+    before they cost a user query and bcrypt verification"""
+
+    def __init__(self, by_ip: TokenBuckets, by_email: TokenBuckets):
+        self.by_ip = by_ip
+        self.by_email = by_email
+
+    def check(self, ip: str, email: str) -> float:
+        """Takes attempt from buckets of client's address and of email;
+        returns 0 if attempt may proceed, or seconds to wait otherwise"""
+        wait = self.by_ip.take(ip)
+        if wait:
+            metrics.LOGIN_THROTTLED.labels("ip").inc()
+            return wait
+        wait = self.by_email.take(email.strip().lower())
+        if wait:
+            metrics.LOGIN_THROTTLED.labels("email").inc()
+        return wait
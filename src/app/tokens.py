@@ -0,0 +1,130 @@
+"""Refresh tokens - long-living opaque tokens exchanged at "/auth/refresh"
+for a new access token, so that renewing access costs an indexed lookup
+instead of verifying password with bcrypt. Tokens are stored as SHA-256
+digests: they are random, so a fast hash is enough"""
+
+import datetime
+import secrets
+import uuid
+from hashlib import sha256
+from typing import Optional, Tuple
+
+import config
+
+from database.models import RefreshToken, User
+
+import metrics
+
+from sanic.log import error_logger
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+
+
+ISSUE_TOKEN = insert(RefreshToken)
+
+# Core table statement, as ORM-enabled UPDATE can't return columns of
+# other entities
+_tokens = RefreshToken.__table__
+USE_TOKEN = (
+    update(_tokens)
+    .where(
+        _tokens.c.token_hash == bindparam("hash"),
+        _tokens.c.used_at.is_(None),
+        _tokens.c.expires_at > func.now(),
+        _tokens.c.user_id == User.id,
+    )
+    .values(used_at=func.now())
+    .returning(User.email, _tokens.c.user_id, _tokens.c.family_id)
+)
+
+USED_TOKEN_FAMILY = select(RefreshToken.family_id).where(
+    RefreshToken.token_hash == bindparam("hash"),
+    RefreshToken.used_at.is_not(None),
+)
+
+TOKEN_FAMILY = select(RefreshToken.family_id).where(
+    RefreshToken.token_hash == bindparam("hash")
+)
+
+REVOKE_FAMILY = delete(RefreshToken).where(
+    RefreshToken.family_id == bindparam("family_id")
+)
+
+REVOKE_USER_TOKENS = delete(RefreshToken).where(
+    RefreshToken.user_id == bindparam("user_id")
+)
+
+PURGE_EXPIRED_USER_TOKENS = delete(RefreshToken).where(
+    RefreshToken.user_id == bindparam("user_id"),
+    RefreshToken.expires_at < func.now(),
+)
+
+
+def hash_token(token: str) -> str:
+    return sha256(token.encode("utf-8")).hexdigest()
+
+
+async def issue_refresh_token(
+    session, user_id: int, family_id: Optional[uuid.UUID] = None
+) -> str:
+    """Stores new token within session's transaction and returns it;
+    token starts new family (new login) unless family_id is given"""
+    token = secrets.token_urlsafe(32)
+    await session.execute(
+        ISSUE_TOKEN,
+        {
+            "token_hash": hash_token(token),
+            "user_id": user_id,
+            "family_id": family_id or uuid.uuid4(),
+            "expires_at": datetime.datetime.now(datetime.timezone.utc)
+            + config.REFRESH_TOKEN_EXP_TIME,
+        },
+    )
+    return token
+
+
+async def rotate_refresh_token(
+    session, token: str
+) -> Optional[Tuple[str, str]]:
+    """Uses token up and issues the next one of its family within session's
+    transaction; returns email of token's user and the new token, or None
+    if token is unknown, expired or revoked. Token which was used already
+    has leaked, so its family is revoked - commit in any case"""
+    token_hash = hash_token(token)
+    row = (await session.execute(USE_TOKEN, {"hash": token_hash})).first()
+    if row is None:
+        family_id = await session.scalar(
+            USED_TOKEN_FAMILY, {"hash": token_hash}
+        )
+        if family_id is None:
+            metrics.REFRESH_TOKENS.labels("invalid").inc()
+            return None
+        await session.execute(REVOKE_FAMILY, {"family_id": family_id})
+        metrics.REFRESH_TOKENS.labels("reused").inc()
+        error_logger.warning(
+            f"Used refresh token was sent again, revoked family {family_id}"
+        )
+        return None
+
+    new_token = await issue_refresh_token(
+        session, row.user_id, row.family_id
+    )
+    metrics.REFRESH_TOKENS.labels("rotated").inc()
+    return row.email, new_token
+
+
+async def revoke_refresh_token(session, token: str) -> None:
+    """Revokes token's family (logout); unknown tokens are ignored"""
+    family_id = await session.scalar(
+        TOKEN_FAMILY, {"hash": hash_token(token)}
+    )
+    if family_id is not None:
+        await session.execute(REVOKE_FAMILY, {"family_id": family_id})
+
+
+async def revoke_user_tokens(session, user_id: int) -> None:
+    await session.execute(REVOKE_USER_TOKENS, {"user_id": user_id})
+
+
+async def purge_expired_tokens(session, user_id: int) -> None:
+    await session.execute(PURGE_EXPIRED_USER_TOKENS, {"user_id": user_id})
@@ -1,204 +1,263 @@
-import asyncio
+import base64
+import binascii
+import contextlib
 import datetime
-import random
-import re
+import math
 from functools import wraps
-from hashlib import sha256
 from http import HTTPStatus
-from typing import Dict, Final, Optional
-from uuid import UUID
+from typing import Any, AsyncIterable, Dict, Final, Optional
+
+from app.admission import Overloaded
+from app.cache import DataVersions
+from app.encoding import dumps
+from app.retry import retry_policy
 
 import config
 
 from database.models import User
+from database.statements import USER_BY_EMAIL
 
 import jwt
 
-from sanic import json
+import metrics
+
+from sanic import empty, json
 from sanic.log import error_logger
 
-from sqlalchemy import select
 
+NDJSON_CONTENT_TYPE: Final = "application/x-ndjson"
+
+_UNSET: Final = object()
 
-ALLOWED_PASSWORD_CHARACTERS: Final = "!@#$%^&*()_+=-'\"<>,./\\|{}[]:;`~]+$"
+
+def decode_token(request) -> Optional[Dict[str, Any]]:
+    """Returns payload of request's token, or None if token is missing or
+    invalid; signature is verified only once per request"""
+    payload = getattr(request.ctx, "token_payload", _UNSET)
+    if payload is _UNSET:
+        payload = None
+        if request.token:
+            try:
+                payload = jwt.decode(
+                    request.token,
+                    request.app.config.SECRET,
+                    algorithms=["HS256"],
+                )
+            except jwt.InvalidTokenError:
+                pass
+        request.ctx.token_payload = payload
+    return payload
 
 
 async def fetch_user_from_request(request) -> Optional[User]:
-    if not request.token:
+    """Resolves user the request is authenticated as; resolution happens
+    lazily - only when asked for - and result is stored in request.ctx.user"""
+    if hasattr(request.ctx, "user"):
+        return request.ctx.user
+
+    payload = decode_token(request)
+    if payload is None:
+        request.ctx.user = None
         return None
-    try:
-        payload = jwt.decode(
-            request.token, request.app.config.SECRET, algorithms=["HS256"]
-        )
-    except jwt.InvalidTokenError:
-        return None
-    st = select(User).where(User.email == payload["sub"])
-    async with request.app.ctx.session() as session:
-        user = await session.scalar(st)
+    cache = request.app.ctx.user_cache
+    user = cache.get(payload["sub"])
+    if user is None:
+        version = cache.version(payload["sub"])
+        async with request.app.ctx.session() as session:
+            user = await session.scalar(
+                USER_BY_EMAIL, {"email": payload["sub"]}
+            )
+        if user is not None:
+            cache.set(payload["sub"], user, version)
+    request.ctx.user = user
     return user
 
 
-async def fetch_user_middleware(request):
-    request.ctx.user = await fetch_user_from_request(request)
+@contextlib.asynccontextmanager
+async def read_connection(request, *user_ids: int):
+    """Connection for read-only queries of given users' data; it is taken
+    from the primary if any of them, or the requesting user, wrote recently
+    (see mark_written) and from the read replica otherwise. Raises
+    Overloaded if worker's limit of database work is reached"""
+    user = getattr(request.ctx, "user", None)
+    if user is not None:
+        user_ids = (*user_ids, user.id)
+    read = request.app.ctx.db_router.read(
+        *user_ids, fresh=getattr(request.ctx, "read_fresh", False)
+    )
+    admission = request.app.ctx.admission
+    if admission is None:
+        async with read as conn:
+            yield conn
+        return
+    async with admission.admit():
+        async with read as conn:
+            yield conn
 
 
-def generate_jwt_token(user_email: str, secret: str, exp_time=None) -> str:
-    if exp_time is None:
-        exp_time = config.ACCESS_TOKEN_EXP_TIME
+def data_changed(app, *user_ids: int) -> None:
+    """Changes ETags of given users' data and of all users' listings, and
+    makes reads of their data go to the primary for a while; call after
+    changes are committed"""
+    app.ctx.data_versions.bump(*user_ids)
+    app.ctx.db_router.mark_written(*user_ids, DataVersions.ALL)
 
-    exp_time = datetime.datetime.now(datetime.timezone.utc) + exp_time
-    payload = {
-        "sub": str(user_email),
-        "exp": str(int(exp_time.timestamp())),
-    }
-    return jwt.encode(payload, secret, algorithm="HS256")
 
+def mark_written(request, *user_ids: int) -> None:
+    """data_changed for given users' data changed by the request; reads of
+    requesting user go to the primary for a while as well"""
+    data_changed(request.app, *user_ids)
+    user = getattr(request.ctx, "user", None)
+    if user is not None:
+        request.app.ctx.db_router.mark_written(user.id)
 
-def email_is_valid(email: str) -> bool:
-    pattern = r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
-    return bool(re.fullmatch(pattern, email))
 
+def requesting_user(request, **kwargs) -> int:
+    return request.ctx.user.id
 
-def password_is_valid(password: str) -> bool:
-    pattern = r"""^[A-Za-z0-9!@#$%^&*()_+=\-"'<>,./\\|{}\[\]:;`~]+$"""
-    return bool(re.fullmatch(pattern, password))
 
+def all_users(request, **kwargs) -> str:
+    return DataVersions.ALL
 
-def fullname_is_valid(full_name: str) -> bool:
-    pattern = r"^[A-Za-z]+(?:\s[A-Za-z]+)*$"
-    return bool(re.fullmatch(pattern, full_name))
 
+def etag_matches(request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    # weak comparison, as required for If-None-Match
+    return any(
+        tag.strip().removeprefix("W/") in (etag, "*")
+        for tag in header.split(",")
+    )
 
-def valid_email_decorator(wrapped):
-    """returns BAD_REQUEST if
-    email not in request data / email provided is invalid"""
+
+def conditional(data_key):
+    """Decorator for GET handlers serving data of user data_key(request,
+    **kwargs) returns (or of all users, see all_users): responses get ETag
+    of that data, and requests with the current one in If-None-Match are
+    answered 304 without calling the handler. Streamed responses are not
+    conditional.
+    Requests revalidating an ETag which is no longer current read from the
+    primary: lagging replica could serve them data older than the new ETag,
+    which would then be answered 304 until the next change"""
 
     def decorator(f):
         @wraps(f)
         async def decorated_function(request, *args, **kwargs):
-            data = request.json
-            if "email" in data and not email_is_valid(data["email"]):
-                return json(
-                    {"error": "invalid email format"}, HTTPStatus.BAD_REQUEST
-                )
-
+            if wants_ndjson(request):
+                return await f(request, *args, **kwargs)
+            etag = request.app.ctx.data_versions.etag(
+                data_key(request, **kwargs)
+            )
+            headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+            if etag_matches(request, etag):
+                return empty(HTTPStatus.NOT_MODIFIED, headers=headers)
+            if "if-none-match" in request.headers:
+                request.ctx.read_fresh = True
             response = await f(request, *args, **kwargs)
+            if response is not None and response.status == HTTPStatus.OK:
+                response.headers.update(headers)
             return response
 
         return decorated_function
 
-    return decorator(wrapped)
-
+    return decorator
 
-def validate_user_data(wrapped):
-    """Decorator validating request data for user creation/editing,
-    returning error in case of invalid data and proceeding with
-    handler on valid data"""
 
-    def decorator(f):
-        @wraps(f)
-        async def decorated_function(request, *args, **kwargs):
-            data = request.json
-            keys = data.keys()
-            required_keys = {"password", "email"}
-            if not data or not required_keys.issubset(keys):
-                return json(
-                    {
-                        "error": "invalid request data: "
-                        "missing email and/or password"
-                    },
-                    HTTPStatus.BAD_REQUEST,
-                )
+def busy_response(retry_after: int):
+    return json(
+        {"error": "server is busy, try again later"},
+        HTTPStatus.SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(retry_after)},
+    )
 
-            if not email_is_valid(data["email"]):
-                return json(
-                    {"error": "invalid email format"}, HTTPStatus.BAD_REQUEST
-                )
-            if not password_is_valid(data["password"]):
-                return json(
-                    {
-                        "error": "invalid password value - "
-                        "only english letters, digits "
-                        f"and special characters "
-                        f"{ALLOWED_PASSWORD_CHARACTERS} allowed"
-                    },
-                    HTTPStatus.BAD_REQUEST,
-                )
 
-            if "full_name" in keys and not fullname_is_valid(
-                data["full_name"].strip()
-            ):
-                return json(
-                    {
-                        "error": "invalid full_name "
-                        "value - it can be only "
-                        "list of words, consisting of "
-                        "ASCII characters"
-                    },
-                    HTTPStatus.BAD_REQUEST,
-                )
+def too_many_requests_response(retry_after: float):
+    return json(
+        {"error": "too many attempts, try again later"},
+        HTTPStatus.TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(max(math.ceil(retry_after), 1))},
+    )
 
-            response = await f(request, *args, **kwargs)
-            return response
 
-        return decorated_function
+def hasher_busy_response():
+    return busy_response(config.PASSWORD_HASHER_RETRY_AFTER)
 
-    return decorator(wrapped)
 
+def generate_jwt_token(user_email: str, secret: str, exp_time=None) -> str:
+    if exp_time is None:
+        exp_time = config.ACCESS_TOKEN_EXP_TIME
 
-def valid_webhook_data(json_obj: Dict[str, str]) -> bool:
-    required_keys = {
-        "transaction_id",
-        "user_id",
-        "account_id",
-        "amount",
-        "signature",
+    exp_time = datetime.datetime.now(datetime.timezone.utc) + exp_time
+    payload = {
+        "sub": str(user_email),
+        "exp": str(int(exp_time.timestamp())),
     }
-    if not all(field in json_obj.keys() for field in required_keys):
-        return False
-    try:
-        UUID(json_obj["transaction_id"])
-        int(json_obj["account_id"])
-        int(json_obj["user_id"])
-        float(json_obj["amount"])
-    except ValueError:
-        return False
-    return True
+    return jwt.encode(payload, secret, algorithm="HS256")
 
 
-def webhook_signature_valid(json_obj: Dict[str, str]) -> bool:
-    if not valid_webhook_data(json_obj):
-        return False
+def wants_ndjson(request) -> bool:
+    return NDJSON_CONTENT_TYPE in request.headers.get("accept", "")
 
-    string = (
-        f"{json_obj['account_id']}{json_obj['amount']}"
-        f"{json_obj['transaction_id']}{json_obj['user_id']}"
-        f"{config.WEBHOOK_SECRET}"
-    )
 
-    return sha256(string.encode("utf-8")).hexdigest() == json_obj["signature"]
+def ndjson_line(obj: Any) -> bytes:
+    line = dumps(obj)
+    if isinstance(line, str):
+        line = line.encode()
+    return line + b"\n"
+
+
+async def stream_ndjson(
+    request, objects: AsyncIterable[Any], chunk_size: int = None
+) -> None:
+    """Sends objects as newline delimited JSON in chunks of chunk_size
+    objects, so that response never has to be held in memory at once"""
+    if chunk_size is None:
+        chunk_size = config.STREAM_CHUNK_SIZE
+    response = await request.respond(content_type=NDJSON_CONTENT_TYPE)
+    chunk = []
+    async for obj in objects:
+        chunk.append(ndjson_line(obj))
+        if len(chunk) >= chunk_size:
+            await response.send(b"".join(chunk))
+            chunk = []
+    if chunk:
+        await response.send(b"".join(chunk))
+    await response.eof()
+
+
+def encode_cursor(position: int) -> str:
+    """Makes opaque pagination cursor out of position in ordered listing"""
+    return base64.urlsafe_b64encode(str(position).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    """Raises ValueError on cursors which were not made by encode_cursor"""
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (binascii.Error, UnicodeError) as e:
+        raise ValueError("invalid cursor") from e
 
 
 def retry_decorator(wrapped):
+    """Re-executes handler failed with transient DB error according to
+    worker's retry policy; other errors are not retried"""
+
     def decorator(f):
         @wraps(f)
         async def decorated_function(request, *args, **kwargs):
-            retries = 3
-            for i in range(retries):
-                try:
-                    return await f(request, *args, **kwargs)
-                except Exception as e:
-                    error_logger.warning(f"Error on processing webhook: {e}")
-                    if i < retries - 1:
-                        await asyncio.sleep(random.uniform(0.2, 0.4) * i)
-                    else:
-                        error_logger.error(
-                            f"Failed to process webhook in {retries} tries"
-                        )
-                        return json(
-                            {"error": "unexpected server error"},
-                            HTTPStatus.INTERNAL_SERVER_ERROR,
-                        )
+            try:
+                return await retry_policy.run(request, f, *args, **kwargs)
+            except Overloaded as e:
+                return busy_response(e.retry_after)
+            except Exception as e:
+                error_logger.exception(
+                    f"Failed to process {metrics.route_label(request)}: {e}"
+                )
+                return json(
+                    {"error": "unexpected server error"},
+                    HTTPStatus.INTERNAL_SERVER_ERROR,
+                )
 
         return decorated_function
 
@@ -1,76 +1,520 @@
+from decimal import Decimal
 from http import HTTPStatus
-from typing import Dict, Optional
+from typing import Any, Dict, List, NamedTuple
+from uuid import UUID
 
-from app.utils import retry_decorator, webhook_signature_valid
+from app.schemas import WebhookPayload, decode
+from app.utils import busy_response, data_changed, retry_decorator
 
-from database.models import Account, Transaction, User
+import config
+
+from database.models import Account, Transaction, UserStats, WebhookInbox
+from database.statements import precompiled
+
+import metrics
+
+import msgspec
 
 from sanic import Blueprint, json
 
-from sqlalchemy import insert, select
+from sqlalchemy import (
+    ARRAY,
+    Integer,
+    Numeric,
+    any_,
+    bindparam,
+    exists,
+    func,
+    literal_column,
+    select,
+    update,
+)
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID, insert as pg_insert
 
 webhook = Blueprint("webhook")
 
 
-async def check_entities(
-    session_maker, data: Dict[str, str]
-) -> Optional[Dict[str, str]]:
-    """checks whether transaction and user with given id exist and are valid;
-    if not, returns errors JSON data; if do, returns nothing"""
-    async with session_maker() as session:
-        transaction = await session.execute(
-            select(Transaction).where(Transaction.id == data["transaction_id"])
-        )
-        if transaction.scalar():
-            return {"error": "transaction already exists"}
+class InvalidSignature(ValueError):
+    pass
 
-        user = await session.execute(
-            select(User).where(User.id == int(data["user_id"]))
-        )
-        user = user.scalar()
 
-        account_owner = await session.execute(
-            select(User).join(
-                User.accounts.and_(Account.id == data["account_id"])
-            )
+class Payment(NamedTuple):
+    transaction_id: UUID
+    user_id: int
+    account_id: int
+    amount: Decimal
+
+    @classmethod
+    def from_payload(cls, payload: WebhookPayload) -> "Payment":
+        """Raises ValueError if signature or values of payload are invalid"""
+        if not payload.signature_valid():
+            raise InvalidSignature("invalid signature")
+        return cls(*payload.parse())
+
+
+def credit_payment_statement():
+    """Builds single statement which validates payment's ownership, inserts
+    transaction (idempotently), creates account if needed and atomically
+    credits its balance; it returns one row with columns "known" (transaction
+    existed before), "valid" (user exists and may own the account),
+    "inserted" and "balance" (new balance, NULL if account was not credited).
+    Payment's fields are passed as parameters of the same names.
+    User's stats row is locked before anything else, the same as by
+    apply_payments, so the two can't deadlock"""
+    transaction_id = bindparam("transaction_id", type_=PG_UUID(as_uuid=True))
+    amount = bindparam("amount", type_=Numeric(12, 2))
+    account_id = bindparam("account_id", type_=Integer)
+    user_id = bindparam("user_id", type_=Integer)
+
+    # every user has stats row; locking it here, before the account is
+    # touched, takes locks in the same order as apply_payments
+    owner = (
+        select(UserStats.user_id.label("id"))
+        .where(
+            UserStats.user_id == user_id,
+            ~exists().where(
+                Account.id == account_id,
+                Account.user_id != UserStats.user_id,
+            ),
         )
-        account_owner = account_owner.first()
+        .with_for_update(of=UserStats)
+        .cte("owner")
+    )
+    new_transaction = (
+        pg_insert(Transaction)
+        .from_select(
+            ["id", "amount", "account_id", "user_id"],
+            select(transaction_id, amount, account_id, owner.c.id),
+        )
+        .on_conflict_do_nothing(index_elements=[Transaction.id])
+        .returning(
+            Transaction.amount, Transaction.account_id, Transaction.user_id
+        )
+        .cte("new_transaction")
+    )
+    credit = pg_insert(Account).from_select(
+        ["id", "user_id", "balance"],
+        select(
+            new_transaction.c.account_id,
+            new_transaction.c.user_id,
+            new_transaction.c.amount,
+        ),
+    )
+    credited = (
+        credit.on_conflict_do_update(
+            index_elements=[Account.id],
+            set_={"balance": Account.balance + credit.excluded.balance},
+            where=Account.user_id == credit.excluded.user_id,
+        )
+        .returning(Account.balance)
+        .cte("credited")
+    )
+    return select(
+        exists().where(Transaction.id == transaction_id).label("known"),
+        exists(select(owner.c.id)).label("valid"),
+        exists(select(new_transaction.c.account_id)).label("inserted"),
+        select(credited.c.balance).scalar_subquery().label("balance"),
+    )
 
-        if not user or (
-            account_owner is not None and user != account_owner.User
-        ):
-            return {"error": "invalid user id"}
-    return None
+
+CREDIT_PAYMENT = precompiled(credit_payment_statement())
+
+ENQUEUE_PAYMENT = precompiled(
+    pg_insert(WebhookInbox)
+    .values(
+        {
+            name: bindparam(name)
+            for name in ("transaction_id", "user_id", "account_id", "amount")
+        }
+    )
+    .on_conflict_do_nothing(index_elements=[WebhookInbox.transaction_id])
+)
+
+TRANSACTION_EXISTS = select(
+    exists().where(Transaction.id == bindparam("transaction_id"))
+)
+
+RECENT_TRANSACTION_IDS = (
+    select(Transaction.id)
+    .order_by(Transaction.seq.desc())
+    .limit(bindparam("limit"))
+)
+
+# statements of apply_payments take arrays, so that their SQL doesn't
+# depend on amount of payments
+_transaction_ids = bindparam("transaction_ids", type_=ARRAY(PG_UUID(True)))
+_user_ids = bindparam("user_ids", type_=ARRAY(Integer))
+_account_ids = bindparam("account_ids", type_=ARRAY(Integer))
+_amounts = bindparam("amounts", type_=ARRAY(Numeric(12, 2)))
+
+KNOWN_TRANSACTIONS = select(Transaction.id).where(
+    Transaction.id == any_(_transaction_ids)
+)
+
+LOCK_USERS = (
+    select(UserStats.user_id)
+    .where(UserStats.user_id == any_(_user_ids))
+    .order_by(UserStats.user_id)
+    .with_for_update()
+)
+
+_new_accounts = (
+    func.unnest(_account_ids, _user_ids)
+    .table_valued("id", "user_id")
+    .render_derived("new_accounts")
+)
+CREATE_ACCOUNTS = precompiled(
+    pg_insert(Account)
+    .from_select(
+        ["id", "user_id", "balance"],
+        select(
+            _new_accounts.c.id, _new_accounts.c.user_id, literal_column("0")
+        ),
+    )
+    .on_conflict_do_nothing(index_elements=[Account.id])
+)
+
+LOCK_ACCOUNTS = (
+    select(Account.id, Account.user_id)
+    .where(Account.id == any_(_account_ids))
+    .order_by(Account.id)
+    .with_for_update()
+)
+
+_new_transactions = (
+    func.unnest(_transaction_ids, _amounts, _account_ids, _user_ids)
+    .table_valued("id", "amount", "account_id", "user_id")
+    .render_derived("new_transactions")
+)
+INSERT_TRANSACTIONS = precompiled(
+    pg_insert(Transaction)
+    .from_select(
+        ["id", "amount", "account_id", "user_id"],
+        select(_new_transactions),
+    )
+    .on_conflict_do_nothing(index_elements=[Transaction.id])
+    .returning(Transaction.id)
+)
+
+_deltas = (
+    func.unnest(_account_ids, _amounts)
+    .table_valued("id", "delta")
+    .render_derived("deltas")
+)
+CREDIT_ACCOUNTS = (
+    update(Account)
+    .where(Account.id == _deltas.c.id)
+    .values(balance=Account.balance + _deltas.c.delta)
+    .execution_options(synchronize_session=False)
+)
+
+
+async def credit_payment(session, payment: Payment) -> str:
+    """Applies single payment within session's transaction in one round trip;
+    returns "accepted", "duplicate" or "invalid user id". On anything but
+    "accepted" nothing is changed, and transaction should be rolled back"""
+    result = await session.execute(CREDIT_PAYMENT, payment._asdict())
+    result = result.one()
+    if result.known or (result.valid and not result.inserted):
+        return "duplicate"
+    if not result.valid or result.balance is None:
+        # account may be created by other user's payment concurrently
+        return "invalid user id"
+    return "accepted"
+
+
+async def apply_payment(app, payment: Payment) -> str:
+    """Applies single payment and returns its status. Payments to the same
+    account are serialized by worker's account locks before taking a DB
+    connection, so they don't occupy the pool while waiting for account's
+    row lock; those which queued up meanwhile are applied together"""
+    status = await app.ctx.account_locks.submit(
+        payment.account_id,
+        payment,
+        lambda payments: apply_queued_payments(app, payments),
+    )
+    if status == "accepted":
+        data_changed(app, payment.user_id)
+    if status != "invalid user id":
+        app.ctx.seen_transactions.add([payment.transaction_id])
+    return status
+
+
+async def apply_queued_payments(app, payments: List[Payment]) -> List[str]:
+    async with app.ctx.session() as session:
+        if len(payments) == 1:
+            status = await credit_payment(session, payments[0])
+            if status == "accepted":
+                await session.commit()
+            else:
+                await session.rollback()
+            return [status]
+
+        unique = {p.transaction_id: p for p in reversed(payments)}
+        async with session.begin():
+            statuses = await apply_payments(session, list(unique.values()))
+    results = []
+    for p in payments:
+        if unique.pop(p.transaction_id, None) is not None:
+            results.append(statuses[p.transaction_id])
+        else:
+            results.append("duplicate")
+    return results
 
 
 @webhook.post("/webhook", name="webhook")
 @retry_decorator
 async def process_payment(request):
-    data = request.json
-    if not webhook_signature_valid(data):
+    try:
+        payment = Payment.from_payload(decode(request.body, WebhookPayload))
+    except ValueError as e:
+        # forged payloads are answered the same way as malformed ones
+        metrics.WEBHOOK_PAYMENTS.labels(invalid_outcome(e)).inc()
         return json({"error": "invalid json data"}, HTTPStatus.BAD_REQUEST)
-    errors = await check_entities(request.app.ctx.session, data)
-    if errors is not None:
-        return json(errors, HTTPStatus.CONFLICT)
-
-    async with request.app.ctx.session(autoflush=False) as session:
-        account = await session.get(Account, data["account_id"])
-        if account is None:
-            await session.execute(
-                insert(Account).values(
-                    id=int(data["account_id"]),
-                    user_id=int(data["user_id"]),
+
+    seen_transactions = request.app.ctx.seen_transactions
+    if seen_transactions.seen(payment.transaction_id):
+        status = "duplicate"
+    elif config.WEBHOOK_MODE == "queue":
+        return await enqueue_payment(request, payment)
+    else:
+        status = await apply_payment(request.app, payment)
+
+    metrics.WEBHOOK_PAYMENTS.labels(status).inc()
+    if status == "duplicate":
+        return json(
+            {"error": "transaction already exists"}, HTTPStatus.CONFLICT
+        )
+    if status != "accepted":
+        return json({"error": "invalid user id"}, HTTPStatus.CONFLICT)
+    return json({"message": "OK"}, HTTPStatus.OK)
+
+
+async def enqueue_payment(request, payment: Payment):
+    """Stores payment to the inbox table, to be applied by consumers;
+    payment which is already queued is not stored again"""
+    inbox = request.app.ctx.webhook_inbox
+    if inbox.depth >= config.WEBHOOK_QUEUE_MAX_DEPTH:
+        return busy_response(config.WEBHOOK_QUEUE_RETRY_AFTER)
+
+    async with request.app.ctx.session() as session:
+        await session.execute(ENQUEUE_PAYMENT, payment._asdict())
+        await session.commit()
+    inbox.notify()
+
+    transaction_id = str(payment.transaction_id)
+    return json(
+        {"transaction_id": transaction_id, "status": "queued"},
+        HTTPStatus.ACCEPTED,
+        headers={
+            "Location": request.app.url_for(
+                f"{webhook.name}.webhook_status",
+                transaction_id=transaction_id,
+            )
+        },
+    )
+
+
+@webhook.get("/webhook/status/<transaction_id:uuid>", name="webhook_status")
+async def get_payment_status(request, transaction_id: UUID):
+    """Returns status of payment received in queue mode: "queued" or
+    outcome of applying it; payments received synchronously (or processed
+    long ago) are reported as "accepted" if transaction exists"""
+    async with request.app.ctx.session() as session:
+        queued = await session.get(WebhookInbox, transaction_id)
+        if queued is not None:
+            return json(queued.serialize(), HTTPStatus.OK)
+        known = await session.scalar(
+            TRANSACTION_EXISTS, {"transaction_id": transaction_id}
+        )
+    if not known:
+        return json({"error": "unknown transaction"}, HTTPStatus.NOT_FOUND)
+    return json(
+        {"transaction_id": str(transaction_id), "status": "accepted"},
+        HTTPStatus.OK,
+    )
+
+
+async def recent_transaction_ids(session, limit: int) -> List[UUID]:
+    """Returns ids of last received transactions, oldest first"""
+    ids = await session.scalars(RECENT_TRANSACTION_IDS, {"limit": limit})
+    return ids.all()[::-1]
+
+
+async def apply_payments(session, payments: List[Payment]) -> Dict[UUID, str]:
+    """Applies payments (with unique transaction ids) within session's
+    transaction using constant amount of statements; returns status of every
+    payment - "accepted", "duplicate" or "invalid user id".
+    Stats rows of payments' users are locked in user id order before any
+    account is created or locked (and accounts - in id order after that),
+    which is the order credit_payment_statement takes them in as well, so
+    concurrent payments can't deadlock. As a consequence, payments to
+    different accounts of one user are serialized by user's stats row"""
+    statuses = dict()
+    known = await session.scalars(
+        KNOWN_TRANSACTIONS,
+        {"transaction_ids": [p.transaction_id for p in payments]},
+    )
+    for transaction_id in known:
+        statuses[transaction_id] = "duplicate"
+    payments = [p for p in payments if p.transaction_id not in statuses]
+    if not payments:
+        return statuses
+
+    users = set(
+        await session.scalars(
+            LOCK_USERS, {"user_ids": list({p.user_id for p in payments})}
+        )
+    )
+    new_accounts = dict()
+    for p in payments:
+        if p.user_id in users:
+            new_accounts.setdefault(p.account_id, p.user_id)
+    if new_accounts:
+        await session.execute(
+            CREATE_ACCOUNTS,
+            {
+                "account_ids": list(new_accounts.keys()),
+                "user_ids": list(new_accounts.values()),
+            },
+        )
+    owners = await session.execute(
+        LOCK_ACCOUNTS, {"account_ids": list({p.account_id for p in payments})}
+    )
+    owners = dict(owners.all())
+
+    valid = []
+    for p in payments:
+        if p.user_id in users and owners.get(p.account_id) == p.user_id:
+            valid.append(p)
+        else:
+            statuses[p.transaction_id] = "invalid user id"
+    if not valid:
+        return statuses
+
+    inserted = set(
+        await session.scalars(
+            INSERT_TRANSACTIONS,
+            {
+                "transaction_ids": [p.transaction_id for p in valid],
+                "amounts": [p.amount for p in valid],
+                "account_ids": [p.account_id for p in valid],
+                "user_ids": [p.user_id for p in valid],
+            },
+        )
+    )
+    deltas = dict()
+    for p in valid:
+        if p.transaction_id in inserted:
+            statuses[p.transaction_id] = "accepted"
+            deltas[p.account_id] = deltas.get(p.account_id, 0) + p.amount
+        else:
+            statuses[p.transaction_id] = "duplicate"
+
+    if deltas:
+        await session.execute(
+            CREDIT_ACCOUNTS,
+            {
+                "account_ids": list(deltas.keys()),
+                "amounts": list(deltas.values()),
+            },
+        )
+    return statuses
+
+
+@webhook.post("/webhook/batch", name="webhook_batch")
+@retry_decorator
+async def process_payment_batch(request):
+    """Accepts JSON array of webhook payloads and applies them in a single
+    DB transaction; returns status of every payload in the same order"""
+    try:
+        data = msgspec.json.decode(request.body, type=List[msgspec.Raw])
+    except msgspec.DecodeError:
+        data = None
+    if not data:
+        return json(
+            {"error": "expected non-empty array of payments"},
+            HTTPStatus.BAD_REQUEST,
+        )
+    if len(data) > config.WEBHOOK_BATCH_MAX_SIZE:
+        return json(
+            {
+                "error": "too many payments in batch, maximum is "
+                f"{config.WEBHOOK_BATCH_MAX_SIZE}"
+            },
+            HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+        )
+
+    seen_transactions = request.app.ctx.seen_transactions
+    # (transaction_id as sent, parsed transaction_id, status if known,
+    # outcome reported to metrics if different from status)
+    items = []
+    payments = dict()
+    for raw in data:
+        try:
+            payload = decode(raw, WebhookPayload)
+            payment = Payment.from_payload(payload)
+        except ValueError as e:
+            items.append(
+                (
+                    sent_transaction_id(raw),
+                    None,
+                    "invalid json data",
+                    invalid_outcome(e),
                 )
             )
-            account = await session.get(Account, data["account_id"])
-        trans = Transaction(
-            id=data["transaction_id"],
-            amount=float(data["amount"]),
-            account_id=int(data["account_id"]),
-            user_id=int(data["user_id"]),
+            continue
+        if payment.transaction_id in payments or seen_transactions.seen(
+            payment.transaction_id
+        ):
+            status = "duplicate"
+        else:
+            payments[payment.transaction_id] = payment
+            status = None
+        items.append(
+            (payload.transaction_id, payment.transaction_id, status, None)
         )
-        session.add(trans)
-        account.balance += data["amount"]
-        await session.commit()
 
-    return json({"message": "OK"}, HTTPStatus.OK)
+    statuses = dict()
+    if payments:
+        async with request.app.ctx.session() as session:
+            async with session.begin():
+                statuses = await apply_payments(
+                    session, list(payments.values())
+                )
+        seen_transactions.add(
+            transaction_id
+            for transaction_id, status in statuses.items()
+            if status != "invalid user id"
+        )
+        data_changed(
+            request.app,
+            *{
+                p.user_id
+                for p in payments.values()
+                if statuses[p.transaction_id] == "accepted"
+            }
+        )
+
+    results = []
+    for sent_id, transaction_id, status, outcome in items:
+        status = status or statuses[transaction_id]
+        metrics.WEBHOOK_PAYMENTS.labels(outcome or status).inc()
+        results.append({"transaction_id": sent_id, "status": status})
+    return json({"results": results}, HTTPStatus.OK)
+
+
+def invalid_outcome(error: ValueError) -> str:
+    """Outcome of rejected payload reported to metrics"""
+    if isinstance(error, InvalidSignature):
+        return "invalid signature"
+    return "invalid json data"
+
+
+def sent_transaction_id(raw: msgspec.Raw) -> Any:
+    """Returns transaction_id of invalid payload, to echo it back"""
+    try:
+        obj = msgspec.json.decode(raw)
+    except msgspec.DecodeError:
+        return None
+    return obj.get("transaction_id") if isinstance(obj, dict) else None
@@ -0,0 +1,147 @@
+"""Stress test of payments to a single "hot" account: sends many concurrent
+"/webhook" requests for one account (while payments to other accounts go
+on in parallel), checks that final balance equals the sum of payments and
+reports throughput and latencies - with account locks disabled
+("unlocked") and enabled ("locked").
+
+Requires migrated database configured the same way as for tests;
+seeded data is removed afterwards. From "src" directory run:
+
+    python -m benchmarks.hot_account --payments 500 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from decimal import Decimal
+
+from app.locks import StripedCombiner
+
+from benchmarks.load import cleanup, seed, signed_payment
+from benchmarks.utils import latency_summary
+
+import config
+
+from database.models import Account
+
+import httpx
+
+from server import create_app
+
+from sqlalchemy import select
+
+
+async def send(client, payment, latencies):
+    started = time.perf_counter()
+    response = await client.post("/webhook", json=payment)
+    latencies.append(time.perf_counter() - started)
+    return response.status_code
+
+
+async def balance(engine, account_id):
+    async with engine.connect() as conn:
+        return await conn.scalar(
+            select(Account.balance).where(Account.id == account_id)
+        )
+
+
+async def run_phase(app, clients, hot, cold, mode, args):
+    stripes = config.ACCOUNT_LOCK_STRIPES if mode == "locked" else 0
+    app.ctx.account_locks = StripedCombiner(stripes)
+    _, hot_user, [hot_account] = hot
+    balance_before = await balance(app.ctx.engine, hot_account)
+
+    hot_payments = [
+        signed_payment(hot_user, hot_account) for _ in range(args.payments)
+    ]
+    cold_payments = []
+    for _ in range(args.payments // 4):
+        _, user_id, [account_id] = random.choice(cold)
+        cold_payments.append(signed_payment(user_id, account_id))
+
+    hot_latencies, cold_latencies = [], []
+    started = time.perf_counter()
+    hot_client, cold_client = clients
+    hot_statuses, cold_statuses = await asyncio.gather(
+        asyncio.gather(
+            *(send(hot_client, p, hot_latencies) for p in hot_payments)
+        ),
+        asyncio.gather(
+            *(send(cold_client, p, cold_latencies) for p in cold_payments)
+        ),
+    )
+    elapsed = time.perf_counter() - started
+
+    expected = sum(Decimal(str(p["amount"])) for p in hot_payments)
+    credited = await balance(app.ctx.engine, hot_account) - balance_before
+    return {
+        "mode": mode,
+        "hot_rps": len(hot_payments) / elapsed,
+        "hot_errors": sum(status != 200 for status in hot_statuses),
+        "cold_errors": sum(status != 200 for status in cold_statuses),
+        "balance_ok": credited == expected,
+        "hot": latency_summary(hot_latencies),
+        "cold": latency_summary(cold_latencies),
+    }
+
+
+async def main(args):
+    app = create_app("hot-account-benchmark")
+    server = await app.create_server(
+        host="127.0.0.1", port=args.port, access_log=False
+    )
+    await server.startup()
+    await server.before_start()
+    await server.after_start()
+    await server.start_serving()
+
+    engine = app.ctx.engine
+    await cleanup(engine)
+    users = await seed(
+        engine,
+        argparse.Namespace(users=args.cold + 1, accounts=1, transactions=0),
+    )
+    # separate clients, so that cold payments don't queue on client side
+    # behind hot ones
+    clients = [
+        httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{args.port}",
+            timeout=None,
+            limits=httpx.Limits(max_connections=args.concurrency),
+        )
+        for _ in range(2)
+    ]
+    results = []
+    try:
+        for mode in ("unlocked", "locked"):
+            results.append(
+                await run_phase(app, clients, users[0], users[1:], mode, args)
+            )
+    finally:
+        for client in clients:
+            await client.aclose()
+        await cleanup(engine)
+        await server.before_stop()
+        server.close()
+        await server.wait_closed()
+        await server.after_stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--payments", type=int, default=500)
+    parser.add_argument("--cold", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--output", help="file to write JSON report to")
+    asyncio.run(main(parser.parse_args()))
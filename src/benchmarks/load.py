@@ -0,0 +1,347 @@
+"""End-to-end load benchmark: boots the application (single worker) in a
+child process, seeds database with benchmark users, accounts and
+transactions, drives a weighted mix of requests at given concurrency and
+reports throughput, latency percentiles, error rates and amount of DB
+queries per endpoint as JSON, so that runs can be compared across commits.
+
+Requires migrated database configured the same way as for tests (e.g.
+docker-compose's "postgres" service); seeded data is removed afterwards.
+From "src" directory run:
+
+    python -m benchmarks.load --duration 30 --concurrency 32 \\
+        --users 200 --mix "me=5,accounts=5,transactions=5,webhook=3,login=1"
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import multiprocessing
+import os
+import random
+import signal
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from hashlib import sha256
+
+from app.utils import generate_jwt_token
+
+from benchmarks.utils import latency_summary
+
+import config
+
+from database.engine import create_db_engine
+from database.models import Account, Transaction, User
+
+import httpx
+
+from sqlalchemy import delete, event, insert, select
+
+from tests import testvars
+
+BENCHMARK_PASSWORD = "benchmark"
+BENCHMARK_DOMAIN = "@load-benchmark.example.com"
+
+DEFAULT_MIX = (
+    "login=1,me=10,accounts=10,transactions=10,webhook=5,"
+    "admin_users=1,admin_users_accounts=1"
+)
+
+current_route = contextvars.ContextVar("current_route", default=None)
+
+
+def serve(port, ready, stats):
+    """Runs application in current process, counting DB queries per route;
+    counters are put into stats queue on shutdown"""
+    from server import create_app
+
+    app = create_app("load-benchmark")
+    queries = Counter()
+
+    def count_query(*args):
+        queries[current_route.get()] += 1
+
+    @app.before_server_start(priority=-1)
+    async def count_queries(app):
+        event.listen(
+            app.ctx.engine.sync_engine, "before_cursor_execute", count_query
+        )
+
+    @app.before_server_start(priority=-1)
+    async def disable_login_throttle(app):
+        # all simulated clients share one address
+        app.ctx.login_throttle.by_ip.rate = 0
+        app.ctx.login_throttle.by_email.rate = 0
+
+    @app.after_server_start
+    async def notify_ready(app):
+        ready.set()
+
+    @app.before_server_stop
+    async def report_queries(app):
+        stats.put(dict(queries))
+
+    @app.on_request(priority=100)
+    async def remember_route(request):
+        current_route.set(request.route.name if request.route else None)
+
+    app.run(
+        host="127.0.0.1",
+        port=port,
+        single_process=True,
+        access_log=False,
+        motd=False,
+    )
+
+
+async def seed(engine, args):
+    """Creates benchmark users with accounts and transactions;
+    returns list of (user email, user id, account ids)"""
+    password = User.hash_password(BENCHMARK_PASSWORD)
+    async with engine.begin() as conn:
+        users = await conn.execute(
+            insert(User)
+            .values(
+                [
+                    {
+                        "email": f"user{i}{BENCHMARK_DOMAIN}",
+                        "full_name": "Load Benchmark",
+                        "password": password,
+                        "is_admin": False,
+                    }
+                    for i in range(args.users)
+                ]
+            )
+            .returning(User.email, User.id)
+        )
+        users = users.all()
+        accounts = await conn.execute(
+            insert(Account)
+            .values(
+                [
+                    {"user_id": user_id, "balance": 0}
+                    for _, user_id in users
+                    for _ in range(args.accounts)
+                ]
+            )
+            .returning(Account.id, Account.user_id)
+        )
+        user_accounts = defaultdict(list)
+        for account_id, user_id in accounts:
+            user_accounts[user_id].append(account_id)
+
+        rows = [
+            {
+                "id": uuid.uuid4(),
+                "amount": random.randint(1, 10000) / 100,
+                "account_id": account_id,
+                "user_id": user_id,
+            }
+            for user_id, account_ids in user_accounts.items()
+            for account_id in account_ids
+            for _ in range(args.transactions)
+        ]
+        for i in range(0, len(rows), 5000):
+            await conn.execute(insert(Transaction), rows[i:i + 5000])
+    return [
+        (email, user_id, user_accounts[user_id]) for email, user_id in users
+    ]
+
+
+async def cleanup(engine):
+    users = select(User.id).where(User.email.endswith(BENCHMARK_DOMAIN))
+    async with engine.begin() as conn:
+        await conn.execute(
+            delete(Transaction).where(Transaction.user_id.in_(users))
+        )
+        await conn.execute(delete(Account).where(Account.user_id.in_(users)))
+        await conn.execute(delete(User).where(User.id.in_(users)))
+
+
+def signed_payment(user_id, account_id):
+    data = {
+        "transaction_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "account_id": account_id,
+        "amount": random.randint(1, 10000) / 100,
+    }
+    string = (
+        f"{data['account_id']}{data['amount']}"
+        f"{data['transaction_id']}{data['user_id']}"
+        f"{config.WEBHOOK_SECRET}"
+    )
+    data["signature"] = sha256(string.encode("utf-8")).hexdigest()
+    return data
+
+
+def build_requests(users):
+    """Returns endpoint name -> (route name, function making request kwargs)"""
+    secret = config.SANIC_SECRET
+    tokens = [generate_jwt_token(email, secret) for email, _, _ in users]
+    admin = {
+        "Authorization": "Bearer "
+        + generate_jwt_token(testvars.TEST_ADMIN_MAIL, secret)
+    }
+
+    def as_user(method, url):
+        def make():
+            token = random.choice(tokens)
+            headers = {"Authorization": f"Bearer {token}"}
+            return {"method": method, "url": url, "headers": headers}
+
+        return make
+
+    def login():
+        email, _, _ = random.choice(users)
+        body = {"email": email, "password": BENCHMARK_PASSWORD}
+        return {"method": "POST", "url": "/auth/login", "json": body}
+
+    def webhook():
+        _, user_id, account_ids = random.choice(users)
+        body = signed_payment(user_id, random.choice(account_ids))
+        return {"method": "POST", "url": "/webhook", "json": body}
+
+    def as_admin(url):
+        return lambda: {"method": "GET", "url": url, "headers": admin}
+
+    return {
+        "login": ("auth.login", login),
+        "me": ("main.personal_info", as_user("GET", "/me")),
+        "accounts": ("main.accounts_info", as_user("GET", "/accounts")),
+        "transactions": (
+            "main.transactions_info",
+            as_user("GET", "/transactions"),
+        ),
+        "webhook": ("webhook.webhook", webhook),
+        "admin_users": ("admin.user_list", as_admin("/admin/users")),
+        "admin_users_accounts": (
+            "admin.users_accounts_info",
+            as_admin("/admin/users-with-accounts"),
+        ),
+    }
+
+
+def parse_mix(mix):
+    weights = dict()
+    for item in mix.split(","):
+        name, weight = item.split("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+async def drive(args, requests, weights):
+    names = list(weights)
+    latencies = defaultdict(list)
+    errors = Counter()
+    deadline = time.perf_counter() + args.duration
+
+    async def client_loop(client):
+        while time.perf_counter() < deadline:
+            name = random.choices(names, [weights[n] for n in names])[0]
+            _, make_request = requests[name]
+            started = time.perf_counter()
+            try:
+                response = await client.request(**make_request())
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies[name].append(time.perf_counter() - started)
+            errors[name] += failed
+
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{args.port}",
+        timeout=args.timeout,
+        limits=httpx.Limits(max_connections=args.concurrency),
+    ) as client:
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(client_loop(client) for _ in range(args.concurrency))
+        )
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+async def run(args):
+    weights = parse_mix(args.mix)
+    engine = create_db_engine()
+    await cleanup(engine)
+    users = await seed(engine, args)
+
+    ctx = multiprocessing.get_context("spawn")
+    ready, stats = ctx.Event(), ctx.Queue()
+    server = ctx.Process(target=serve, args=(args.port, ready, stats))
+    server.start()
+    try:
+        if not await asyncio.to_thread(ready.wait, 60):
+            raise RuntimeError("server didn't start in time")
+        requests = build_requests(users)
+        unknown = set(weights) - set(requests)
+        if unknown:
+            raise ValueError(f"unknown endpoints in mix: {unknown}")
+        latencies, errors, elapsed = await drive(args, requests, weights)
+    finally:
+        if server.is_alive():
+            os.kill(server.pid, signal.SIGINT)
+        queries = dict()
+        if ready.is_set():
+            queries = await asyncio.to_thread(stats.get, True, 30)
+        await asyncio.to_thread(server.join, 30)
+        if not args.keep_data:
+            await cleanup(engine)
+        await engine.dispose()
+
+    report = {
+        "duration_s": elapsed,
+        "concurrency": args.concurrency,
+        "seed": {
+            "users": args.users,
+            "accounts_per_user": args.accounts,
+            "transactions_per_account": args.transactions,
+        },
+        "total_rps": sum(map(len, latencies.values())) / elapsed,
+        "endpoints": dict(),
+    }
+    for name in weights:
+        route, _ = requests[name]
+        count = len(latencies[name])
+        report["endpoints"][name] = {
+            "requests": count,
+            "rps": count / elapsed,
+            "error_rate": errors[name] / count if count else 0.0,
+            "db_queries_per_request": (
+                queries.get(f"load-benchmark.{route}", 0) / count
+                if count
+                else 0.0
+            ),
+            **latency_summary(latencies[name]),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--accounts", type=int, default=2)
+    parser.add_argument("--transactions", type=int, default=50)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", help="file to write JSON report to")
+    parser.add_argument("--keep-data", action="store_true")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
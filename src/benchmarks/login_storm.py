@@ -0,0 +1,110 @@
+"""Measures latency of "/accounts" requests served while a worker handles
+a storm of logins - with bcrypt running inline on the event loop ("inline"
+mode, behaviour before offloading) and on the hashing thread pool ("pool").
+
+Requires migrated database configured the same way as for tests;
+from "src" directory run:
+
+    python -m benchmarks.login_storm --logins 20 --polls 50
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from benchmarks.utils import percentile
+
+from database.hashing import password_hasher
+
+import httpx
+
+from server import create_app
+
+from tests import testvars
+
+CREDENTIALS = {
+    "email": testvars.TEST_USER_MAIL,
+    "password": testvars.TEST_USER_PASS,
+}
+
+
+async def poll_accounts(client, token, polls, interval):
+    latencies = []
+    for _ in range(polls):
+        started = time.perf_counter()
+        response = await client.get(
+            "/accounts", headers={"Authorization": f"Bearer {token}"}
+        )
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def login(client):
+    started = time.perf_counter()
+    response = await client.post("/auth/login", json=CREDENTIALS)
+    return response.status_code, time.perf_counter() - started
+
+
+async def run_phase(client, token, mode, args):
+    password_hasher.offload = mode == "pool"
+    polling = asyncio.create_task(
+        poll_accounts(client, token, args.polls, args.interval)
+    )
+    logins = await asyncio.gather(*(login(client) for _ in range(args.logins)))
+    latencies = await polling
+    return {
+        "mode": mode,
+        "accounts_p50_ms": percentile(latencies, 0.5) * 1000,
+        "accounts_p95_ms": percentile(latencies, 0.95) * 1000,
+        "accounts_max_ms": max(latencies) * 1000,
+        "logins_ok": sum(status == 200 for status, _ in logins),
+        "logins_busy": sum(status == 503 for status, _ in logins),
+        "login_max_ms": max(elapsed for _, elapsed in logins) * 1000,
+    }
+
+
+async def main(args):
+    app = create_app("login-storm-benchmark")
+    server = await app.create_server(
+        host="127.0.0.1", port=args.port, access_log=False
+    )
+    await server.startup()
+    await server.before_start()
+    # the storm is made of the same user's logins on purpose
+    app.ctx.login_throttle.by_ip.rate = 0
+    app.ctx.login_throttle.by_email.rate = 0
+    await server.after_start()
+    await server.start_serving()
+
+    results = []
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{args.port}",
+            timeout=None,
+            limits=httpx.Limits(max_connections=args.logins + 1),
+        ) as client:
+            response = await client.post("/auth/login", json=CREDENTIALS)
+            token = response.json()["access_token"]
+            for mode in ("inline", "pool"):
+                results.append(await run_phase(client, token, mode, args))
+    finally:
+        await server.before_stop()
+        server.close()
+        await server.wait_closed()
+        await server.after_stop()
+
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=20)
+    parser.add_argument("--polls", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.02)
+    parser.add_argument("--port", type=int, default=8765)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,196 @@
+"""Compares CPU time, wall time and peak memory of building GET responses
+the former way (full ORM entities loaded through session and serialized
+into dicts - "orm") and with read-only Core queries returning Struct rows
+("core"), for a 10k-transaction page and for users listings.
+
+Requires migrated database configured the same way as for tests;
+seeded data is removed afterwards. From "src" directory run:
+
+    python -m benchmarks.read_path --users 5000 --transactions 10000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+from app.encoding import dumps
+
+from benchmarks.load import cleanup, seed
+
+import config
+
+from database import queries
+from database.engine import create_db_engine
+from database.models import Account, Transaction, User, UserStats
+
+from sqlalchemy import false, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+
+def serialize_with_stats(user, stats):
+    data = user.serialize()
+    data["stats"] = stats.serialize() if stats is not None else None
+    return data
+
+
+def with_accounts(user, stats, accounts):
+    return {**serialize_with_stats(user, stats), "accounts": accounts}
+
+
+async def orm_transactions(engine, session, user_id, limit):
+    async with session() as s:
+        transactions = (
+            await s.scalars(
+                select(Transaction)
+                .where(Transaction.user_id == user_id, Transaction.seq > 0)
+                .order_by(Transaction.seq)
+                .limit(limit + 1)
+            )
+        ).all()
+    return dumps({"transactions": [t.serialize() for t in transactions]})
+
+
+async def core_transactions(engine, session, user_id, limit):
+    async with engine.connect() as conn:
+        transactions, _ = await queries.transactions_page(
+            conn, user_id, 0, limit
+        )
+    return dumps({"transactions": transactions})
+
+
+async def orm_users(engine, session, user_id, limit):
+    async with session() as s:
+        rows = await s.execute(
+            select(User, UserStats)
+            .join(UserStats, isouter=True)
+            .order_by(User.is_admin, User.id)
+        )
+    return dumps([serialize_with_stats(user, stats) for user, stats in rows])
+
+
+async def core_users(engine, session, user_id, limit):
+    async with engine.connect() as conn:
+        rows = await conn.execute(queries.USERS_QUERY)
+    return dumps([queries.user_row(row) for row in rows])
+
+
+async def orm_users_accounts(engine, session, user_id, limit):
+    data, user, stats, accounts = [], None, None, []
+    async with session() as s:
+        rows = await s.execute(
+            select(User, UserStats, Account)
+            .join(UserStats, isouter=True)
+            .join(User.accounts, isouter=True)
+            .where(User.is_admin == false())
+            .order_by(User.id, Account.id)
+        )
+        for row in rows:
+            if user is not None and row.User.id != user.id:
+                data.append(with_accounts(user, stats, accounts))
+                accounts = []
+            user, stats = row.User, row.UserStats
+            if row.Account is not None:
+                accounts.append(row.Account.serialize())
+    if user is not None:
+        data.append(with_accounts(user, stats, accounts))
+    return dumps(data)
+
+
+async def core_users_accounts(engine, session, user_id, limit):
+    async with engine.connect() as conn:
+        rows = await conn.stream(
+            queries.USERS_ACCOUNTS_QUERY.execution_options(
+                yield_per=config.STREAM_CHUNK_SIZE
+            )
+        )
+        data = [user async for user in queries.users_with_accounts(rows)]
+    return dumps(data)
+
+
+CASES = {
+    "transactions": (orm_transactions, core_transactions),
+    "users": (orm_users, core_users),
+    "users_with_accounts": (orm_users_accounts, core_users_accounts),
+}
+
+
+async def measure(function, args, repeat):
+    # warm up statement caches
+    body = await function(*args)
+    cpu, wall = [], []
+    for _ in range(repeat):
+        started, started_cpu = time.perf_counter(), time.process_time()
+        await function(*args)
+        wall.append(time.perf_counter() - started)
+        cpu.append(time.process_time() - started_cpu)
+    tracemalloc.start()
+    await function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "wall_ms": statistics.median(wall) * 1000,
+        "cpu_ms": statistics.median(cpu) * 1000,
+        "peak_memory_kb": peak / 1024,
+        "body_bytes": len(body),
+    }
+
+
+async def main(args):
+    engine = create_db_engine()
+    session = async_sessionmaker(bind=engine)
+    await cleanup(engine)
+    users = await seed(
+        engine,
+        argparse.Namespace(users=args.users, accounts=2, transactions=0),
+    )
+    _, user_id, account_ids = users[0]
+    async with engine.begin() as conn:
+        await conn.execute(
+            insert(Transaction),
+            [
+                {
+                    "id": uuid.uuid4(),
+                    "amount": random.randint(1, 10000) / 100,
+                    "account_id": random.choice(account_ids),
+                    "user_id": user_id,
+                }
+                for _ in range(args.transactions)
+            ],
+        )
+
+    results = []
+    try:
+        for name, (orm, core) in CASES.items():
+            function_args = (engine, session, user_id, args.transactions)
+            results.append(
+                {
+                    "case": name,
+                    "orm": await measure(orm, function_args, args.repeat),
+                    "core": await measure(core, function_args, args.repeat),
+                }
+            )
+    finally:
+        await cleanup(engine)
+        await engine.dispose()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--transactions", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", help="file to write JSON report to")
+    asyncio.run(main(parser.parse_args()))
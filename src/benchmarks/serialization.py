@@ -0,0 +1,154 @@
+"""Micro-benchmark of JSON encoding of large list responses: 10k-row
+"/transactions", "/admin/users" and "/admin/users-with-accounts" bodies
+encoded the former way (models turned into dicts with Decimal balances,
+encoded by Sanic's default ujson-based dumps - "legacy") and by the app's
+encoder, which encodes Decimal and UUID values natively ("encoder").
+
+Doesn't need database; from "src" directory run:
+
+    python -m benchmarks.serialization --rows 10000
+"""
+
+import argparse
+import datetime
+import json
+import sys
+import timeit
+from decimal import Decimal
+from uuid import uuid4
+
+from app.encoding import dumps
+
+from database.models import Account, Transaction, User, UserStats
+
+from sanic.response import json_dumps
+
+
+def legacy_transaction(transaction):
+    return {
+        "id": str(transaction.id),
+        "amount": transaction.amount,
+        "account_id": transaction.account_id,
+    }
+
+
+def serialize_with_stats(user, stats):
+    data = user.serialize()
+    data["stats"] = stats.serialize() if stats is not None else None
+    return data
+
+
+def build_rows(count):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    users = [
+        (
+            User(
+                id=i,
+                email=f"user{i}@example.com",
+                full_name="Jane Doe",
+                is_admin=False,
+            ),
+            UserStats(
+                user_id=i,
+                total_balance=Decimal("1234.50"),
+                account_count=2,
+                transaction_count=10,
+                last_transaction_at=now,
+            ),
+        )
+        for i in range(count)
+    ]
+    # two accounts per user
+    accounts = [
+        Account(id=i, balance=Decimal("617.25"), user_id=i // 2)
+        for i in range(count)
+    ]
+    transactions = [
+        Transaction(id=uuid4(), amount=Decimal("10.99"), account_id=i)
+        for i in range(count)
+    ]
+    return users, accounts, transactions
+
+
+def cases(users, accounts, transactions):
+    def with_accounts():
+        return [
+            {
+                **serialize_with_stats(user, stats),
+                "accounts": [
+                    account.serialize()
+                    for account in accounts[2 * i:2 * i + 2]
+                ],
+            }
+            for i, (user, stats) in enumerate(users[: len(users) // 2])
+        ]
+
+    return {
+        "transactions": (
+            lambda: json_dumps(
+                {
+                    "transactions": [
+                        legacy_transaction(t) for t in transactions
+                    ],
+                    "next_cursor": None,
+                }
+            ),
+            lambda: dumps(
+                {
+                    "transactions": [t.serialize() for t in transactions],
+                    "next_cursor": None,
+                }
+            ),
+        ),
+        "users": (
+            lambda: json_dumps(
+                [serialize_with_stats(user, stats) for user, stats in users]
+            ),
+            lambda: dumps(
+                [serialize_with_stats(user, stats) for user, stats in users]
+            ),
+        ),
+        "users_with_accounts": (
+            lambda: json_dumps(with_accounts()),
+            lambda: dumps(with_accounts()),
+        ),
+    }
+
+
+def measure(function, number):
+    """Milliseconds per response"""
+    return min(timeit.repeat(function, number=number, repeat=5)) * (
+        1000 / number
+    )
+
+
+def main(args):
+    rows = build_rows(args.rows)
+    results = []
+    for name, (legacy, encoder) in cases(*rows).items():
+        legacy_ms = measure(legacy, args.number)
+        encoder_ms = measure(encoder, args.number)
+        results.append(
+            {
+                "case": name,
+                "rows": args.rows,
+                "legacy_ms": legacy_ms,
+                "encoder_ms": encoder_ms,
+                "speedup": legacy_ms / encoder_ms,
+            }
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--number", type=int, default=10)
+    parser.add_argument("--output", help="file to write JSON report to")
+    main(parser.parse_args())
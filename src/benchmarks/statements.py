@@ -0,0 +1,129 @@
+"""Compares Python CPU time per query on the hot auth and webhook paths:
+statements built for every call the former way ("built" - user lookup
+construct, and webhook's credit statement, which SQLAlchemy can't cache
+and compiles on every execution) against module-level prebuilt ones
+executed with parameters ("prebuilt").
+
+Requires migrated database configured the same way as for tests; credits
+are rolled back and seeded data is removed afterwards. From "src"
+directory run:
+
+    python -m benchmarks.statements --number 2000
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+import uuid
+from decimal import Decimal
+
+from app.webhook import CREDIT_PAYMENT, credit_payment_statement
+
+from benchmarks.load import cleanup, seed
+
+from database.engine import create_db_engine
+from database.models import User
+from database.statements import USER_BY_EMAIL
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+
+async def built_user(session, email, payment):
+    async with session() as s:
+        return await s.scalar(select(User).where(User.email == email))
+
+
+async def prebuilt_user(session, email, payment):
+    async with session() as s:
+        return await s.scalar(USER_BY_EMAIL, {"email": email})
+
+
+async def built_credit(session, email, payment):
+    async with session() as s:
+        params = {**payment, "transaction_id": uuid.uuid4()}
+        await s.execute(credit_payment_statement(), params)
+        await s.rollback()
+
+
+async def prebuilt_credit(session, email, payment):
+    async with session() as s:
+        params = {**payment, "transaction_id": uuid.uuid4()}
+        await s.execute(CREDIT_PAYMENT, params)
+        await s.rollback()
+
+
+CASES = {
+    "auth_user_lookup": (built_user, prebuilt_user),
+    "webhook_credit": (built_credit, prebuilt_credit),
+}
+
+
+async def measure(function, args, number, repeat):
+    """Median over repeats of CPU and wall microseconds per call"""
+    await function(*args)  # warm up statement caches
+    cpu, wall = [], []
+    for _ in range(repeat):
+        started, started_cpu = time.perf_counter(), time.process_time()
+        for _ in range(number):
+            await function(*args)
+        wall.append((time.perf_counter() - started) / number)
+        cpu.append((time.process_time() - started_cpu) / number)
+    return {
+        "cpu_us": statistics.median(cpu) * 1e6,
+        "wall_us": statistics.median(wall) * 1e6,
+    }
+
+
+async def main(args):
+    engine = create_db_engine()
+    session = async_sessionmaker(bind=engine)
+    await cleanup(engine)
+    [(email, user_id, account_ids)] = await seed(
+        engine, argparse.Namespace(users=1, accounts=1, transactions=0)
+    )
+    payment = {
+        "user_id": user_id,
+        "account_id": account_ids[0],
+        "amount": Decimal("10.50"),
+    }
+
+    results = []
+    try:
+        for name, (built, prebuilt) in CASES.items():
+            function_args = (session, email, payment)
+            before = await measure(
+                built, function_args, args.number, args.repeat
+            )
+            after = await measure(
+                prebuilt, function_args, args.number, args.repeat
+            )
+            results.append(
+                {
+                    "case": name,
+                    "built": before,
+                    "prebuilt": after,
+                    "cpu_speedup": before["cpu_us"] / after["cpu_us"],
+                }
+            )
+    finally:
+        await cleanup(engine)
+        await engine.dispose()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="file to write JSON report to")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,19 @@
+import statistics
+from typing import Dict, List
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """Latency percentiles in milliseconds"""
+    if not latencies:
+        return {}
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
@@ -0,0 +1,167 @@
+"""Micro-benchmark of request body validation: per-request cost of the
+former path (JSON parsed into dict, then validated with regex pattern
+strings, then fields parsed again by the handler - "legacy") against
+decoding into typed schemas in a single pass ("schema").
+
+Doesn't need database; from "src" directory run:
+
+    python -m benchmarks.validation --number 100000
+"""
+
+import argparse
+import json
+import re
+import sys
+import timeit
+from decimal import Decimal
+from hashlib import sha256
+from uuid import UUID, uuid4
+
+from app.schemas import LoginCredentials, UserData, WebhookPayload, decode
+from app.webhook import Payment
+
+import config
+
+import ujson
+
+
+def legacy_login(body):
+    credentials = ujson.loads(body)
+    if (
+        "email" not in credentials.keys()
+        or "password" not in credentials.keys()
+    ):
+        raise ValueError("invalid credentials list")
+    return credentials["email"], credentials["password"]
+
+
+def legacy_user_data(body):
+    data = ujson.loads(body)
+    keys = data.keys()
+    if not data or not {"password", "email"}.issubset(keys):
+        raise ValueError("missing email and/or password")
+    if not re.fullmatch(
+        r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$", data["email"]
+    ):
+        raise ValueError("invalid email format")
+    if not re.fullmatch(
+        r"""^[A-Za-z0-9!@#$%^&*()_+=\-"'<>,./\\|{}\[\]:;`~]+$""",
+        data["password"],
+    ):
+        raise ValueError("invalid password value")
+    if "full_name" in keys and not re.fullmatch(
+        r"^[A-Za-z]+(?:\s[A-Za-z]+)*$", data["full_name"].strip()
+    ):
+        raise ValueError("invalid full_name value")
+    # handler normalized the same fields again
+    if "full_name" in keys:
+        data["full_name"] = data["full_name"].strip()
+    data["is_admin"] = str(data.get("is_admin")).lower() in [
+        "true",
+        "1",
+        "yes",
+        "y",
+    ]
+    return data
+
+
+def legacy_payment(body):
+    data = ujson.loads(body)
+    required_keys = {
+        "transaction_id",
+        "user_id",
+        "account_id",
+        "amount",
+        "signature",
+    }
+    if not all(field in data.keys() for field in required_keys):
+        raise ValueError("invalid json data")
+    UUID(data["transaction_id"])
+    int(data["account_id"])
+    int(data["user_id"])
+    float(data["amount"])
+    string = (
+        f"{data['account_id']}{data['amount']}"
+        f"{data['transaction_id']}{data['user_id']}"
+        f"{config.WEBHOOK_SECRET}"
+    )
+    if sha256(string.encode("utf-8")).hexdigest() != data["signature"]:
+        raise ValueError("invalid json data")
+    return Payment(
+        UUID(data["transaction_id"]),
+        int(data["user_id"]),
+        int(data["account_id"]),
+        Decimal(str(data["amount"])),
+    )
+
+
+def schema_payment(body):
+    return Payment.from_payload(decode(body, WebhookPayload))
+
+
+def payment_body():
+    data = {
+        "transaction_id": str(uuid4()),
+        "user_id": 1,
+        "account_id": 1,
+        "amount": 100.5,
+    }
+    string = (
+        f"{data['account_id']}{data['amount']}"
+        f"{data['transaction_id']}{data['user_id']}"
+        f"{config.WEBHOOK_SECRET}"
+    )
+    data["signature"] = sha256(string.encode("utf-8")).hexdigest()
+    return json.dumps(data).encode()
+
+
+CASES = {
+    "login": (
+        b'{"email": "user@example.com", "password": "secret_password"}',
+        legacy_login,
+        lambda body: decode(body, LoginCredentials),
+    ),
+    "user_data": (
+        b'{"email": "user@example.com", "password": "secret_password",'
+        b' "full_name": "  Jane Doe ", "is_admin": "yes"}',
+        legacy_user_data,
+        lambda body: decode(body, UserData),
+    ),
+    "webhook": (payment_body(), legacy_payment, schema_payment),
+}
+
+
+def measure(function, body, number):
+    """Microseconds per call"""
+    return min(timeit.repeat(lambda: function(body), number=number)) * (
+        1e6 / number
+    )
+
+
+def main(args):
+    results = []
+    for name, (body, legacy, schema) in CASES.items():
+        legacy_us = measure(legacy, body, args.number)
+        schema_us = measure(schema, body, args.number)
+        results.append(
+            {
+                "case": name,
+                "legacy_us": legacy_us,
+                "schema_us": schema_us,
+                "speedup": legacy_us / schema_us,
+            }
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=100000)
+    parser.add_argument("--output", help="file to write JSON report to")
+    main(parser.parse_args())
@@ -16,6 +16,13 @@ def load_environ():
         logging.warning(".env file not found")
 
 
+def env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ["true", "1", "yes", "y"]
+
+
 load_environ()
 
 SANIC_SECRET: Final = os.getenv("SANIC_SECRET")
@@ -26,4 +33,104 @@ POSTGRES_USER: Final = os.getenv("POSTGRES_USER")
 POSTGRES_PASSWORD: Final = os.getenv("POSTGRES_PASSWORD")
 HOST: Final = os.getenv("HOST", "localhost")
 
+DB_POOL_SIZE: Final = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW: Final = int(os.getenv("DB_MAX_OVERFLOW", 5))
+DB_POOL_TIMEOUT: Final = float(os.getenv("DB_POOL_TIMEOUT", 10))
+DB_POOL_RECYCLE: Final = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING: Final = env_flag("DB_POOL_PRE_PING")
+DB_STATEMENT_CACHE_SIZE: Final = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 500))
+
+# adaptive limit of concurrent database work per worker (sessions and read
+# connections); work over it waits up to ADMISSION_MAX_WAIT seconds for a
+# slot and is rejected with 503 then, instead of queueing for the pool.
+# Limit follows execution time of queries: it shrinks while it exceeds
+# ADMISSION_TOLERANCE times time of unloaded queries and grows back otherwise
+ADMISSION_CONTROL: Final = env_flag("ADMISSION_CONTROL")
+ADMISSION_INITIAL_LIMIT: Final = int(
+    os.getenv("ADMISSION_INITIAL_LIMIT", DB_POOL_SIZE)
+)
+ADMISSION_MIN_LIMIT: Final = int(os.getenv("ADMISSION_MIN_LIMIT", 2))
+ADMISSION_MAX_LIMIT: Final = int(
+    os.getenv("ADMISSION_MAX_LIMIT", DB_POOL_SIZE + DB_MAX_OVERFLOW)
+)
+ADMISSION_TOLERANCE: Final = float(os.getenv("ADMISSION_TOLERANCE", 2))
+ADMISSION_MAX_WAIT: Final = float(os.getenv("ADMISSION_MAX_WAIT", 2))
+ADMISSION_RETRY_AFTER: Final = int(os.getenv("ADMISSION_RETRY_AFTER", 1))
+
+# optional read replica (same database name and credentials as primary)
+# serving read-only queries of GET endpoints
+REPLICA_HOST: Final = os.getenv("REPLICA_HOST")
+REPLICA_PORT: Final = (
+    int(os.getenv("REPLICA_PORT")) if os.getenv("REPLICA_PORT") else None
+)
+REPLICA_CONNECT_TIMEOUT: Final = float(
+    os.getenv("REPLICA_CONNECT_TIMEOUT", 2)
+)
+# seconds to read from primary after replica failed to give connection
+REPLICA_RETRY_INTERVAL: Final = float(os.getenv("REPLICA_RETRY_INTERVAL", 10))
+# seconds to read user's data from primary after it was written
+READ_YOUR_WRITES_WINDOW: Final = float(
+    os.getenv("READ_YOUR_WRITES_WINDOW", 5)
+)
+
+USER_CACHE_SIZE: Final = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL: Final = float(os.getenv("USER_CACHE_TTL", 60))
+
+# token buckets of login attempts per client address and per email:
+# refill rate (attempts per minute; 0 disables the limit) and burst size
+LOGIN_IP_RATE: Final = float(os.getenv("LOGIN_IP_RATE", 60))
+LOGIN_IP_BURST: Final = float(os.getenv("LOGIN_IP_BURST", 30))
+LOGIN_EMAIL_RATE: Final = float(os.getenv("LOGIN_EMAIL_RATE", 6))
+LOGIN_EMAIL_BURST: Final = float(os.getenv("LOGIN_EMAIL_BURST", 10))
+
+PASSWORD_HASHER_OFFLOAD: Final = env_flag("PASSWORD_HASHER_OFFLOAD", True)
+PASSWORD_HASHER_THREADS: Final = int(os.getenv("PASSWORD_HASHER_THREADS", 2))
+PASSWORD_HASHER_QUEUE: Final = int(os.getenv("PASSWORD_HASHER_QUEUE", 32))
+PASSWORD_HASHER_RETRY_AFTER: Final = int(
+    os.getenv("PASSWORD_HASHER_RETRY_AFTER", 1)
+)
+
+WEBHOOK_BATCH_MAX_SIZE: Final = int(os.getenv("WEBHOOK_BATCH_MAX_SIZE", 1000))
+WEBHOOK_SEEN_CACHE_SIZE: Final = int(
+    os.getenv("WEBHOOK_SEEN_CACHE_SIZE", 50000)
+)
+RETRY_ATTEMPTS: Final = int(os.getenv("RETRY_ATTEMPTS", 3))
+RETRY_BASE_DELAY: Final = float(os.getenv("RETRY_BASE_DELAY", 0.05))
+RETRY_MAX_DELAY: Final = float(os.getenv("RETRY_MAX_DELAY", 1))
+RETRY_BUDGET_RATIO: Final = float(os.getenv("RETRY_BUDGET_RATIO", 0.1))
+RETRY_BUDGET_MIN_PER_SECOND: Final = float(
+    os.getenv("RETRY_BUDGET_MIN_PER_SECOND", 1)
+)
+
+# locks serializing payments to the same account within a worker
+ACCOUNT_LOCK_STRIPES: Final = int(os.getenv("ACCOUNT_LOCK_STRIPES", 1024))
+# "sync" applies payments within request, "queue" stores them to the inbox
+# table, answers 202 and leaves applying to background consumers
+WEBHOOK_MODE: Final = os.getenv("WEBHOOK_MODE", "sync")
+WEBHOOK_QUEUE_BATCH_SIZE: Final = int(
+    os.getenv("WEBHOOK_QUEUE_BATCH_SIZE", 500)
+)
+WEBHOOK_QUEUE_LINGER: Final = float(os.getenv("WEBHOOK_QUEUE_LINGER", 0.05))
+WEBHOOK_QUEUE_POLL_INTERVAL: Final = float(
+    os.getenv("WEBHOOK_QUEUE_POLL_INTERVAL", 1)
+)
+WEBHOOK_QUEUE_MAX_DEPTH: Final = int(
+    os.getenv("WEBHOOK_QUEUE_MAX_DEPTH", 100000)
+)
+WEBHOOK_QUEUE_RETRY_AFTER: Final = int(
+    os.getenv("WEBHOOK_QUEUE_RETRY_AFTER", 1)
+)
+WEBHOOK_INBOX_RETENTION: Final = float(
+    os.getenv("WEBHOOK_INBOX_RETENTION", 86400)
+)
+
+PAGE_SIZE: Final = int(os.getenv("PAGE_SIZE", 100))
+MAX_PAGE_SIZE: Final = int(os.getenv("MAX_PAGE_SIZE", 1000))
+STREAM_CHUNK_SIZE: Final = int(os.getenv("STREAM_CHUNK_SIZE", 500))
+# "msgspec" or "ujson" (Sanic's default encoder)
+JSON_ENCODER: Final = os.getenv("JSON_ENCODER", "msgspec")
+
 ACCESS_TOKEN_EXP_TIME: datetime.timedelta = datetime.timedelta(minutes=15)
+REFRESH_TOKEN_EXP_TIME: datetime.timedelta = datetime.timedelta(
+    days=float(os.getenv("REFRESH_TOKEN_EXP_DAYS", 30))
+)
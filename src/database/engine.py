@@ -1,8 +1,9 @@
+import asyncio
+
 import config
 
 from sqlalchemy import URL
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
 
 url_object = URL.create(
@@ -12,4 +13,80 @@ url_object = URL.create(
     host=config.HOST,
     database=config.POSTGRES_DB,
 )
-engine = create_async_engine(url_object, poolclass=NullPool)
+
+
+replica_url_object = (
+    URL.create(
+        "postgresql+asyncpg",
+        username=config.POSTGRES_USER,
+        password=config.POSTGRES_PASSWORD,
+        host=config.REPLICA_HOST,
+        port=config.REPLICA_PORT,
+        database=config.POSTGRES_DB,
+    )
+    if config.REPLICA_HOST
+    else None
+)
+
+
+def create_db_engine(url: URL = url_object) -> AsyncEngine:
+    """Creates pooled engine; must be called once per worker process,
+    as asyncpg connections are bound to the event loop they were opened in"""
+    return create_async_engine(
+        url,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_pre_ping=config.DB_POOL_PRE_PING,
+        connect_args={
+            "prepared_statement_cache_size": config.DB_STATEMENT_CACHE_SIZE,
+        },
+    )
+
+
+def create_replica_engine(url: URL = replica_url_object) -> AsyncEngine:
+    """Creates engine of read replica; its connections are pinged on
+    checkout and opened with short timeout, so that replica going down
+    is noticed when connection is requested and reads can fall back
+    to the primary"""
+    return create_async_engine(
+        url,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        connect_args={
+            "prepared_statement_cache_size": config.DB_STATEMENT_CACHE_SIZE,
+            "timeout": config.REPLICA_CONNECT_TIMEOUT,
+        },
+    )
+
+
+async def warm_up(engine: AsyncEngine, connections: int = None) -> None:
+    """Opens pool's base connections up front, so that the first requests
+    served by worker don't pay for connection establishment"""
+    if connections is None:
+        connections = engine.pool.size()
+
+    async def checkout():
+        conn = await engine.connect()
+        try:
+            await conn.exec_driver_sql("SELECT 1")
+        except BaseException:
+            await conn.close()
+            raise
+        return conn
+
+    # connections that did open are returned to the pool even if others
+    # failed, before the first failure is raised
+    results = await asyncio.gather(
+        *(checkout() for _ in range(connections)), return_exceptions=True
+    )
+    for result in results:
+        if not isinstance(result, BaseException):
+            await result.close()
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
@@ -0,0 +1,69 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+import metrics
+
+
+class HasherBusyError(Exception):
+    """Raised when too many password operations are already pending"""
+
+
+class PasswordHasher:
+    """Runs bcrypt calls on a small dedicated thread pool (bcrypt releases
+    the GIL), so they don't block worker's event loop; when amount of pending
+    calls reaches the limit, new ones are rejected right away"""
+
+    def __init__(
+        self,
+        max_workers: int = config.PASSWORD_HASHER_THREADS,
+        max_pending: int = config.PASSWORD_HASHER_QUEUE,
+        offload: bool = config.PASSWORD_HASHER_OFFLOAD,
+    ):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.offload = offload
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None
+
+    async def run(self, func, *args):
+        if not self.offload:
+            return self._timed(func, *args)
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            metrics.PASSWORD_HASH_REJECTED.inc()
+            raise HasherBusyError("too many pending password operations")
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="bcrypt"
+            )
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, self._timed, func, *args
+            )
+        finally:
+            self.pending -= 1
+
+    @staticmethod
+    def _timed(func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            metrics.PASSWORD_HASH_DURATION.observe(
+                time.perf_counter() - started
+            )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
@@ -1,9 +1,23 @@
 import uuid
+from datetime import datetime
 from typing import Any, Dict, List, Optional
 
 import bcrypt
 
-from sqlalchemy import Column, ForeignKey, Numeric
+from database.hashing import password_hasher
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    ForeignKey,
+    Identity,
+    Index,
+    Numeric,
+    String,
+    func,
+    text,
+)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import (
     DeclarativeBase,
@@ -48,6 +62,12 @@ class User(Base):
         )
         return pwhash.decode(encoding="utf-8")
 
+    @staticmethod
+    async def hash_password_async(password: str) -> str:
+        """Same as hash_password, but doesn't block event loop;
+        raises HasherBusyError if hashing pool is saturated"""
+        return await password_hasher.run(User.hash_password, password)
+
     def set_password(self, password: str):
         self.password = type(self).hash_password(password)
 
@@ -55,6 +75,15 @@ class User(Base):
         bpass = password.encode("utf-8")
         return bcrypt.checkpw(bpass, self.password.encode(encoding="utf-8"))
 
+    async def verify_password_async(self, password: str) -> bool:
+        """Same as verify_password, but doesn't block event loop;
+        raises HasherBusyError if hashing pool is saturated"""
+        return await password_hasher.run(
+            bcrypt.checkpw,
+            password.encode("utf-8"),
+            self.password.encode(encoding="utf-8"),
+        )
+
     def serialize(self) -> Dict[str, Any]:
         return {
             "id": self.id,
@@ -69,7 +98,7 @@ class Account(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     balance: Mapped[float] = mapped_column(Numeric(12, 2), default=0.0)
 
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), index=True)
     user: Mapped["User"] = relationship(
         back_populates="accounts", foreign_keys=[user_id]
     )
@@ -87,10 +116,15 @@ class Account(Base):
 
 class Transaction(Base):
     __tablename__ = "transaction"
+    __table_args__ = (Index("ix_transaction_user_id_seq", "user_id", "seq"),)
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     amount: Mapped[float] = mapped_column(Numeric(12, 2))
+    # insertion order, as UUID primary key has none; used for pagination
+    seq: Mapped[int] = mapped_column(BigInteger, Identity())
 
-    account_id: Mapped[int] = mapped_column(ForeignKey("account.id"))
+    account_id: Mapped[int] = mapped_column(
+        ForeignKey("account.id"), index=True
+    )
     account: Mapped["Account"] = relationship(back_populates="transactions")
 
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
@@ -98,12 +132,99 @@ class Transaction(Base):
 
     def serialize(self):
         return {
-            "id": str(self.id),
+            "id": self.id,
             "amount": self.amount,
             "account_id": self.account_id,
         }
 
 
+class UserStats(Base):
+    """Aggregates over user's accounts and transactions; rows are created and
+    updated only by database triggers (see "add user stats" migration)"""
+
+    __tablename__ = "user_stats"
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
+    )
+    total_balance: Mapped[float] = mapped_column(
+        Numeric(14, 2), server_default="0"
+    )
+    account_count: Mapped[int] = mapped_column(server_default="0")
+    transaction_count: Mapped[int] = mapped_column(
+        BigInteger, server_default="0"
+    )
+    last_transaction_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True)
+    )
+
+    def serialize(self) -> Dict[str, Any]:
+        last_transaction_at = self.last_transaction_at
+        return {
+            "total_balance": self.total_balance,
+            "account_count": self.account_count,
+            "transaction_count": self.transaction_count,
+            "last_transaction_at": (
+                last_transaction_at.isoformat()
+                if last_transaction_at is not None
+                else None
+            ),
+        }
+
+
+class WebhookInbox(Base):
+    """Payments received by "/webhook" in queue mode; they are applied by
+    background consumers, which record the outcome in "status" """
+
+    __tablename__ = "webhook_inbox"
+    __table_args__ = (
+        Index(
+            "ix_webhook_inbox_queued",
+            "received_at",
+            postgresql_where=text("status = 'queued'"),
+        ),
+    )
+    transaction_id = Column(UUID(as_uuid=True), primary_key=True)
+    user_id: Mapped[int]
+    account_id: Mapped[int]
+    amount: Mapped[float] = mapped_column(Numeric(12, 2))
+    status: Mapped[str] = mapped_column(server_default="queued")
+    received_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+    processed_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True)
+    )
+
+    def serialize(self) -> Dict[str, Any]:
+        processed_at = self.processed_at
+        return {
+            "transaction_id": str(self.transaction_id),
+            "status": self.status,
+            "received_at": self.received_at.isoformat(),
+            "processed_at": (
+                processed_at.isoformat() if processed_at is not None else None
+            ),
+        }
+
+
+class RefreshToken(Base):
+    """Refresh tokens issued on login; only SHA-256 of the token is stored.
+    Every refresh uses the token up and issues the next one of the same
+    family - use of already used token means it was stolen, and revokes
+    (deletes) the whole family"""
+
+    __tablename__ = "refresh_token"
+    token_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("user.id", ondelete="CASCADE"), index=True
+    )
+    family_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    used_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True)
+    )
+
+
 async def create_user(
     bind,
     email: str = "default@example.com",
@@ -115,7 +236,7 @@ async def create_user(
 
     async with async_sessionmaker(bind=bind)() as session:
         user = User(email=email, full_name=full_name, is_admin=is_admin)
-        user.set_password(password)
+        user.password = await User.hash_password_async(password)
         session.add(user)
         await session.commit()
 
@@ -0,0 +1,178 @@
+"""Read-only queries of GET endpoints. They select only served columns with
+Core (no identity map, no attribute instrumentation) and return rows as
+slotted msgspec Structs, which the app's JSON encoder writes natively"""
+
+from decimal import Decimal
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from database.models import Account, Transaction, User, UserStats
+
+import msgspec
+
+from sqlalchemy import Row, bindparam, false, select
+
+
+class AccountRow(msgspec.Struct, gc=False):
+    id: int
+    balance: Decimal
+
+
+class TransactionRow(msgspec.Struct, gc=False):
+    id: UUID
+    amount: Decimal
+    account_id: int
+
+
+class StatsRow(msgspec.Struct, gc=False):
+    total_balance: Decimal
+    account_count: int
+    transaction_count: int
+    # ISO 8601 string, the same as UserStats.serialize
+    last_transaction_at: Optional[str]
+
+
+class UserRow(msgspec.Struct, gc=False):
+    id: int
+    email: str
+    full_name: Optional[str]
+    is_admin: bool
+    stats: Optional[StatsRow]
+
+
+class UserAccountsRow(UserRow, gc=False):
+    accounts: List[AccountRow]
+
+
+STATS_COLUMNS = (
+    UserStats.total_balance,
+    UserStats.account_count,
+    UserStats.transaction_count,
+    UserStats.last_transaction_at,
+)
+
+USERS_QUERY = (
+    select(User.id, User.email, User.full_name, User.is_admin, *STATS_COLUMNS)
+    .join(UserStats, isouter=True)
+    .order_by(User.is_admin, User.id)
+)
+
+USERS_ACCOUNTS_QUERY = (
+    select(
+        User.id,
+        User.email,
+        User.full_name,
+        User.is_admin,
+        *STATS_COLUMNS,
+        Account.id.label("account_id"),
+        Account.balance,
+    )
+    .join(UserStats, isouter=True)
+    .join(User.accounts, isouter=True)
+    .where(User.is_admin == false())
+    .order_by(User.id, Account.id)
+)
+
+STATS_QUERY = select(*STATS_COLUMNS).where(
+    UserStats.user_id == bindparam("user_id")
+)
+
+ACCOUNTS_QUERY = select(Account.id, Account.balance).where(
+    Account.user_id == bindparam("user_id")
+)
+
+TRANSACTIONS_PAGE_QUERY = (
+    select(
+        Transaction.id,
+        Transaction.amount,
+        Transaction.account_id,
+        Transaction.seq,
+    )
+    .where(
+        Transaction.user_id == bindparam("user_id"),
+        Transaction.seq > bindparam("after"),
+    )
+    .order_by(Transaction.seq)
+    .limit(bindparam("limit"))
+)
+
+
+def stats_row(
+    total_balance, account_count, transaction_count, last_transaction_at
+) -> Optional[StatsRow]:
+    # account_count is not nullable, so NULL means there is no stats row
+    if account_count is None:
+        return None
+    return StatsRow(
+        total_balance,
+        account_count,
+        transaction_count,
+        (
+            last_transaction_at.isoformat()
+            if last_transaction_at is not None
+            else None
+        ),
+    )
+
+
+def user_row(row) -> UserRow:
+    """Makes UserRow out of row of USERS_QUERY"""
+    return UserRow(*row[:4], stats_row(*row[4:8]))
+
+
+async def each_row(result) -> AsyncIterator[Row]:
+    """Iterates rows of streamed result chunk by chunk (see "yield_per"),
+    as fetching them one by one costs a context switch per row"""
+    async for partition in result.partitions():
+        for row in partition:
+            yield row
+
+
+async def user_rows(result) -> AsyncIterator[UserRow]:
+    async for row in each_row(result):
+        yield user_row(row)
+
+
+async def users_with_accounts(result) -> AsyncIterator[UserAccountsRow]:
+    """Folds streamed rows of USERS_ACCOUNTS_QUERY into users with their
+    accounts"""
+    user = None
+    async for row in each_row(result):
+        if user is None or row.id != user.id:
+            if user is not None:
+                yield user
+            user = UserAccountsRow(*row[:4], stats_row(*row[4:8]), [])
+        if row.account_id is not None:
+            user.accounts.append(AccountRow(row.account_id, row.balance))
+    if user is not None:
+        yield user
+
+
+async def user_stats(conn, user_id: int) -> Optional[StatsRow]:
+    row = (await conn.execute(STATS_QUERY, {"user_id": user_id})).first()
+    return stats_row(*row) if row is not None else None
+
+
+async def account_balances(conn, user_id: int) -> Dict[int, Decimal]:
+    rows = await conn.execute(ACCOUNTS_QUERY, {"user_id": user_id})
+    return dict(rows.all())
+
+
+async def user_accounts(conn, user_id: int) -> List[AccountRow]:
+    rows = await conn.execute(ACCOUNTS_QUERY, {"user_id": user_id})
+    return [AccountRow(*row) for row in rows]
+
+
+async def transactions_page(
+    conn, user_id: int, after: int, limit: int
+) -> Tuple[List[TransactionRow], Optional[int]]:
+    """Returns user's transactions following position `after` in order
+    they were received, and position of the last one if there are more"""
+    rows = (
+        await conn.execute(
+            TRANSACTIONS_PAGE_QUERY,
+            {"user_id": user_id, "after": after, "limit": limit + 1},
+        )
+    ).all()
+    next_position = rows[limit - 1].seq if len(rows) > limit else None
+    return [TransactionRow(*row[:3]) for row in rows[:limit]], next_position
@@ -0,0 +1,114 @@
+import contextlib
+import time
+import zlib
+from multiprocessing import Array
+from typing import AsyncIterator, Hashable, Optional
+
+import config
+
+import metrics
+
+from sanic.log import error_logger
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+
+class RecentWrites:
+    """Striped times of the last writes living in shared memory, so that
+    all workers know whose data was changed recently. Keys are spread over
+    fixed amount of stripes, so a write may make few unrelated keys look
+    recently written - never the other way round"""
+
+    def __init__(self, array):
+        self._array = array
+        self._values = array.get_obj()
+        self._stripes = len(self._values)
+
+    @staticmethod
+    def allocate(stripes: int = 4096):
+        return Array("d", stripes)
+
+    def _stripe(self, key: Hashable) -> int:
+        # builtin hash() is salted per process, so it can't be used here
+        return zlib.crc32(str(key).encode("utf-8")) % self._stripes
+
+    def mark(self, key: Hashable) -> None:
+        # wall clock, as times are compared across processes
+        self._values[self._stripe(key)] = time.time()
+
+    def written_within(self, key: Hashable, window: float) -> bool:
+        return time.time() - self._values[self._stripe(key)] < window
+
+
+class DatabaseRouter:
+    """Hands out connections for read-only queries: from the replica,
+    unless it's not configured or unavailable, data being read was
+    written within read-your-writes window, or fresh data is required -
+    then from the primary.
+    Writes always go to the primary (app.ctx.session)"""
+
+    def __init__(
+        self,
+        primary: AsyncEngine,
+        replica: Optional[AsyncEngine],
+        recent_writes: RecentWrites,
+        window: float = config.READ_YOUR_WRITES_WINDOW,
+        retry_interval: float = config.REPLICA_RETRY_INTERVAL,
+    ):
+        self.primary = primary
+        self.replica = replica
+        self.recent_writes = recent_writes
+        self.window = window
+        self.retry_interval = retry_interval
+        self._replica_down_until = 0.0
+
+    def mark_written(self, *keys: Hashable) -> None:
+        """Makes reads of keys' data go to the primary for a while;
+        call after changes are committed"""
+        for key in keys:
+            self.recent_writes.mark(key)
+
+    def replica_available(self) -> bool:
+        return (
+            self.replica is not None
+            and time.monotonic() >= self._replica_down_until
+        )
+
+    def replica_failed(self, error: BaseException) -> None:
+        """Routes reads to the primary for retry interval"""
+        error_logger.warning(
+            "Read replica is unavailable, reading from primary for "
+            f"{self.retry_interval}s: {error!r}"
+        )
+        self._replica_down_until = time.monotonic() + self.retry_interval
+
+    @contextlib.asynccontextmanager
+    async def read(
+        self, *keys: Hashable, fresh: bool = False
+    ) -> AsyncIterator[AsyncConnection]:
+        """Connection for reading data of given keys (e.g. user ids); fresh
+        reads are never served by the replica, whatever its lag is"""
+        conn = None
+        if not self.replica_available():
+            target = "primary"
+        elif fresh:
+            target = "primary_fresh"
+        elif any(
+            self.recent_writes.written_within(key, self.window)
+            for key in keys
+        ):
+            target = "primary_recent_write"
+        else:
+            target = "replica"
+            try:
+                conn = await self.replica.connect()
+            except Exception as e:
+                self.replica_failed(e)
+                target = "primary_fallback"
+        if conn is None:
+            conn = await self.primary.connect()
+        metrics.DB_READS.labels(target).inc()
+        try:
+            yield conn
+        finally:
+            await conn.close()
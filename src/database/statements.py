@@ -0,0 +1,49 @@
+"""Fixed statements shared by handlers. Statements are built once, with
+bound parameters instead of values, so executing them costs neither
+building constructs nor generating cache keys (which are memoized on
+the statement); values are passed as execution parameters"""
+
+from database.models import User
+
+from sqlalchemy import Executable, bindparam, column, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine.interfaces import BindTyping
+
+
+class _TextDialect(postgresql.dialect):
+    """Renders ":name" parameters, which text() understands, and no casts
+    of them - asyncpg dialect renders those on execution"""
+
+    bind_typing = BindTyping.NONE
+
+
+_text_dialect = _TextDialect(paramstyle="named")
+
+
+def precompiled(statement) -> Executable:
+    """Compiles statement SQLAlchemy can't cache - PostgreSQL's INSERT
+    (... ON CONFLICT) is compiled anew on every execution otherwise - into
+    textual one with the same bound parameters and typed result columns,
+    which is cached by its text. SQL text of the statement never changes,
+    so asyncpg prepares it once per connection"""
+    compiled = statement.compile(dialect=_text_dialect)
+    result = text(compiled.string).bindparams(
+        *(
+            bindparam(
+                name,
+                value=bind.value,
+                type_=bind.type,
+                required=bind.required,
+            )
+            for name, bind in compiled.binds.items()
+        )
+    )
+    columns = statement.exported_columns
+    if columns:
+        result = result.columns(*(column(c.key, c.type) for c in columns))
+    return result
+
+
+USER_BY_EMAIL = select(User).where(User.email == bindparam("email"))
+
+USER_BY_ID = select(User).where(User.id == bindparam("id"))
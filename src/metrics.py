@@ -0,0 +1,240 @@
+"""Prometheus metrics of the application.
+
+When served by Sanic's own server, metrics of all workers are aggregated
+through prometheus_client's multiprocess mode: PROMETHEUS_MULTIPROC_DIR is
+set up by the main process before workers are started (see server.py)
+"""
+
+import contextvars
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+
+from sqlalchemy import event
+
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+REQUESTS = Counter(
+    "http_requests_total",
+    "Handled HTTP requests",
+    ["route", "method", "status"],
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time from receiving request to sending response headers",
+    ["route"],
+)
+REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent in database queries per request",
+    ["route"],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests being handled at the moment",
+    multiprocess_mode="livesum",
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Database query execution time",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections",
+    "Connections currently checked out from the pool",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_connections",
+    "Connections currently open above the pool size",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_LIMIT = Gauge(
+    "db_admission_limit",
+    "Current adaptive limit of concurrent database work",
+    multiprocess_mode="livesum",
+)
+ADMISSION_REJECTED = Counter(
+    "db_admission_rejected_total",
+    "Requests rejected with 503 because database work limit was reached, "
+    "by blueprint (none - work outside of requests)",
+    ["blueprint"],
+)
+DB_READS = Counter(
+    "db_reads_total",
+    "Connections handed out for read-only queries by where they were "
+    "routed: replica, primary (no replica available), primary_recent_write, "
+    "primary_fresh (revalidation of changed data) or primary_fallback "
+    "(replica failed to give connection)",
+    ["target"],
+)
+PASSWORD_HASH_DURATION = Histogram(
+    "password_hash_duration_seconds",
+    "Time spent in bcrypt, excluding waiting for a free thread",
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "password_hash_rejected_total",
+    "Password operations rejected because hashing pool was saturated",
+)
+WEBHOOK_PAYMENTS = Counter(
+    "webhook_payments_total",
+    "Processed webhook payments by outcome: status reported to provider "
+    "or invalid signature (reported as invalid json data)",
+    ["outcome"],
+)
+LOGIN_THROTTLED = Counter(
+    "login_attempts_throttled_total",
+    "Login attempts rejected before verifying password, by exhausted "
+    "token bucket: ip (client address) or email",
+    ["bucket"],
+)
+REFRESH_TOKENS = Counter(
+    "auth_refresh_tokens_total",
+    "Refresh attempts by outcome: rotated, invalid (unknown, expired or "
+    "revoked token) or reused (used token sent again; family is revoked)",
+    ["outcome"],
+)
+ACCOUNT_LOCK_WAIT = Histogram(
+    "account_lock_wait_seconds",
+    "Time payments wait for in-process lock of their account",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+WEBHOOK_SEEN_LOOKUPS = Counter(
+    "webhook_seen_transactions_lookups_total",
+    "Lookups of incoming transaction ids in worker's filter of committed "
+    "ones; hits are rejected as duplicates without querying database",
+    ["result"],
+)
+WEBHOOK_INBOX_DEPTH = Gauge(
+    "webhook_inbox_depth",
+    "Payments waiting in the inbox table to be applied",
+    multiprocess_mode="livemax",
+)
+REQUEST_RETRIES = Counter(
+    "http_request_retries_total",
+    "Handler re-executions performed by retry policy",
+    ["route"],
+)
+RETRY_BUDGET_EXHAUSTED = Counter(
+    "http_request_retries_denied_total",
+    "Transient failures not retried because retry budget was exhausted",
+    ["route"],
+)
+
+
+class RequestStats:
+    __slots__ = ("route", "started_at", "db_time")
+
+    def __init__(self, route: str):
+        self.route = route
+        self.started_at = time.perf_counter()
+        self.db_time = 0.0
+
+
+current_request: contextvars.ContextVar[Optional[RequestStats]] = (
+    contextvars.ContextVar("current_request", default=None)
+)
+
+
+def setup_multiprocess_dir() -> None:
+    """Must be called in main process before workers are started"""
+    path = os.environ.get(MULTIPROC_DIR_ENV)
+    if path is None:
+        os.environ[MULTIPROC_DIR_ENV] = tempfile.mkdtemp(prefix="metrics-")
+    else:
+        # files of previous run would be summed up with the new ones
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+
+def mark_worker_dead(pid: int) -> None:
+    if MULTIPROC_DIR_ENV in os.environ:
+        multiprocess.mark_process_dead(pid)
+
+
+def render() -> bytes:
+    if MULTIPROC_DIR_ENV in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def route_label(request) -> str:
+    return request.route.name if request.route else "unknown"
+
+
+def request_started(request) -> None:
+    current_request.set(RequestStats(route_label(request)))
+    REQUESTS_IN_PROGRESS.inc()
+
+
+def request_finished(request, response) -> None:
+    stats = current_request.get()
+    if stats is None:
+        return
+    # connection task is reused by keep-alive requests
+    current_request.set(None)
+    REQUESTS_IN_PROGRESS.dec()
+    REQUESTS.labels(stats.route, request.method, response.status).inc()
+    REQUEST_DURATION.labels(stats.route).observe(
+        time.perf_counter() - stats.started_at
+    )
+    REQUEST_DB_DURATION.labels(stats.route).observe(stats.db_time)
+
+
+def instrument_engine(engine, name: str = "primary") -> None:
+    """Tracks query durations and pool usage of given AsyncEngine"""
+    sync_engine = engine.sync_engine
+    pool = sync_engine.pool
+    checked_out = DB_POOL_CHECKED_OUT.labels(name)
+    overflow = DB_POOL_OVERFLOW.labels(name)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, params, context, many):
+        conn.info.setdefault("query_started_at", []).append(
+            time.perf_counter()
+        )
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, params, context, many):
+        elapsed = time.perf_counter() - conn.info["query_started_at"].pop()
+        DB_QUERY_DURATION.observe(elapsed)
+        stats = current_request.get()
+        if stats is not None:
+            stats.db_time += elapsed
+
+    @event.listens_for(sync_engine, "handle_error")
+    def on_error(context):
+        started = context.connection and context.connection.info.get(
+            "query_started_at"
+        )
+        if started:
+            started.pop()
+
+    # "checkin" is dispatched before connection is returned to the pool,
+    # so counter is maintained by hand instead of reading pool.checkedout()
+    @event.listens_for(pool, "checkout")
+    def on_checkout(*args):
+        checked_out.inc()
+        overflow.set(max(pool.overflow(), 0))
+
+    @event.listens_for(pool, "checkin")
+    def on_checkin(*args):
+        checked_out.dec()
+        overflow.set(max(pool.overflow(), 0))
@@ -1,25 +1,201 @@
+import os
+
 from app.admin_routes import admin_bp
+from app.admission import (
+    AdaptiveLimiter,
+    AdmittedSessions,
+    Overloaded,
+    blueprint_of,
+    current_blueprint,
+)
+from app.cache import (
+    DataVersions,
+    SeenTransactions,
+    SharedVersions,
+    UserCache,
+)
+from app.encoding import dumps
+from app.inbox import InboxConsumer
+from app.locks import StripedCombiner
+from app.monitoring import (
+    metrics_request_middleware,
+    metrics_response_middleware,
+    monitoring,
+)
 from app.routes import auth, main
-from app.utils import fetch_user_middleware
-from app.webhook import webhook
+from app.throttling import LoginThrottle, TokenBuckets
+from app.utils import busy_response
+from app.webhook import recent_transaction_ids, webhook
 
+import config
 from config import load_environ
 
-from database.engine import engine
+from database.engine import create_db_engine, create_replica_engine, warm_up
+from database.hashing import password_hasher
+from database.routing import DatabaseRouter, RecentWrites
+
+import metrics
 
 from sanic import Sanic
 
 from sqlalchemy.ext.asyncio import async_sessionmaker
 
 
+async def allocate_shared_memory(app):
+    app.shared_ctx.user_versions = SharedVersions.allocate()
+    app.shared_ctx.recent_writes = RecentWrites.allocate()
+    app.shared_ctx.data_versions = SharedVersions.allocate()
+    app.shared_ctx.data_epoch = DataVersions.allocate_epoch()
+    app.shared_ctx.login_attempts_by_ip = TokenBuckets.allocate()
+    app.shared_ctx.login_attempts_by_email = TokenBuckets.allocate()
+    metrics.setup_multiprocess_dir()
+
+
+async def add_user_cache(app):
+    # shared context is populated only when served by Sanic's own server
+    versions = getattr(app.shared_ctx, "user_versions", None)
+    if versions is None:
+        versions = SharedVersions.allocate()
+    app.ctx.user_cache = UserCache(SharedVersions(versions))
+
+
+async def add_data_versions(app):
+    versions = getattr(app.shared_ctx, "data_versions", None)
+    if versions is not None:
+        epoch = app.shared_ctx.data_epoch
+    elif hasattr(app.ctx, "data_versions"):
+        # listeners run again for every request under ASGI test client,
+        # while versions of this process must survive
+        return
+    else:
+        versions = SharedVersions.allocate()
+        epoch = DataVersions.allocate_epoch()
+    app.ctx.data_versions = DataVersions(SharedVersions(versions), epoch)
+
+
+async def add_login_throttle(app):
+    by_ip = getattr(app.shared_ctx, "login_attempts_by_ip", None)
+    if by_ip is not None:
+        by_email = app.shared_ctx.login_attempts_by_email
+    elif hasattr(app.ctx, "login_throttle"):
+        # the same as for data versions: buckets must survive listeners
+        # being run again by ASGI test client
+        return
+    else:
+        by_ip, by_email = TokenBuckets.allocate(), TokenBuckets.allocate()
+    app.ctx.login_throttle = LoginThrottle(
+        TokenBuckets(by_ip, config.LOGIN_IP_RATE / 60, config.LOGIN_IP_BURST),
+        TokenBuckets(
+            by_email, config.LOGIN_EMAIL_RATE / 60, config.LOGIN_EMAIL_BURST
+        ),
+    )
+
+
 async def add_db_session(app):
     load_environ()  # to make sure SANIC_SECRET is stored in app.config
-    app.ctx.session = async_sessionmaker(bind=engine)
+    app.ctx.engine = create_db_engine()
+    metrics.instrument_engine(app.ctx.engine)
+    await warm_up(app.ctx.engine)
+    app.ctx.session = async_sessionmaker(bind=app.ctx.engine)
+    app.ctx.admission = None
+    if config.ADMISSION_CONTROL:
+        app.ctx.admission = AdaptiveLimiter()
+        app.ctx.admission.sample_queries(app.ctx.engine)
+        app.ctx.session = AdmittedSessions(
+            app.ctx.session, app.ctx.admission
+        )
+
+    replica = None
+    if config.REPLICA_HOST:
+        replica = create_replica_engine()
+        metrics.instrument_engine(replica, "replica")
+        if app.ctx.admission is not None:
+            app.ctx.admission.sample_queries(replica)
+    recent_writes = getattr(app.shared_ctx, "recent_writes", None)
+    if recent_writes is None:
+        recent_writes = RecentWrites.allocate()
+    app.ctx.db_router = DatabaseRouter(
+        app.ctx.engine, replica, RecentWrites(recent_writes)
+    )
+    if replica is not None:
+        try:
+            await warm_up(replica)
+        except Exception as e:
+            app.ctx.db_router.replica_failed(e)
+
+
+async def add_account_locks(app):
+    app.ctx.account_locks = StripedCombiner()
+
+
+async def add_seen_transactions(app):
+    app.ctx.seen_transactions = SeenTransactions()
+    if app.ctx.seen_transactions.max_size > 0:
+        async with app.ctx.session() as session:
+            app.ctx.seen_transactions.add(
+                await recent_transaction_ids(
+                    session, app.ctx.seen_transactions.max_size
+                )
+            )
+
+
+async def start_inbox_consumer(app):
+    app.ctx.webhook_inbox = InboxConsumer()
+    if config.WEBHOOK_MODE == "queue":
+        app.add_task(app.ctx.webhook_inbox.run, name="webhook_inbox")
+
+
+async def stop_inbox_consumer(app):
+    if config.WEBHOOK_MODE == "queue":
+        # batch in progress is rolled back and stays queued
+        await app.cancel_task("webhook_inbox", raise_exception=False)
+
+
+async def close_db_session(app):
+    await app.ctx.engine.dispose()
+    if app.ctx.db_router.replica is not None:
+        await app.ctx.db_router.replica.dispose()
+
+
+async def stop_password_hasher(app):
+    password_hasher.shutdown()
+
+
+async def set_current_blueprint(request):
+    current_blueprint.set(blueprint_of(request))
+
+
+async def clear_current_blueprint(request, response):
+    # connection task is reused by keep-alive requests
+    current_blueprint.set(None)
+
+
+def overloaded_response(request, exception: Overloaded):
+    return busy_response(exception.retry_after)
+
+
+async def release_worker_metrics(app):
+    metrics.mark_worker_dead(os.getpid())
 
 
 def create_app(app_name: str = "payment-app") -> Sanic:
-    app = Sanic(app_name)
-    app.register_listener(add_db_session, "after_server_start")
-    app.blueprint([main, auth, admin_bp, webhook])
-    app.register_middleware(fetch_user_middleware, "request")
+    app = Sanic(app_name, dumps=dumps)
+    app.register_listener(allocate_shared_memory, "main_process_start")
+    app.register_listener(add_user_cache, "before_server_start")
+    app.register_listener(add_data_versions, "before_server_start")
+    app.register_listener(add_login_throttle, "before_server_start")
+    app.register_listener(add_db_session, "before_server_start")
+    app.register_listener(add_account_locks, "before_server_start")
+    app.register_listener(add_seen_transactions, "before_server_start")
+    app.register_listener(start_inbox_consumer, "after_server_start")
+    app.register_listener(stop_inbox_consumer, "before_server_stop")
+    app.register_listener(close_db_session, "after_server_stop")
+    app.register_listener(stop_password_hasher, "after_server_stop")
+    app.register_listener(release_worker_metrics, "after_server_stop")
+    app.register_middleware(metrics_request_middleware, "request")
+    app.register_middleware(metrics_response_middleware, "response")
+    app.register_middleware(set_current_blueprint, "request")
+    app.register_middleware(clear_current_blueprint, "response")
+    app.error_handler.add(Overloaded, overloaded_response)
+    app.blueprint([main, auth, admin_bp, webhook, monitoring])
     return app
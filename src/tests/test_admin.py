@@ -1,15 +1,20 @@
+import json
 from http import HTTPStatus
 
 from app.admin_routes import admin_bp
+from app.cache import DataVersions, SharedVersions, UserCache
 from app.utils import generate_jwt_token
+from app.webhook import webhook as webhook_bp
 
 from database.models import User
+from database.routing import DatabaseRouter
 
 import pytest
 
 from sanic_testing.testing import SanicASGITestClient
 
 from tests import testvars
+from tests.test_webhook import signed_payload
 
 
 @pytest.fixture
@@ -176,3 +181,135 @@ async def test_user_deletion(app, admin_token):
     )
     assert response.status == HTTPStatus.OK
     assert bool(response.json)  # checking that is not empty
+
+
+@pytest.mark.parametrize(
+    "endpoint",
+    [f"{admin_bp.name}.user_list", f"{admin_bp.name}.users_accounts_info"],
+)
+@pytest.mark.asyncio
+async def test_ndjson_streaming(app, admin_token, endpoint):
+    test_client = SanicASGITestClient(app)
+    _, json_response = await test_client.get(
+        app.url_for(endpoint),
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    _, ndjson_response = await test_client.get(
+        app.url_for(endpoint),
+        headers={
+            "Authorization": f"Bearer {admin_token}",
+            "Accept": "application/x-ndjson",
+        },
+    )
+    assert ndjson_response.status == HTTPStatus.OK
+    assert ndjson_response.content_type == "application/x-ndjson"
+    lines = ndjson_response.text.splitlines()
+    assert [json.loads(line) for line in lines] == json_response.json
+
+
+@pytest.mark.usefixtures("_delete_odd_users")
+@pytest.mark.asyncio
+async def test_users_listing_revalidation(app, admin_token):
+    test_client = SanicASGITestClient(app)
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    url = app.url_for(f"{admin_bp.name}.user_list")
+
+    _, response = await test_client.get(url, headers=headers)
+    etag = response.headers["etag"]
+    _, response = await test_client.get(
+        url, headers={**headers, "If-None-Match": f"W/{etag}"}
+    )
+    assert response.status == HTTPStatus.NOT_MODIFIED
+
+    await test_client.post(
+        app.url_for(f"{admin_bp.name}.create_user"),
+        headers=headers,
+        json={"email": "valid@gmail.com", "password": "valid_password"},
+    )
+    _, response = await test_client.get(
+        url, headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status == HTTPStatus.OK
+    assert "valid@gmail.com" in {user["email"] for user in response.json}
+
+
+@pytest.mark.asyncio
+async def test_listing_reads_follow_all_users_writes(
+    app, admin_token, monkeypatch
+):
+    reads = []
+    read = DatabaseRouter.read
+
+    def recording_read(self, *keys, fresh=False):
+        reads.append((keys, fresh))
+        return read(self, *keys, fresh=fresh)
+
+    monkeypatch.setattr(DatabaseRouter, "read", recording_read)
+    test_client = SanicASGITestClient(app)
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    url = app.url_for(f"{admin_bp.name}.user_list")
+
+    _, response = await test_client.get(url, headers=headers)
+    assert DataVersions.ALL in reads[-1][0]
+    assert not reads[-1][1]
+
+    await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook"), json=signed_payload()
+    )
+    assert app.ctx.db_router.recent_writes.written_within(
+        DataVersions.ALL, 60
+    )
+    # revalidation of changed listing mustn't be served by lagging replica
+    _, response = await test_client.get(
+        url, headers={**headers, "If-None-Match": response.headers["etag"]}
+    )
+    assert response.status == HTTPStatus.OK
+    assert reads[-1][1]
+
+
+@pytest.mark.usefixtures("_delete_odd_users")
+@pytest.mark.asyncio
+async def test_edit_drops_cached_user_under_old_email(
+    app, admin_token, monkeypatch
+):
+    # the same cache for all requests, as in a worker of running server
+    cache = UserCache(SharedVersions(SharedVersions.allocate(stripes=64)))
+    monkeypatch.setattr("server.UserCache", lambda versions: cache)
+    test_client = SanicASGITestClient(app)
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    _, response = await test_client.post(
+        app.url_for(f"{admin_bp.name}.create_user"),
+        headers=headers,
+        json={
+            "email": "demoted@gmail.com",
+            "password": "valid_password",
+            "is_admin": True,
+        },
+    )
+    user_id = response.json["id"]
+    old_token = generate_jwt_token("demoted@gmail.com", app.config.SECRET)
+    url = app.url_for(f"{admin_bp.name}.user_list")
+    _, response = await test_client.get(
+        url, headers={"Authorization": f"Bearer {old_token}"}
+    )
+    assert response.status == HTTPStatus.OK
+
+    _, response = await test_client.put(
+        app.url_for(f"{admin_bp.name}.UserManipulationView", id=user_id),
+        headers=headers,
+        json={
+            "email": "renamed@gmail.com",
+            "password": "valid_password",
+            "is_admin": False,
+        },
+    )
+    assert response.status == HTTPStatus.OK
+    _, response = await test_client.get(
+        url, headers={"Authorization": f"Bearer {old_token}"}
+    )
+    assert response.status == HTTPStatus.UNAUTHORIZED
+    new_token = generate_jwt_token("renamed@gmail.com", app.config.SECRET)
+    _, response = await test_client.get(
+        url, headers={"Authorization": f"Bearer {new_token}"}
+    )
+    assert response.status == HTTPStatus.FORBIDDEN
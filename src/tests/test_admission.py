@@ -0,0 +1,168 @@
+import asyncio
+from http import HTTPStatus
+
+from app.admin_routes import admin_bp
+from app.admission import AdaptiveLimiter, Overloaded, current_blueprint
+from app.routes import main as main_bp
+from app.utils import generate_jwt_token
+
+import config
+
+from database.engine import create_db_engine
+
+import pytest
+
+from sanic_testing.testing import SanicASGITestClient
+
+from tests import testvars
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.admission.time.monotonic", lambda: now[0])
+    return now
+
+
+def saturate(limiter, latency, rounds):
+    """Admits work up to the limit and releases it, `rounds` times"""
+    for _ in range(rounds):
+        admitted = int(limiter.limit)
+        for _ in range(admitted):
+            assert limiter.try_acquire()
+        for _ in range(admitted):
+            limiter.observe(latency, admitted)
+        for _ in range(admitted):
+            limiter.release()
+
+
+def run_alone(limiter, latency, samples):
+    for _ in range(samples):
+        assert limiter.try_acquire()
+        limiter.observe(latency, 1)
+        limiter.release()
+
+
+def make_limiter():
+    limiter = AdaptiveLimiter(initial_limit=10, min_limit=2, max_limit=15)
+    run_alone(limiter, 0.002, 100)
+    return limiter
+
+
+def test_limit_stays_down_while_slowdown_lasts(clock):
+    limiter = make_limiter()
+    saturate(limiter, 0.002, 10)
+    assert limiter.limit == 15
+
+    saturate(limiter, 0.2, 300)
+    assert limiter.limit == 2
+    assert limiter.baseline == pytest.approx(0.002)
+
+    saturate(limiter, 0.002, 30)
+    assert limiter.limit == 15
+
+
+def test_long_slowdown_becomes_new_baseline(clock):
+    limiter = make_limiter()
+    saturate(limiter, 0.2, 50)
+    assert limiter.limit == 2
+
+    clock[0] += limiter.baseline_window
+    saturate(limiter, 0.2, 30)
+    assert limiter.baseline == pytest.approx(0.2)
+    assert limiter.limit > 10
+
+
+def test_limit_does_not_grow_under_low_demand(clock):
+    limiter = make_limiter()
+    run_alone(limiter, 0.002, 1000)
+    assert limiter.limit == 10
+
+    run_alone(limiter, 1.0, 1000)
+    assert limiter.limit < 10
+
+
+def test_lower_priority_blueprint_is_shed_first():
+    limiter = AdaptiveLimiter(initial_limit=4)
+    assert limiter.try_acquire(share=0.5)
+    assert limiter.try_acquire(share=0.5)
+    assert not limiter.try_acquire(share=0.5)
+    assert limiter.try_acquire(share=1.0)
+    assert limiter.try_acquire(share=1.0)
+    assert not limiter.try_acquire(share=1.0)
+
+
+@pytest.mark.asyncio
+async def test_admit_raises_overloaded_when_limit_is_reached():
+    limiter = AdaptiveLimiter(initial_limit=1, max_wait=0.01)
+    token = current_blueprint.set("admin")
+    try:
+        async with limiter.admit():
+            with pytest.raises(Overloaded):
+                async with limiter.admit():
+                    pass
+    finally:
+        current_blueprint.reset(token)
+    assert limiter.in_flight == 0
+    assert limiter.rejected == 1
+
+
+@pytest.mark.asyncio
+async def test_admit_waits_for_released_slot():
+    limiter = AdaptiveLimiter(initial_limit=1, max_wait=5)
+    order = []
+
+    async def work(name, duration):
+        async with limiter.admit():
+            order.append(name)
+            await asyncio.sleep(duration)
+
+    await asyncio.gather(work("first", 0.01), work("second", 0))
+    assert order == ["first", "second"]
+    assert limiter.rejected == 0
+
+
+@pytest.mark.asyncio
+async def test_limiter_samples_query_execution_time():
+    engine = create_db_engine()
+    limiter = AdaptiveLimiter(initial_limit=4)
+    limiter.sample_queries(engine)
+    async with limiter.admit():
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql("SELECT pg_sleep(0.05)")
+            # time spent outside of queries is not sampled
+            await asyncio.sleep(0.2)
+    await engine.dispose()
+    assert 0.05 <= limiter.latency < 0.2
+
+
+@pytest.mark.asyncio
+async def test_saturated_worker_sheds_admin_before_users(app, monkeypatch):
+    def busy_limiter():
+        # half of the limit is taken by work outside of this request
+        limiter = AdaptiveLimiter(
+            initial_limit=4, min_limit=4, max_limit=4, max_wait=0.01
+        )
+        limiter.in_flight = 2
+        return limiter
+
+    monkeypatch.setattr(config, "ADMISSION_CONTROL", True)
+    monkeypatch.setattr("server.AdaptiveLimiter", busy_limiter)
+    test_client = SanicASGITestClient(app)
+
+    admin_token = generate_jwt_token(
+        testvars.TEST_ADMIN_MAIL, app.config.SECRET
+    )
+    _, response = await test_client.get(
+        app.url_for(f"{admin_bp.name}.user_list"),
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    assert response.status == HTTPStatus.SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "1"
+
+    user_token = generate_jwt_token(testvars.TEST_USER_MAIL, app.config.SECRET)
+    _, response = await test_client.get(
+        app.url_for(f"{main_bp.name}.personal_info"),
+        headers={"Authorization": f"Bearer {user_token}"},
+    )
+    assert response.status == HTTPStatus.OK
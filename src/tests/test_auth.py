@@ -4,8 +4,11 @@ from http import HTTPStatus
 
 from app.admin_routes import admin_bp
 from app.routes import auth as auth_bp, main as main_bp
+from app.throttling import LoginThrottle, TokenBuckets
 from app.utils import generate_jwt_token
 
+from database.hashing import password_hasher
+
 import pytest
 
 from sanic_testing.testing import SanicASGITestClient
@@ -138,3 +141,131 @@ async def test_admin_endpoints_protected(app, endpoint, args, method):
         json={"any_valid_json": "json"},
     )
     assert response.status == HTTPStatus.FORBIDDEN
+
+
+@pytest.mark.asyncio
+async def test_401_on_token_of_unknown_user(app):
+    test_client = SanicASGITestClient(app)
+    token = generate_jwt_token("deleted@example.com", app.config.SECRET)
+    _, response = await test_client.get(
+        app.url_for(f"{main_bp.name}.personal_info"),
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status == HTTPStatus.UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_public_endpoint_skips_authentication(app):
+    test_client = SanicASGITestClient(app)
+    token = generate_jwt_token(testvars.TEST_USER_MAIL, app.config.SECRET)
+    request, response = await test_client.get(
+        app.url_for(f"{main_bp.name}.index"),
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status == HTTPStatus.OK
+    assert not hasattr(request.ctx, "token_payload")
+    assert not hasattr(request.ctx, "user")
+
+
+@pytest.mark.asyncio
+async def test_503_when_password_hasher_is_saturated(app, monkeypatch):
+    monkeypatch.setattr(password_hasher, "max_pending", 0)
+    test_client = SanicASGITestClient(app)
+    _, response = await test_client.post(
+        app.url_for(f"{auth_bp.name}.login"),
+        json={
+            "email": testvars.TEST_USER_MAIL,
+            "password": testvars.TEST_USER_PASS,
+        },
+    )
+    assert response.status == HTTPStatus.SERVICE_UNAVAILABLE
+    assert "Retry-After" in response.headers
+
+
+async def login(test_client, app):
+    _, response = await test_client.post(
+        app.url_for(f"{auth_bp.name}.login"),
+        json={
+            "email": testvars.TEST_USER_MAIL,
+            "password": testvars.TEST_USER_PASS,
+        },
+    )
+    return response.json["refresh_token"]
+
+
+async def refresh(test_client, app, refresh_token):
+    _, response = await test_client.post(
+        app.url_for(f"{auth_bp.name}.refresh"),
+        json={"refresh_token": refresh_token},
+    )
+    return response
+
+
+@pytest.mark.asyncio
+async def test_refresh_rotates_tokens(app):
+    test_client = SanicASGITestClient(app)
+    first = await login(test_client, app)
+
+    response = await refresh(test_client, app, first)
+    assert response.status == HTTPStatus.OK
+    second = response.json["refresh_token"]
+    assert second != first
+    _, response = await test_client.get(
+        app.url_for(f"{main_bp.name}.personal_info"),
+        headers={"Authorization": f"Bearer {response.json['access_token']}"},
+    )
+    assert response.json["email"] == testvars.TEST_USER_MAIL
+
+    # reuse of the first token revokes the whole family
+    response = await refresh(test_client, app, first)
+    assert response.status == HTTPStatus.UNAUTHORIZED
+    response = await refresh(test_client, app, second)
+    assert response.status == HTTPStatus.UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_logout_revokes_refresh_token(app):
+    test_client = SanicASGITestClient(app)
+    refresh_token = await login(test_client, app)
+
+    _, response = await test_client.post(
+        app.url_for(f"{auth_bp.name}.logout"),
+        json={"refresh_token": refresh_token},
+    )
+    assert response.status == HTTPStatus.OK
+    response = await refresh(test_client, app, refresh_token)
+    assert response.status == HTTPStatus.UNAUTHORIZED
+
+
+@pytest.mark.parametrize("data", [{}, {"refresh_token": "unknown"}])
+@pytest.mark.asyncio
+async def test_refresh_rejects_invalid_tokens(app, data):
+    test_client = SanicASGITestClient(app)
+    _, response = await test_client.post(
+        app.url_for(f"{auth_bp.name}.refresh"), json=data
+    )
+    assert response.status in (
+        HTTPStatus.BAD_REQUEST,
+        HTTPStatus.UNAUTHORIZED,
+    )
+
+
+@pytest.mark.asyncio
+async def test_429_when_login_attempts_exceed_limit(app, monkeypatch):
+    throttle = LoginThrottle(
+        TokenBuckets(TokenBuckets.allocate(64), rate=0.01, burst=10),
+        TokenBuckets(TokenBuckets.allocate(64), rate=0.01, burst=1),
+    )
+    monkeypatch.setattr(app.ctx, "login_throttle", throttle, raising=False)
+    test_client = SanicASGITestClient(app)
+    data = {"email": testvars.TEST_USER_MAIL, "password": "wrong_password"}
+
+    _, response = await test_client.post(
+        app.url_for(f"{auth_bp.name}.login"), json=data
+    )
+    assert response.status == HTTPStatus.IM_A_TEAPOT
+    _, response = await test_client.post(
+        app.url_for(f"{auth_bp.name}.login"), json=data
+    )
+    assert response.status == HTTPStatus.TOO_MANY_REQUESTS
+    assert int(response.headers["Retry-After"]) >= 1
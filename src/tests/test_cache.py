@@ -0,0 +1,78 @@
+import uuid
+
+from app.cache import (
+    DataVersions,
+    SeenTransactions,
+    SharedVersions,
+    UserCache,
+)
+
+import pytest
+
+
+@pytest.fixture
+def versions():
+    return SharedVersions(SharedVersions.allocate(stripes=64))
+
+
+def test_invalidation_reaches_other_workers(versions):
+    first_worker, second_worker = UserCache(versions), UserCache(versions)
+    key = "default@example.com"
+    first_worker.set(key, "user", first_worker.version(key))
+    second_worker.set(key, "user", second_worker.version(key))
+
+    first_worker.invalidate(key)
+
+    assert first_worker.get(key) is None
+    assert second_worker.get(key) is None
+
+
+def test_stale_version_is_not_served(versions):
+    cache = UserCache(versions)
+    key = "default@example.com"
+    version = cache.version(key)
+    cache.invalidate(key)  # user updated while being fetched from DB
+    cache.set(key, "outdated user", version)
+    assert cache.get(key) is None
+
+
+def test_lru_eviction(versions):
+    cache = UserCache(versions, max_size=2)
+    for key in ("a@example.com", "b@example.com"):
+        cache.set(key, key, cache.version(key))
+    cache.get("a@example.com")
+    cache.set("c@example.com", "c", cache.version("c@example.com"))
+
+    assert cache.get("b@example.com") is None
+    assert cache.get("a@example.com") == "a@example.com"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiration(versions):
+    cache = UserCache(versions, ttl=-1)
+    cache.set("a@example.com", "a", cache.version("a@example.com"))
+    assert cache.get("a@example.com") is None
+
+
+def test_seen_transactions_keep_recent_ids():
+    ids = [uuid.uuid4() for _ in range(3)]
+    seen = SeenTransactions(max_size=2)
+    seen.add(ids[:2])
+    assert seen.seen(ids[0])  # becomes most recent
+    seen.add(ids[2:])
+
+    assert seen.seen(ids[0])
+    assert not seen.seen(ids[1])
+    assert seen.seen(ids[2])
+    assert len(seen) == 2
+
+
+def test_data_versions(versions):
+    data_versions = DataVersions(versions, DataVersions.allocate_epoch())
+    own, other, listing = (
+        data_versions.etag(key) for key in (1, 2, DataVersions.ALL)
+    )
+    data_versions.bump(1)
+    assert data_versions.etag(1) != own
+    assert data_versions.etag(DataVersions.ALL) != listing
+    assert data_versions.etag(2) == other  # stripes of 1 and 2 differ
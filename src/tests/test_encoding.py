@@ -0,0 +1,80 @@
+import json
+import uuid
+from decimal import Decimal
+
+from app.encoding import ENCODERS
+
+from database.engine import create_db_engine
+from database.models import Account, Transaction
+from database.queries import AccountRow, UserAccountsRow
+
+import pytest
+
+from sqlalchemy import literal, select
+
+
+@pytest.mark.parametrize("name", ENCODERS.keys())
+def test_models_are_encoded_directly(name):
+    transaction_id = uuid.uuid4()
+    transaction = Transaction(
+        id=transaction_id, amount=Decimal("1.25"), account_id=1
+    )
+    data = {
+        "transactions": [transaction],
+        "accounts": {7: Decimal("100.50")},
+    }
+
+    encoded = json.loads(ENCODERS[name](data))
+
+    assert encoded == {
+        "transactions": [
+            {"id": str(transaction_id), "amount": 1.25, "account_id": 1}
+        ],
+        "accounts": {"7": 100.5},
+    }
+
+
+def test_decimals_are_encoded_exactly():
+    encoded = ENCODERS["msgspec"](
+        [Account(id=1, balance=Decimal("12345678901234.10"))]
+    )
+    assert encoded == b'[{"id":1,"balance":12345678901234.10}]'
+
+
+@pytest.mark.asyncio
+async def test_rows_are_encoded_as_objects():
+    engine = create_db_engine()
+    try:
+        async with engine.connect() as conn:
+            row = (
+                await conn.execute(
+                    select(literal(1).label("id"), literal("x").label("name"))
+                )
+            ).one()
+    finally:
+        await engine.dispose()
+
+    for dumps in ENCODERS.values():
+        assert json.loads(dumps([row])) == [{"id": 1, "name": "x"}]
+
+
+@pytest.mark.parametrize("name", ENCODERS.keys())
+def test_structs_are_encoded_as_objects(name):
+    user = UserAccountsRow(
+        1, "a@b.com", None, False, None, [AccountRow(2, Decimal("0.50"))]
+    )
+    assert json.loads(ENCODERS[name]([user])) == [
+        {
+            "id": 1,
+            "email": "a@b.com",
+            "full_name": None,
+            "is_admin": False,
+            "stats": None,
+            "accounts": [{"id": 2, "balance": 0.5}],
+        }
+    ]
+
+
+def test_unknown_objects_are_rejected():
+    with pytest.raises(TypeError, match="not JSON"):
+        ENCODERS["msgspec"](object())
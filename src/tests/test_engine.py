@@ -0,0 +1,27 @@
+from database.engine import create_db_engine, warm_up
+
+import pytest
+
+
+class FlakyEngine:
+    """Engine failing to open its second connection"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.pool = engine.pool
+        self.calls = 0
+
+    def connect(self):
+        self.calls += 1
+        if self.calls == 2:
+            raise ConnectionError("connection refused")
+        return self.engine.connect()
+
+
+@pytest.mark.asyncio
+async def test_warm_up_returns_connections_if_one_fails():
+    engine = create_db_engine()
+    with pytest.raises(ConnectionError):
+        await warm_up(FlakyEngine(engine), connections=4)
+    assert engine.pool.checkedout() == 0
+    await engine.dispose()
@@ -0,0 +1,40 @@
+import asyncio
+
+from app.locks import StripedCombiner
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_waiting_items_are_processed_together():
+    combiner = StripedCombiner(stripes=4)
+    calls = []
+
+    async def process(items):
+        calls.append(items)
+        await asyncio.sleep(0.01)
+        return [item * 10 for item in items]
+
+    results = await asyncio.gather(
+        *(combiner.submit("account", i, process) for i in range(5))
+    )
+    assert results == [0, 10, 20, 30, 40]
+    assert calls == [[0], [1, 2, 3, 4]]
+
+
+@pytest.mark.asyncio
+async def test_failure_is_reported_to_every_item_of_batch():
+    combiner = StripedCombiner(stripes=1)
+
+    async def process(items):
+        await asyncio.sleep(0.01)
+        if len(items) > 1:
+            raise RuntimeError("connection lost")
+        return items
+
+    results = await asyncio.gather(
+        *(combiner.submit(i, i, process) for i in range(3)),
+        return_exceptions=True,
+    )
+    assert results[0] == 0
+    assert all(isinstance(r, RuntimeError) for r in results[1:])
@@ -0,0 +1,46 @@
+from http import HTTPStatus
+
+from app.monitoring import monitoring
+from app.routes import main as main_bp
+from app.webhook import webhook as webhook_bp
+
+import pytest
+
+from sanic_testing.testing import SanicASGITestClient
+
+from tests.test_webhook import signed_payload
+
+
+@pytest.mark.asyncio
+async def test_metrics_report_handled_requests(app):
+    test_client = SanicASGITestClient(app)
+    await test_client.get(app.url_for(f"{main_bp.name}.index"))
+    _, response = await test_client.get(
+        app.url_for(f"{monitoring.name}.metrics")
+    )
+    assert response.status == HTTPStatus.OK
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.body.decode()
+    assert "http_request_duration_seconds" in body
+    assert 'route="payment-app.main.index"' in body
+    assert "db_query_duration_seconds" in body
+
+
+@pytest.mark.asyncio
+async def test_metrics_count_invalid_signatures_separately(app):
+    forged = signed_payload()
+    forged["amount"] = 1000000
+    malformed = signed_payload(amount="not a number")
+
+    test_client = SanicASGITestClient(app)
+    for payload in (forged, malformed):
+        _, response = await test_client.post(
+            app.url_for(f"{webhook_bp.name}.webhook"), json=payload
+        )
+        assert response.json == {"error": "invalid json data"}
+    _, response = await test_client.get(
+        app.url_for(f"{monitoring.name}.metrics")
+    )
+    body = response.body.decode()
+    assert 'webhook_payments_total{outcome="invalid signature"}' in body
+    assert 'webhook_payments_total{outcome="invalid json data"}' in body
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+from app.retry import RetryBudget, RetryPolicy, is_transient_error
+
+import pytest
+
+import sqlalchemy.exc
+
+
+def db_error(sqlstate):
+    orig = Exception("error")
+    orig.sqlstate = sqlstate
+    return sqlalchemy.exc.DBAPIError("SELECT 1", {}, orig)
+
+
+@pytest.mark.parametrize(
+    "error,transient",
+    [
+        (db_error("40001"), True),
+        (db_error("40P01"), True),
+        (db_error("08006"), True),
+        (db_error("23505"), False),  # unique_violation
+        (ConnectionRefusedError(), True),
+        (ValueError(), False),
+        (KeyError(), False),
+    ],
+)
+def test_error_classification(error, transient):
+    assert is_transient_error(error) is transient
+
+
+def test_budget_limits_retries_to_fraction_of_requests():
+    budget = RetryBudget(ratio=0.5, min_per_second=0)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+@pytest.mark.asyncio
+async def test_only_transient_errors_are_retried():
+    policy = RetryPolicy(attempts=3, base_delay=0)
+    request = SimpleNamespace(route=None)
+    errors = [db_error("40P01"), ValueError("bug")]
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        raise errors[len(calls) - 1]
+
+    with pytest.raises(ValueError, match="bug"):
+        await policy.run(request, handler)
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_no_retries_beyond_budget():
+    # single token, never refilled
+    policy = RetryPolicy(
+        attempts=5, base_delay=0, budget=RetryBudget(0, min_per_second=0)
+    )
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        raise db_error("40001")
+
+    with pytest.raises(sqlalchemy.exc.DBAPIError):
+        await policy.run(SimpleNamespace(route=None), handler)
+    assert len(calls) == 2
@@ -0,0 +1,62 @@
+from database.engine import create_db_engine, url_object
+from database.routing import DatabaseRouter, RecentWrites
+
+import pytest
+
+
+@pytest.fixture
+async def engines():
+    # second engine of the same database plays the replica
+    primary, replica = create_db_engine(), create_db_engine()
+    yield primary, replica
+    await primary.dispose()
+    await replica.dispose()
+
+
+def make_router(primary, replica, **kwargs):
+    return DatabaseRouter(
+        primary, replica, RecentWrites(RecentWrites.allocate(64)), **kwargs
+    )
+
+
+@pytest.mark.asyncio
+async def test_reads_stick_to_primary_after_write(engines):
+    primary, replica = engines
+    router = make_router(primary, replica, window=60)
+
+    async with router.read(1) as conn:
+        assert conn.engine is replica
+    router.mark_written(1)
+    async with router.read(1) as conn:
+        assert conn.engine is primary
+    async with router.read(2) as conn:
+        assert conn.engine is replica
+
+
+@pytest.mark.asyncio
+async def test_fresh_reads_go_to_primary(engines):
+    primary, replica = engines
+    router = make_router(primary, replica)
+
+    async with router.read(1, fresh=True) as conn:
+        assert conn.engine is primary
+
+
+@pytest.mark.asyncio
+async def test_reads_fall_back_to_primary_if_replica_is_down(engines):
+    primary, _ = engines
+    unreachable = create_db_engine(url_object.set(host="/nonexistent"))
+    router = make_router(primary, unreachable, retry_interval=60)
+
+    async with router.read() as conn:
+        assert conn.engine is primary
+    assert not router.replica_available()
+    await unreachable.dispose()
+
+
+def test_recent_writes_expire():
+    writes = RecentWrites(RecentWrites.allocate(64))
+    writes.mark("key")
+    assert writes.written_within("key", 60)
+    assert not writes.written_within("key", 0)
+    assert not writes.written_within("other key", 60)
@@ -0,0 +1,70 @@
+import json
+import uuid
+
+from app.schemas import (
+    LoginCredentials,
+    SchemaError,
+    UserData,
+    WebhookPayload,
+    decode,
+)
+
+import msgspec
+
+import pytest
+
+from tests.test_webhook import signed_payload
+
+
+@pytest.mark.parametrize(
+    "data, error",
+    [
+        ({"email": "a@b.com"}, "missing email and/or password"),
+        ({"email": "a@b", "password": "pass"}, "invalid email format"),
+        ({"email": "a@b.com", "password": "på"}, "invalid password value"),
+        (
+            {"email": "a@b.com", "password": "pass", "full_name": "R2 D2"},
+            "invalid full_name value",
+        ),
+        ([], "invalid request data"),
+    ],
+)
+def test_user_data_errors(data, error):
+    with pytest.raises(SchemaError, match=error):
+        decode(json.dumps(data).encode(), UserData)
+
+
+def test_user_data_normalization():
+    data = decode(
+        b'{"email": "a@b.com", "password": "pass",'
+        b' "full_name": "  Jane Doe ", "is_admin": "Yes"}',
+        UserData,
+    )
+    assert data.full_name == "Jane Doe"
+    assert data.is_admin is True
+
+    data = decode(b'{"email": "a@b.com", "password": "pass"}', UserData)
+    assert data.fields() == {"email": "a@b.com", "password": "pass"}
+
+
+def test_login_credentials_errors():
+    with pytest.raises(SchemaError, match="invalid credentials list"):
+        decode(b'{"email": "a@b.com"}', LoginCredentials)
+    with pytest.raises(SchemaError, match="invalid credentials list"):
+        decode(b"not json", LoginCredentials)
+
+
+@pytest.mark.parametrize("amount", [100, 1.25, "7.5"])
+def test_webhook_payload_keeps_signed_representation(amount):
+    payload = msgspec.convert(signed_payload(amount=amount), WebhookPayload)
+    assert payload.signature_valid()
+    transaction_id, _, _, parsed_amount = payload.parse()
+    assert isinstance(transaction_id, uuid.UUID)
+    assert str(parsed_amount) == str(amount)
+
+
+@pytest.mark.parametrize("amount", ["NaN", "ten"])
+def test_webhook_payload_rejects_malformed_amount(amount):
+    payload = msgspec.convert(signed_payload(amount=amount), WebhookPayload)
+    with pytest.raises(ValueError, match="invalid amount"):
+        payload.parse()
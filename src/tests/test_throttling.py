@@ -0,0 +1,70 @@
+from app.throttling import LoginThrottle, TokenBuckets
+
+import pytest
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.throttling.time.time", lambda: now[0])
+    return now
+
+
+def make_buckets(rate=1, burst=2):
+    return TokenBuckets(TokenBuckets.allocate(sets=64), rate, burst)
+
+
+def test_bucket_refills_at_rate(clock):
+    buckets = make_buckets(rate=0.5, burst=2)
+    assert buckets.take("key") == 0
+    assert buckets.take("key") == 0
+    assert buckets.take("key") == pytest.approx(2)
+    assert buckets.take("other key") == 0
+
+    clock[0] += 2
+    assert buckets.take("key") == 0
+    assert buckets.take("key") > 0
+
+
+def test_buckets_are_shared_by_workers(clock):
+    array = TokenBuckets.allocate(sets=64)
+    first_worker = TokenBuckets(array, rate=1, burst=1)
+    second_worker = TokenBuckets(array, rate=1, burst=1)
+    assert first_worker.take("key") == 0
+    assert second_worker.take("key") > 0
+
+
+def test_colliding_keys_have_own_buckets(clock):
+    # single set: every key falls into it
+    buckets = TokenBuckets(TokenBuckets.allocate(sets=1), rate=1, burst=2)
+    assert buckets.take("attacked") == 0
+    assert buckets.take("attacked") == 0
+    assert buckets.take("attacked") > 0
+    for key in ("first", "second", "third"):
+        assert buckets.take(key) == 0
+    assert buckets.take("attacked") > 0
+
+
+def test_drained_set_admits_new_key(clock):
+    buckets = TokenBuckets(TokenBuckets.allocate(sets=1), rate=1, burst=2)
+    for way in range(TokenBuckets.WAYS):
+        assert buckets.take(f"key {way}") == 0
+        assert buckets.take(f"key {way}") == 0
+        assert buckets.take(f"key {way}") > 0
+    # the least drained entry is handed over to an unrelated key
+    assert buckets.take("new key") == 0
+    assert buckets.take("new key") == 0
+    assert buckets.take("new key") > 0
+
+
+def test_login_throttle_limits_email_across_addresses(clock):
+    throttle = LoginThrottle(make_buckets(burst=10), make_buckets(burst=2))
+    assert throttle.check("10.0.0.1", "user@example.com") == 0
+    assert throttle.check("10.0.0.2", "User@example.com ") == 0
+    assert throttle.check("10.0.0.3", "user@example.com") > 0
+    assert throttle.check("10.0.0.3", "other@example.com") == 0
+
+
+def test_zero_rate_disables_limit():
+    buckets = make_buckets(rate=0, burst=0)
+    assert all(buckets.take("key") == 0 for _ in range(100))
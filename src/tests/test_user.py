@@ -0,0 +1,131 @@
+from decimal import Decimal
+from http import HTTPStatus
+
+from app.routes import main as main_bp
+from app.utils import encode_cursor, generate_jwt_token
+from app.webhook import webhook as webhook_bp
+
+from database.models import Transaction
+
+import pytest
+
+from sanic_testing.testing import SanicASGITestClient
+
+from sqlalchemy import select
+
+from tests import testvars
+from tests.test_webhook import signed_payload
+
+
+@pytest.fixture
+def user_token(app):
+    return generate_jwt_token(testvars.TEST_USER_MAIL, app.config.SECRET)
+
+
+@pytest.mark.asyncio
+async def test_transactions_pagination(app, user_token):
+    test_client = SanicASGITestClient(app)
+    payments = [signed_payload() for _ in range(3)]
+    await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook_batch"), json=payments
+    )
+    async with app.ctx.session() as session:
+        first_seq = await session.scalar(
+            select(Transaction.seq).where(
+                Transaction.id == payments[0]["transaction_id"]
+            )
+        )
+
+    received, cursor = [], encode_cursor(first_seq - 1)
+    while True:
+        params = {"limit": 2, "after": cursor}
+        _, response = await test_client.get(
+            app.url_for(f"{main_bp.name}.transactions_info"),
+            headers={"Authorization": f"Bearer {user_token}"},
+            params=params,
+        )
+        assert response.status == HTTPStatus.OK
+        assert len(response.json["transactions"]) <= 2
+        received.extend(t["id"] for t in response.json["transactions"])
+        cursor = response.json["next_cursor"]
+        if cursor is None:
+            break
+
+    assert received == [p["transaction_id"] for p in payments]
+
+
+@pytest.mark.parametrize(
+    "params",
+    [{"limit": 0}, {"limit": "many"}, {"limit": 100500}, {"after": "@@"}],
+)
+@pytest.mark.asyncio
+async def test_transactions_invalid_pagination(app, user_token, params):
+    test_client = SanicASGITestClient(app)
+    _, response = await test_client.get(
+        app.url_for(f"{main_bp.name}.transactions_info"),
+        headers={"Authorization": f"Bearer {user_token}"},
+        params=params,
+    )
+    assert response.status == HTTPStatus.BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_stats_follow_payments(app, user_token):
+    test_client = SanicASGITestClient(app)
+    headers = {"Authorization": f"Bearer {user_token}"}
+
+    async def stats():
+        _, response = await test_client.get(
+            app.url_for(f"{main_bp.name}.personal_info"), headers=headers
+        )
+        assert response.status == HTTPStatus.OK
+        return response.json["stats"]
+
+    before = await stats()
+    await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook"),
+        json=signed_payload(amount=1.5),
+    )
+    await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook_batch"),
+        json=[signed_payload(amount=2), signed_payload(amount=3)],
+    )
+    after = await stats()
+
+    assert after["transaction_count"] - before["transaction_count"] == 3
+    assert Decimal(str(after["total_balance"])) - Decimal(
+        str(before["total_balance"])
+    ) == Decimal("6.5")
+    assert after["last_transaction_at"] is not None
+
+    _, response = await test_client.get(
+        app.url_for(f"{main_bp.name}.accounts_info"), headers=headers
+    )
+    balances = [Decimal(str(b)) for b in response.json.values()]
+    assert Decimal(str(after["total_balance"])) == sum(balances)
+    assert after["account_count"] == len(balances)
+
+
+@pytest.mark.asyncio
+async def test_conditional_get_until_payment(app, user_token):
+    test_client = SanicASGITestClient(app)
+    headers = {"Authorization": f"Bearer {user_token}"}
+    url = app.url_for(f"{main_bp.name}.accounts_info")
+
+    _, response = await test_client.get(url, headers=headers)
+    etag = response.headers["etag"]
+    _, response = await test_client.get(
+        url, headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status == HTTPStatus.NOT_MODIFIED
+    assert response.headers["etag"] == etag
+    assert not response.body
+
+    await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook"), json=signed_payload()
+    )
+    _, response = await test_client.get(
+        url, headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status == HTTPStatus.OK
+    assert response.headers["etag"] != etag
@@ -1,12 +1,67 @@
+import asyncio
 import uuid
+from decimal import Decimal
+from hashlib import sha256
+from http import HTTPStatus
 
-from database.models import Transaction
+from app.admin_routes import admin_bp
+from app.schemas import WebhookPayload
+from app.utils import generate_jwt_token
+from app.webhook import (
+    CREDIT_PAYMENT,
+    Payment,
+    apply_payment,
+    apply_payments,
+    credit_payment,
+    webhook as webhook_bp,
+)
+
+import config
+
+from database.engine import create_db_engine
+from database.models import Account, Transaction
 
 import pytest
 
+from sanic_testing.testing import SanicASGITestClient
+
+from sqlalchemy import delete
+from sqlalchemy.engine.interfaces import CacheStats
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
 from tests import testvars
 
 
+def signed_payload(
+    user_id=testvars.USER_ID, account_id=testvars.ACCOUNT_ID, amount=100
+):
+    data = {
+        "transaction_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "account_id": account_id,
+        "amount": amount,
+    }
+    string = (
+        f"{data['account_id']}{data['amount']}"
+        f"{data['transaction_id']}{data['user_id']}"
+        f"{config.WEBHOOK_SECRET}"
+    )
+    data["signature"] = sha256(string.encode("utf-8")).hexdigest()
+    return data
+
+
+async def account_balance(test_client, account_id=testvars.ACCOUNT_ID):
+    app = test_client.sanic_app
+    token = generate_jwt_token(testvars.TEST_ADMIN_MAIL, app.config.SECRET)
+    _, response = await test_client.get(
+        app.url_for(f"{admin_bp.name}.user_accounts", id=testvars.USER_ID),
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    for account in response.json:
+        if account["id"] == account_id:
+            return Decimal(str(account["balance"]))
+
+
 @pytest.fixture(scope="module")
 async def _add_test_transactions(app):
     async with app.ctx.session() as session:
@@ -23,3 +78,266 @@ async def _add_test_transactions(app):
         session.add_all(trans)
         await session.commit()
     return
+
+
+@pytest.mark.asyncio
+async def test_payment_credits_account(app):
+    test_client = SanicASGITestClient(app)
+    balance_before = await account_balance(test_client)
+    payload = signed_payload(amount=15.25)
+    _, response = await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook"), json=payload
+    )
+    assert response.status == HTTPStatus.OK
+    assert await account_balance(test_client) - balance_before == Decimal(
+        "15.25"
+    )
+
+    _, response = await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook"), json=payload
+    )
+    assert response.status == HTTPStatus.CONFLICT
+    assert await account_balance(test_client) - balance_before == Decimal(
+        "15.25"
+    )
+
+
+@pytest.mark.parametrize(
+    "payload,status",
+    [
+        (signed_payload(user_id=testvars.ADMIN_ID), HTTPStatus.CONFLICT),
+        (signed_payload(user_id=100500), HTTPStatus.CONFLICT),
+        ({**signed_payload(), "amount": 100500}, HTTPStatus.BAD_REQUEST),
+        ({"transaction_id": "not-uuid"}, HTTPStatus.BAD_REQUEST),
+        (signed_payload(amount=10**10), HTTPStatus.BAD_REQUEST),
+        (signed_payload(amount="0.005"), HTTPStatus.BAD_REQUEST),
+        (signed_payload(account_id=2**31), HTTPStatus.BAD_REQUEST),
+    ],
+)
+@pytest.mark.asyncio
+async def test_invalid_payment_rejected(app, payload, status):
+    test_client = SanicASGITestClient(app)
+    balance_before = await account_balance(test_client)
+    _, response = await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook"), json=payload
+    )
+    assert response.status == status
+    assert await account_balance(test_client) == balance_before
+
+
+@pytest.mark.asyncio
+async def test_batch_statuses(app):
+    accepted = [signed_payload(amount=10), signed_payload(amount=2.5)]
+    foreign_account = signed_payload(user_id=testvars.ADMIN_ID)
+    forged = signed_payload()
+    forged["amount"] = 1000000
+    batch = [*accepted, accepted[0], foreign_account, forged]
+
+    test_client = SanicASGITestClient(app)
+    balance_before = await account_balance(test_client)
+    _, response = await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook_batch"), json=batch
+    )
+    assert response.status == HTTPStatus.OK
+    statuses = [item["status"] for item in response.json["results"]]
+    assert statuses == [
+        "accepted",
+        "accepted",
+        "duplicate",
+        "invalid user id",
+        "invalid json data",
+    ]
+    assert await account_balance(test_client) - balance_before == 12.5
+
+    _, response = await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook_batch"), json=accepted
+    )
+    statuses = [item["status"] for item in response.json["results"]]
+    assert statuses == ["duplicate", "duplicate"]
+
+
+@pytest.mark.asyncio
+async def test_batch_rejects_values_out_of_column_range(app):
+    accepted = signed_payload(amount=3)
+    batch = [
+        accepted,
+        signed_payload(amount=10**10),
+        signed_payload(user_id=-(2**31) - 1),
+    ]
+
+    test_client = SanicASGITestClient(app)
+    balance_before = await account_balance(test_client)
+    _, response = await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook_batch"), json=batch
+    )
+    assert response.status == HTTPStatus.OK
+    statuses = [item["status"] for item in response.json["results"]]
+    assert statuses == ["accepted", "invalid json data", "invalid json data"]
+    assert await account_balance(test_client) - balance_before == 3
+
+
+@pytest.mark.parametrize("data", [{}, [], {"key": "value"}])
+@pytest.mark.asyncio
+async def test_batch_rejects_non_array(app, data):
+    test_client = SanicASGITestClient(app)
+    _, response = await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook_batch"), json=data
+    )
+    assert response.status == HTTPStatus.BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_seen_duplicate_is_rejected_without_database(app, monkeypatch):
+    test_client = SanicASGITestClient(app)
+    payload = signed_payload(amount=1)
+    _, response = await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook"), json=payload
+    )
+    assert response.status == HTTPStatus.OK
+
+    async def fail(*args):
+        raise AssertionError("database must not be queried")
+
+    monkeypatch.setattr("app.webhook.credit_payment", fail)
+    monkeypatch.setattr("app.webhook.apply_payments", fail)
+    _, response = await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook"), json=payload
+    )
+    assert response.status == HTTPStatus.CONFLICT
+    _, response = await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook_batch"), json=[payload]
+    )
+    assert response.json["results"][0]["status"] == "duplicate"
+
+
+@pytest.mark.asyncio
+async def test_queued_payment_is_applied_by_consumer(app, monkeypatch):
+    monkeypatch.setattr(config, "WEBHOOK_MODE", "queue")
+    test_client = SanicASGITestClient(app)
+    balance_before = await account_balance(test_client)
+    payload = signed_payload(amount=7.5)
+    _, response = await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook"), json=payload
+    )
+    assert response.status == HTTPStatus.ACCEPTED
+    assert response.json["status"] == "queued"
+
+    await app.ctx.webhook_inbox.drain(app)
+    _, response = await test_client.get(response.headers["Location"])
+    assert response.status == HTTPStatus.OK
+    assert response.json["status"] == "accepted"
+    assert response.json["processed_at"] is not None
+    assert await account_balance(test_client) - balance_before == Decimal(
+        "7.5"
+    )
+
+
+@pytest.mark.asyncio
+async def test_503_when_inbox_is_full(app, monkeypatch):
+    monkeypatch.setattr(config, "WEBHOOK_MODE", "queue")
+    monkeypatch.setattr(config, "WEBHOOK_QUEUE_MAX_DEPTH", 0)
+    test_client = SanicASGITestClient(app)
+    _, response = await test_client.post(
+        app.url_for(f"{webhook_bp.name}.webhook"), json=signed_payload()
+    )
+    assert response.status == HTTPStatus.SERVICE_UNAVAILABLE
+    assert "Retry-After" in response.headers
+
+
+@pytest.mark.asyncio
+async def test_status_of_unknown_payment(app):
+    test_client = SanicASGITestClient(app)
+    _, response = await test_client.get(
+        app.url_for(
+            f"{webhook_bp.name}.webhook_status",
+            transaction_id=str(uuid.uuid4()),
+        )
+    )
+    assert response.status == HTTPStatus.NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_concurrent_payments_to_one_account(app):
+    test_client = SanicASGITestClient(app)
+    balance_before = await account_balance(test_client)
+    payments = [
+        Payment.from_payload(WebhookPayload(**signed_payload(amount=1.25)))
+        for _ in range(50)
+    ]
+    statuses = await asyncio.gather(
+        *(apply_payment(app, p) for p in [*payments, payments[0]])
+    )
+    assert statuses == ["accepted"] * len(payments) + ["duplicate"]
+    assert await account_balance(test_client) - balance_before == Decimal(
+        "62.5"
+    )
+
+
+@pytest.mark.asyncio
+async def test_credit_statement_is_compiled_once(app):
+    engine = create_db_engine()
+    try:
+        async with engine.connect() as conn:
+            for expected in (CacheStats.CACHE_MISS, CacheStats.CACHE_HIT):
+                payment = Payment(
+                    uuid.uuid4(),
+                    testvars.USER_ID,
+                    testvars.ACCOUNT_ID,
+                    Decimal("1.25"),
+                )
+                result = await conn.execute(
+                    CREDIT_PAYMENT, payment._asdict()
+                )
+                assert result.context.cache_hit == expected
+                row = result.one()
+                assert row.valid
+                assert row.inserted
+                assert isinstance(row.balance, Decimal)
+            await conn.rollback()
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_batch_creating_account_races_single_payments():
+    # batch creating user's account and single payments to another account
+    # of the same user must lock rows in the same order, or they deadlock
+    engine = create_db_engine()
+    session = async_sessionmaker(bind=engine)
+
+    def payment(account_id):
+        return Payment(
+            uuid.uuid4(), testvars.USER_ID, account_id, Decimal("0.01")
+        )
+
+    async def single(p):
+        async with session() as s, s.begin():
+            return await credit_payment(s, p)
+
+    async def batch(payments):
+        async with session() as s, s.begin():
+            statuses = await apply_payments(s, payments)
+        return [statuses[p.transaction_id] for p in payments]
+
+    new_accounts = []
+    try:
+        for _ in range(20):
+            new_accounts.append(uuid.uuid4().int % 2**30 + 2**30)
+            results = await asyncio.gather(
+                batch(
+                    [payment(new_accounts[-1]), payment(testvars.ACCOUNT_ID)]
+                ),
+                *(single(payment(testvars.ACCOUNT_ID)) for _ in range(3)),
+            )
+            assert results == [["accepted"] * 2, *["accepted"] * 3]
+    finally:
+        async with session() as s, s.begin():
+            await s.execute(
+                delete(Transaction).where(
+                    Transaction.account_id.in_(new_accounts)
+                )
+            )
+            await s.execute(
+                delete(Account).where(Account.id.in_(new_accounts))
+            )
+        await engine.dispose()